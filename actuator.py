@@ -0,0 +1,219 @@
+"""
+Cursor actuator with swappable backends.
+
+CursorActuator moves the cursor from its own thread. Targets submitted while
+a move is in flight are coalesced to the newest one, targets in the same grid
+cell as the last move are skipped, and moves can optionally glide between
+cells at the display refresh rate.
+
+Backends:
+    pyautogui  the original path, with PyAutoGUI's per-call PAUSE sleep removed
+    xlib       warps the pointer directly through X11 (needs python-xlib)
+    uinput     absolute pointer device through Linux uinput (needs evdev)
+    null       records moves only, for tests and benchmarks
+"""
+
+import threading
+import time
+
+
+class PyAutoGuiBackend:
+    def __init__(self):
+        import pyautogui
+
+        # PAUSE sleeps 0.1 s after every call, which caps the update rate
+        pyautogui.PAUSE = 0
+        self.pyautogui = pyautogui
+
+    def size(self):
+        return tuple(self.pyautogui.size())
+
+    def move(self, x, y):
+        self.pyautogui.moveTo(x, y, _pause=False)
+
+
+class XlibBackend:
+    def __init__(self):
+        from Xlib import display
+
+        self.display = display.Display()
+        self.root = self.display.screen().root
+
+    def size(self):
+        screen = self.display.screen()
+        return screen.width_in_pixels, screen.height_in_pixels
+
+    def move(self, x, y):
+        self.root.warp_pointer(int(x), int(y))
+        self.display.flush()
+
+
+class UinputBackend:
+    def __init__(self, width=None, height=None):
+        from evdev import AbsInfo, UInput, ecodes
+
+        if width is None or height is None:
+            width, height = PyAutoGuiBackend().size()
+        self.width, self.height = width, height
+        self.ecodes = ecodes
+        capabilities = {
+            ecodes.EV_KEY: [ecodes.BTN_LEFT],
+            ecodes.EV_ABS: [
+                (ecodes.ABS_X, AbsInfo(0, 0, width - 1, 0, 0, 0)),
+                (ecodes.ABS_Y, AbsInfo(0, 0, height - 1, 0, 0, 0)),
+            ],
+        }
+        self.device = UInput(capabilities, name="eye-trackpad")
+
+    def size(self):
+        return self.width, self.height
+
+    def move(self, x, y):
+        self.device.write(self.ecodes.EV_ABS, self.ecodes.ABS_X, int(x))
+        self.device.write(self.ecodes.EV_ABS, self.ecodes.ABS_Y, int(y))
+        self.device.syn()
+
+
+class NullBackend:
+    def __init__(self, width=1920, height=1080):
+        self.width = width
+        self.height = height
+        self.moves = 0
+        self.position = (0, 0)
+
+    def size(self):
+        return self.width, self.height
+
+    def move(self, x, y):
+        self.moves += 1
+        self.position = (x, y)
+
+
+BACKENDS = {
+    "pyautogui": PyAutoGuiBackend,
+    "xlib": XlibBackend,
+    "uinput": UinputBackend,
+    "null": NullBackend,
+}
+
+
+def make_backend(name, **kwargs):
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown cursor backend {name!r}, choose from {list(BACKENDS)}"
+        )
+    return BACKENDS[name](**kwargs)
+
+
+class CursorActuator:
+    """
+    Moves the cursor on a background thread.
+
+    moveTo(x, y) never blocks: it replaces any pending target. With cellWidth
+    and cellHeight set, targets in the same grid cell as the last move are
+    dropped. With interpolate, the cursor glides toward the target in steps
+    at refreshRate Hz, covering `glide` of the remaining distance per step.
+    """
+
+    def __init__(
+        self,
+        backend,
+        cellWidth=None,
+        cellHeight=None,
+        interpolate=False,
+        refreshRate=60,
+        glide=0.5,
+    ):
+        self.backend = backend
+        self.cellWidth = cellWidth
+        self.cellHeight = cellHeight
+        self.interpolate = interpolate
+        self.period = 1.0 / refreshRate
+        self.glide = glide
+
+        self.cond = threading.Condition()
+        self.target = None
+        self.position = None
+        self.lastCell = None
+        self.running = False
+        self.thread = None
+
+        # counters
+        self.submitted = 0
+        self.skipped = 0
+        self.moves = 0
+
+    def size(self):
+        return self.backend.size()
+
+    def cell(self, x, y):
+        if self.cellWidth is None or self.cellHeight is None:
+            return (x, y)
+        return (int(x // self.cellWidth), int(y // self.cellHeight))
+
+    def moveTo(self, x, y, *args, **kwargs):
+        with self.cond:
+            self.submitted += 1
+            cell = self.cell(x, y)
+            if cell == self.lastCell:
+                self.skipped += 1
+                return
+            self.lastCell = cell
+            self.target = (x, y)
+            self.cond.notify()
+        if self.thread is None:
+            self.start()
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def next_target(self):
+        """
+        Waits for a pending target and takes it. Returns None on stop.
+        """
+        with self.cond:
+            while self.running and self.target is None:
+                self.cond.wait()
+            target, self.target = self.target, None
+            return target if self.running else None
+
+    def run(self):
+        while True:
+            target = self.next_target()
+            if target is None:
+                return
+            if not self.interpolate or self.position is None:
+                self.move(*target)
+                continue
+            # glide toward the newest target until it is reached
+            while True:
+                x, y = self.position
+                dx, dy = target[0] - x, target[1] - y
+                if abs(dx) < 1 and abs(dy) < 1:
+                    break
+                self.move(x + dx * self.glide, y + dy * self.glide)
+                time.sleep(self.period)
+                with self.cond:
+                    if not self.running:
+                        return
+                    if self.target is not None:
+                        target, self.target = self.target, None
+            self.move(*target)
+
+    def move(self, x, y):
+        self.backend.move(x, y)
+        self.position = (x, y)
+        self.moves += 1
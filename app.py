@@ -1,23 +1,42 @@
+import time
+
+START = time.perf_counter()
+
 import tkinter as tk
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
-from calibrate_frame import CalibrateScreen
-from mouse_controller import MouseController
-import pyautogui
-import cv2
-from GazeTracking.gaze_tracking import GazeTracking
-import numpy as np
+from startup import StartupLoader
+
+# cv2, numpy, pyautogui, GazeTracking and the calibration/controller modules
+# are imported lazily or by StartupLoader so the window appears right away
 
 
 class EyeTrackingApp(tk.Tk):
-    def __init__(self, root, gaze, webcam, theme="morph"):
+    def __init__(
+        self,
+        root,
+        loader,
+        theme="morph",
+        mappingModel="quadratic",
+        onReady=None,
+    ):
         self.root = root
-        self.gaze = gaze
-        self.webcam = webcam
+        self.loader = loader
+        self.onReady = onReady
+        self.gaze = None
+        self.webcam = None
         self.root.geometry("800x600")
         self.root.title("Eye Tracking App")
 
         self.xcoeff, self.ycoeff = None, None
+        self.mappingModel = mappingModel
+        self.mapper = None
+
+        # Saved calibration offered on the home screen, and the raw samples of
+        # a fresh calibration so it can be saved
+        self.profile = None
+        self.eyeData = None
+        self.dotPositions = None
 
         # Define styles
         self.style = ttk.Style(theme=theme)
@@ -42,8 +61,8 @@ class EyeTrackingApp(tk.Tk):
         # Initialize the home screen
         self.init_home_screen()
 
-        # Keybinds
-        self.root.bind("<space>", self.calibration_screen)
+        # Keybinds are added once the camera and eye tracker are loaded
+        self.root.after(50, self.check_ready)
 
     def init_home_screen(self):
         # Add labels to the home screen
@@ -53,16 +72,99 @@ class EyeTrackingApp(tk.Tk):
         ttk.Label(self.root, text="Start Calibration", style="Subtitle.TLabel").pack(
             pady=(100, 5)
         )
+        self.statusLabel = ttk.Label(
+            self.root,
+            text="Loading the camera and eye tracker...",
+            style="Instructions.TLabel",
+        )
+        self.statusLabel.pack(pady=5)
+
+    def check_ready(self):
+        """
+        Polls the startup loader and enables calibration once it is done.
+        """
+        if not self.loader.is_ready():
+            self.root.after(50, self.check_ready)
+            return
+        if self.loader.ok():
+            self.gaze = self.loader.gaze
+            self.webcam = self.loader.webcam
+            self.profile = self.loader.profile
+
+            self.statusLabel.configure(text="Press space bar to start.")
+            self.root.bind("<space>", self.calibration_screen)
+            if self.profile is not None:
+                self.init_profile_options()
+                self.root.bind("l", self.load_profile)
+                self.root.bind("v", self.validation_screen)
+        else:
+            self.statusLabel.configure(
+                text="Startup failed: " + "; ".join(self.loader.errors)
+            )
+        if self.onReady is not None:
+            self.onReady()
+
+    def init_profile_options(self):
+        saved = time.strftime("%d %b %Y %H:%M", time.localtime(self.profile["created"]))
+        ttk.Label(
+            self.root,
+            text=f"Calibration from {saved} found",
+            style="Subtitle.TLabel",
+        ).pack(pady=(40, 5))
         ttk.Label(
-            self.root, text="Press space bar to start.", style="Instructions.TLabel"
+            self.root,
+            text="Press L to use it, or V to check it with 3 dots first.",
+            style="Instructions.TLabel",
         ).pack(pady=5)
 
-    def calibration_screen(self, event=None):
-        # Clear the screen
+    def clear_screen(self):
+        self.root.unbind("l")
+        self.root.unbind("v")
         for widget in self.root.winfo_children():
             widget.destroy()
+
+    def load_profile(self, event=None):
+        """
+        Uses the saved calibration as is and skips straight to mouse control.
+        """
+        import numpy as np
+        from profiles import profile_mapper
+
+        self.mapper = profile_mapper(self.profile)
+        self.xcoeff = np.array(self.profile["xcoeff"])
+        self.ycoeff = np.array(self.profile["ycoeff"])
+        self.root.destroy()
+
+    def validation_screen(self, event=None):
+        """
+        Checks the saved calibration on a few dots. Falls back to the full
+        calibration if it is off.
+        """
+        from calibrate_frame import CalibrateScreen
+        from profiles import VALIDATION_DOTS
+
+        self.clear_screen()
+        CalibrateScreen(
+            self.root,
+            self.gaze,
+            self.webcam,
+            20,
+            20,
+            self,
+            self.mappingModel,
+            dotPositions=VALIDATION_DOTS,
+            validateProfile=self.profile,
+        )
+
+    def calibration_screen(self, event=None):
+        from calibrate_frame import CalibrateScreen
+
+        # Clear the screen
+        self.clear_screen()
         # Instantiate the Calibrate class
-        CalibrateScreen(self.root, self.gaze, self.webcam, 20, 20, self)
+        CalibrateScreen(
+            self.root, self.gaze, self.webcam, 20, 20, self, self.mappingModel
+        )
 
     # get xcoeff and ycoeff from CalibrateScreen
     def get_coeffs(self):
@@ -70,21 +172,175 @@ class EyeTrackingApp(tk.Tk):
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Eye controlled mouse.")
+    parser.add_argument("--record", help="save the webcam session to this directory")
+    parser.add_argument(
+        "--profile", help="write stage latencies to this .json/.csv on exit"
+    )
+    parser.add_argument(
+        "--cursor",
+        default="pyautogui",
+        choices=["pyautogui", "xlib", "uinput"],
+        help="how the cursor is moved",
+    )
+    parser.add_argument(
+        "--glide", action="store_true", help="glide the cursor between cells"
+    )
+    parser.add_argument(
+        "--overlay", action="store_true", help="show stage latencies on the video"
+    )
+    parser.add_argument(
+        "--drift",
+        action="store_true",
+        help="keep refining the calibration from clicks and R key dot prompts",
+    )
+    parser.add_argument(
+        "--detector",
+        default="dlib",
+        choices=["dlib", "haar"],
+        help="pupil detector, haar is faster on slow machines",
+    )
+    parser.add_argument(
+        "--pupil",
+        default="blob",
+        choices=["blob", "centroid"],
+        help="haar only: blob detector or the cheaper moments centroid",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        help="run pupil detection in this many worker processes",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="do less detection work while the eyes are fixating",
+    )
+    parser.add_argument(
+        "--control-port",
+        type=int,
+        help="after calibration, track headless with a control socket on this "
+        "port (see service.py) instead of the Esc key",
+    )
+    parser.add_argument(
+        "--telemetry",
+        metavar="URL",
+        help="send stage latencies to this webapp /telemetry endpoint",
+    )
+    parser.add_argument(
+        "--camera-config",
+        metavar="JSON",
+        help="camera resolution, fps, MJPG/YUYV format, buffer size and drain "
+        "mode (see capture.py)",
+    )
+    parser.add_argument(
+        "--snap",
+        action="store_true",
+        help="pull the cursor toward buttons and text found on the screen",
+    )
+    parser.add_argument(
+        "--startup-benchmark",
+        action="store_true",
+        help="print startup timings as JSON and exit once ready",
+    )
+    args = parser.parse_args()
+    if args.control_port is not None and args.processes:
+        # the service runs its own loops with detection in this process
+        parser.error("--processes can't be combined with --control-port")
+
     cellWidth = 20
     cellHeight = 20
-    screenWidth = pyautogui.size()[0]
-    screenHeight = pyautogui.size()[1]
-
-    gaze = GazeTracking()
-    webcam = cv2.VideoCapture(0)
 
     root = tk.Tk()
-    app = EyeTrackingApp(root, gaze, webcam)
+
+    from capture import load_config
+
+    try:
+        cameraConfig = load_config(args.camera_config)
+    except (OSError, ValueError) as e:
+        parser.error(f"--camera-config: {e}")
+
+    # Load the models and open the camera while the home screen is up; the
+    # screen size comes from pyautogui like in the calibration screen
+    loader = StartupLoader(
+        record=args.record,
+        detector=args.detector,
+        detectorParams={"method": args.pupil} if args.detector == "haar" else None,
+        cameraConfig=cameraConfig,
+    )
+    loader.start()
+
+    startupTimes = {"imports": time.perf_counter() - START}
+
+    def window_shown():
+        startupTimes["window"] = time.perf_counter() - START
+
+    def startup_ready():
+        startupTimes["ready"] = time.perf_counter() - START
+        if args.startup_benchmark:
+            import json
+
+            startupTimes["loader"] = loader.timings
+            startupTimes["errors"] = loader.errors
+            print(json.dumps(startupTimes))
+            root.destroy()
+
+    root.after_idle(window_shown)
+    app = EyeTrackingApp(root, loader, onReady=startup_ready)
     root.mainloop()
+
+    loader.ready.wait()
+    gaze, webcam = loader.gaze, loader.webcam
+    screenWidth, screenHeight = loader.screenWidth, loader.screenHeight
     xcoeff, ycoeff = app.get_coeffs()
 
+    # Save a fresh calibration for next time
+    if app.eyeData is not None and xcoeff is not None:
+        from profiles import build_profile, camera_settings
+
+        loader.profileStore.save(
+            build_profile(
+                loader.user,
+                loader.camera,
+                xcoeff,
+                ycoeff,
+                app.eyeData,
+                app.dotPositions,
+                screenWidth,
+                screenHeight,
+                cellWidth,
+                cellHeight,
+                app.mappingModel,
+                camera_settings(webcam),
+                gaze.settings() if hasattr(gaze, "settings") else None,
+            )
+        )
+
     # Start tracking
-    if np.all(xcoeff is not None) and np.all(ycoeff is not None):
+    if xcoeff is not None and ycoeff is not None:
+        from mouse_controller import MouseController
+
+        snapper = None
+        if args.snap:
+            from screen_targets import ScreenTargetProvider
+            from snapping import TargetSnapper
+
+            snapper = TargetSnapper()
+            targets = ScreenTargetProvider(onTargets=snapper.set_targets)
+            targets.start()
+
+        profiler = reporter = None
+        if args.telemetry:
+            from instrumentation import StageProfiler
+            from telemetry_reporter import TelemetryReporter
+
+            profiler = StageProfiler(enabled=True)
+            reporter = TelemetryReporter(profiler, args.telemetry)
+            reporter.start()
+
         app = MouseController(
             xcoeff,
             ycoeff,
@@ -94,7 +350,32 @@ if __name__ == "__main__":
             cellHeight,
             screenWidth,
             screenHeight,
+            threaded=True,
+            mapper=app.mapper,
+            profileOutput=args.profile,
+            debugOverlay=args.overlay,
+            cursorBackend=args.cursor,
+            interpolate=args.glide,
+            driftCorrection=args.drift,
+            snapper=snapper,
+            processes=args.processes,
+            adaptive=args.adaptive,
+            detector=args.detector,
+            detectorParams=loader.detectorParams,
+            autostart=args.control_port is None,
+            profiler=profiler,
         )
+        if args.control_port is not None:
+            from service import GazeService
+
+            GazeService(app, port=args.control_port).run()
+        if snapper is not None:
+            targets.stop()
+        if reporter is not None:
+            reporter.stop()
+
+    if webcam is not None:
+        import cv2
 
-    webcam.release()
-    cv2.destroyAllWindows()
+        webcam.release()
+        cv2.destroyAllWindows()
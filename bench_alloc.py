@@ -0,0 +1,131 @@
+"""
+Memory benchmark for the frame buffer reuse in buffers.py.
+
+Runs the capture and Haar detection path over a recorded session twice per
+config: once under tracemalloc, recording how much memory each frame
+allocates on top of what is live when it starts (its transient peak), and
+once untraced for the time per frame and the garbage collections. The
+"allocating" config reads every frame into a new array and lets OpenCV
+allocate every intermediate image, "pooled" reads into a FrameRing and
+writes them into the detector's BufferPool.
+
+Usage:
+    python bench_alloc.py session/
+    python bench_alloc.py session/ --frames 1000 --method centroid
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from buffers import FrameRing
+from detectors import HaarDetector
+from replay import ReplayCapture
+
+CONFIGS = {
+    "allocating": False,
+    "pooled": True,
+}
+
+
+class GcCounter:
+    """
+    Counts garbage collections per generation while installed.
+    """
+
+    def __init__(self):
+        self.counts = [0, 0, 0]
+
+    def __call__(self, phase, info):
+        if phase == "start":
+            self.counts[info["generation"]] += 1
+
+    def __enter__(self):
+        gc.callbacks.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        gc.callbacks.remove(self)
+
+
+def run(webcam, reuse, frames, warmup, method, traced):
+    """
+    Returns the per frame transient bytes (if traced) and seconds.
+    """
+    detector = HaarDetector(method=method, reuseBuffers=reuse)
+    ring = FrameRing(1) if reuse else None
+    transient, seconds = [], []
+    for index in range(warmup + frames):
+        if traced:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        ret, frame = ring.read(webcam) if reuse else webcam.read()
+        if not ret:
+            break
+        detector.refresh(frame)
+        if reuse:
+            ring.release(frame)
+        elapsed = time.perf_counter() - start
+        if index < warmup:
+            continue
+        seconds.append(elapsed)
+        if traced:
+            transient.append(tracemalloc.get_traced_memory()[1] - current)
+    return np.array(transient), np.array(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("session", help="recorded session from replay.py")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--method", choices=["blob", "centroid"], default="blob")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    webcam = ReplayCapture(args.session, loop=True, preload=True)
+    width = int(webcam.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(webcam.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    print(f"{args.frames} frames of {width}x{height}, {args.method} pupils\n")
+
+    results = {name: {"transient": [], "seconds": [], "gc": []} for name in CONFIGS}
+    # interleaved so both configs see the same machine state
+    for _ in range(args.rounds):
+        for name, reuse in CONFIGS.items():
+            tracemalloc.start()
+            transient, _ = run(
+                webcam, reuse, args.frames, args.warmup, args.method, True
+            )
+            tracemalloc.stop()
+            gc.collect()
+            with GcCounter() as collections:
+                _, seconds = run(
+                    webcam, reuse, args.frames, args.warmup, args.method, False
+                )
+            results[name]["transient"].append(transient)
+            results[name]["seconds"].append(seconds)
+            results[name]["gc"].append(collections.counts)
+
+    print(
+        f"{'config':>11} {'KiB/frame':>10} {'max KiB':>8} {'ms/frame':>9} "
+        f"{'p99 ms':>7} {'max ms':>7} {'gc 0/1/2':>10}"
+    )
+    for name, result in results.items():
+        transient = np.concatenate(result["transient"]) / 1024
+        # the best round's timings, the others are noise on a busy machine
+        seconds = min(result["seconds"], key=np.mean) * 1000
+        counts = np.sum(result["gc"], axis=0) // args.rounds
+        print(
+            f"{name:>11} {np.median(transient):>10.1f} {transient.max():>8.0f} "
+            f"{seconds.mean():>9.2f} {np.percentile(seconds, 99):>7.2f} "
+            f"{seconds.max():>7.2f} {'/'.join(str(c) for c in counts):>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
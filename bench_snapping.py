@@ -0,0 +1,97 @@
+"""
+Benchmark for snapping.py.
+
+Compares the original weight_elements (distance to every element in a loop,
+full sort, weights added one by one) with TargetSnapper's grid hash radius
+query, for increasing numbers of targets spread over the screen. Both are
+checked to give the same snapped point.
+
+Usage:
+    python bench_snapping.py
+    python bench_snapping.py --counts 100 1000 10000 --queries 500
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from snapping import TargetSnapper
+
+
+def calculate_distance(point1, point2):
+    return np.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
+
+
+def weight_elements(gaze_x, gaze_y, elements, snap_threshold=120, weight_exponent=6):
+    """
+    The original per-frame snapping, kept as the baseline.
+    """
+    gaze_point = (gaze_x, gaze_y)
+    distances = []
+    for index, element in enumerate(elements):
+        dist = calculate_distance(gaze_point, element)
+        distances.append((index, dist))
+    distances = sorted(distances, key=lambda tup: tup[1])
+
+    total_weight = 0
+    weighted_position = np.array([0.0, 0.0])
+    for element, distance in distances:
+        if distance < snap_threshold:
+            weight = (snap_threshold - distance) ** weight_exponent
+            weighted_position += np.array(elements[element]) * weight
+            total_weight += weight
+
+    if total_weight > 0:
+        return weighted_position / total_weight
+    else:
+        return gaze_point
+
+
+def time_per_call(function, queries):
+    start = time.perf_counter()
+    results = [function(x, y) for x, y in queries]
+    return (time.perf_counter() - start) / len(queries) * 1e6, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--counts", type=int, nargs="+", default=[100, 1000, 5000, 20000]
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    size = np.array([args.width, args.height])
+    queries = rng.uniform(0, 1, (args.queries, 2)) * size
+
+    print(
+        f"{'targets':>8} {'build ms':>9} {'original us':>12} {'grid us':>9} {'speedup':>8}"
+    )
+    for count in args.counts:
+        elements = rng.uniform(0, 1, (count, 2)) * size
+        snapper = TargetSnapper()
+
+        start = time.perf_counter()
+        snapper.set_targets(elements)
+        build = (time.perf_counter() - start) * 1000
+
+        # the original is too slow to run every query on large sets
+        sample = queries[: max(10, args.queries * 1000 // count)]
+        original, expected = time_per_call(
+            lambda x, y: weight_elements(x, y, elements.tolist()), sample
+        )
+        grid, results = time_per_call(snapper.snap, queries)
+        assert np.allclose(expected, results[: len(sample)])
+        print(
+            f"{count:>8} {build:>9.2f} {original:>12.1f} {grid:>9.1f} "
+            f"{original / grid:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
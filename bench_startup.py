@@ -0,0 +1,120 @@
+"""
+Startup benchmark for app.py.
+
+Measures the cold import time of each heavy module in a fresh interpreter,
+then launches `app.py --startup-benchmark` and reports how long it took for
+the home screen to appear and for the camera and eye tracker to be ready.
+The second part needs a display (use xvfb-run on CI).
+
+Usage:
+    python bench_startup.py
+    python bench_startup.py --repeat 5 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = [
+    "tkinter",
+    "ttkbootstrap",
+    "numpy",
+    "cv2",
+    "pyautogui",
+    "GazeTracking.gaze_tracking",
+    "calibrate_frame",
+    "mouse_controller",
+    "app",
+]
+
+
+def import_time(module):
+    """
+    Returns the import time of module in a fresh interpreter, in ms, or None
+    if it failed to import.
+    """
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1]) * 1000
+
+
+def app_startup(timeout):
+    """
+    Runs app.py until it is ready and returns its timings in ms.
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "app.py", "--startup-benchmark"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+    )
+    wall = (time.perf_counter() - start) * 1000
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith("{"):
+            times = json.loads(line)
+            break
+    else:
+        return {"error": result.stderr.strip().splitlines()[-1:]}
+    return {
+        "imports_ms": times["imports"] * 1000,
+        "window_ms": times.get("window", 0) * 1000,
+        "ready_ms": times["ready"] * 1000,
+        "process_ms": wall,
+        "loader_ms": {k: v * 1000 for k, v in times["loader"].items()},
+        "errors": times["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--skip-app", action="store_true", help="imports only")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {"imports": {}}
+    print("cold import times (median of %d)" % args.repeat)
+    for module in MODULES:
+        times = [import_time(module) for _ in range(args.repeat)]
+        if None in times:
+            print(f"  {module:28s}   failed")
+            results["imports"][module] = None
+            continue
+        median = statistics.median(times)
+        results["imports"][module] = median
+        print(f"  {module:28s} {median:8.1f} ms")
+
+    if not args.skip_app:
+        runs = [app_startup(args.timeout) for _ in range(args.repeat)]
+        results["app"] = runs
+        good = [run for run in runs if "error" not in run]
+        if not good:
+            print("app.py failed to start:", runs[0]["error"])
+        else:
+            print("app.py startup (median of %d)" % len(good))
+            for key in ("imports_ms", "window_ms", "ready_ms", "process_ms"):
+                print(f"  {key:28s} {statistics.median(r[key] for r in good):8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
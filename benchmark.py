@@ -0,0 +1,207 @@
+"""
+End-to-end benchmark of the mouse controller on a recorded session.
+
+Runs MouseController over a replay.ReplayCapture with a null cursor for each
+pipeline configuration and reports frames/sec and capture-to-cursor latency
+percentiles. Needs no camera or display, so it can run on CI.
+
+Frames are replayed at the recorded frame rate like a real camera. --unpaced
+feeds them as fast as they are read instead, which measures the peak rate of
+the serial configs; threaded configs drop most frames in that mode by design.
+The pool configs are timed from when their workers are ready; the time to
+spawn them and load the models is reported separately as spawn_s.
+
+Usage:
+    python replay.py session/ --seconds 20       # record once
+    python benchmark.py session/
+    python benchmark.py session/ --configs serial threaded+roi --json out.json
+"""
+
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from instrumentation import StageProfiler
+from replay import ReplayCapture
+
+# name -> MouseController options
+CONFIGS = {
+    "serial": {"threaded": False},
+    "serial+roi": {"threaded": False, "faceTracking": True},
+    "serial+adaptive": {"threaded": False, "faceTracking": True, "adaptive": True},
+    "threaded": {"threaded": True},
+    "threaded+roi": {"threaded": True, "faceTracking": True},
+    "pool": {"threaded": True, "processes": 4},
+    "pool+roi": {"threaded": True, "processes": 4, "faceTracking": True},
+}
+
+
+def make_controller(webcam, options, smoothing, detector="dlib"):
+    from detectors import make_detector
+    from mouse_controller import MouseController
+
+    gaze = make_detector(detector, faceTracking=options.get("faceTracking", False))
+
+    width, height = 1920, 1080
+    controller = MouseController(
+        [0, 1, 0],
+        [0, 1, 0],
+        gaze,
+        webcam,
+        20,
+        20,
+        width,
+        height,
+        threaded=options["threaded"],
+        smoothing=smoothing,
+        cursorBackend="null",
+        autostart=False,
+        profiler=StageProfiler(enabled=True),
+        adaptive=options.get("adaptive", False),
+    )
+    # identity mapping over the frame, compiled like a calibrated one
+    frameSize = (
+        webcam.get(cv2.CAP_PROP_FRAME_WIDTH),
+        webcam.get(cv2.CAP_PROP_FRAME_HEIGHT),
+    )
+    controller.mapper.compile((0, 0), frameSize)
+    return controller
+
+
+def run_serial(controller):
+    latencies = []
+    frames = 0
+    while True:
+        ret, frame = controller.webcam.read()
+        if not ret:
+            break
+        start = time.perf_counter()
+        frames += 1
+        target = controller.processFrame(frame, start)
+        if target is not None:
+            controller.moveCursor(target, start)
+            latencies.append(time.perf_counter() - start)
+    return frames, latencies
+
+
+def run_threaded(controller):
+    from pipeline import GazePipeline
+
+    pipeline = GazePipeline(
+        controller.webcam,
+        controller.processFrame,
+        controller.moveCursor,
+        profiler=controller.profiler,
+    )
+    pipeline.run()
+    frames = pipeline.stats["inference"].count
+    return frames, list(pipeline.latencies)
+
+
+def run_pool(controller, options, detector):
+    """
+    Returns the frames, latencies, seconds run once the workers were ready
+    and seconds spent starting them.
+    """
+    from procpool import ProcessPipeline
+
+    pipeline = ProcessPipeline(
+        controller.webcam,
+        controller.processPupils,
+        controller.moveCursor,
+        workers=options["processes"],
+        detector=detector,
+        detectorParams={"faceTracking": options.get("faceTracking", False)},
+        profiler=controller.profiler,
+    )
+    spawn = time.perf_counter()
+    # returns once every worker has loaded its detector; the replay clock
+    # starts with the first frame read after that
+    pipeline.start()
+    start = time.perf_counter()
+    try:
+        pipeline.wait()
+    finally:
+        pipeline.stop()
+    elapsed = time.perf_counter() - start
+    frames = pipeline.stats["inference"].count
+    return frames, list(pipeline.latencies), elapsed, start - spawn
+
+
+def run_config(name, args):
+    webcam = ReplayCapture(args.session, realtime=not args.unpaced, preload=True)
+    controller = make_controller(webcam, CONFIGS[name], args.smoothing, args.detector)
+    spawn = None
+    start = time.perf_counter()
+    if CONFIGS[name].get("processes"):
+        frames, latencies, elapsed, spawn = run_pool(
+            controller, CONFIGS[name], args.detector
+        )
+    elif CONFIGS[name]["threaded"]:
+        frames, latencies = run_threaded(controller)
+        elapsed = time.perf_counter() - start
+    else:
+        frames, latencies = run_serial(controller)
+        elapsed = time.perf_counter() - start
+    controller.cursor.stop()
+    webcam.release()
+
+    latencies = np.array(latencies) * 1000
+    result = {
+        "config": name,
+        "frames": frames,
+        "moves": controller.cursor.moves,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+    }
+    if spawn is not None:
+        result["spawn_s"] = spawn
+    for p in (50, 90, 99):
+        result[f"p{p}_ms"] = (
+            float(np.percentile(latencies, p)) if len(latencies) else 0.0
+        )
+    result["stages"] = controller.profiler.summary()
+    result["work"] = dict(controller.work)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("session", help="recorded session directory")
+    parser.add_argument(
+        "--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS)
+    )
+    parser.add_argument("--smoothing", default="average")
+    parser.add_argument("--detector", default="dlib", choices=["dlib", "haar"])
+    parser.add_argument(
+        "--unpaced",
+        action="store_true",
+        help="replay as fast as possible instead of at the recorded frame rate",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'config':14s} {'frames':>7s} {'moves':>7s} {'fps':>7s} "
+        f"{'p50 ms':>7s} {'p90 ms':>7s} {'p99 ms':>7s}"
+    )
+    for name in args.configs:
+        r = run_config(name, args)
+        results.append(r)
+        print(
+            f"{r['config']:14s} {r['frames']:7d} {r['moves']:7d} {r['fps']:7.1f} "
+            f"{r['p50_ms']:7.2f} {r['p90_ms']:7.2f} {r['p99_ms']:7.2f}"
+        )
+        if "spawn_s" in r:
+            print(f"{'':14s} workers took {r['spawn_s']:.1f} s to start, not counted")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
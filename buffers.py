@@ -0,0 +1,86 @@
+"""
+Reusable image buffers for the capture and tracking loops.
+
+A webcam read, a gray conversion or a morphology step each allocate a new
+array when called without a destination, which at 30 fps is a steady stream
+of short lived megabyte buffers. BufferPool keeps named scratch arrays for
+OpenCV's dst arguments and FrameRing a few frames for the camera to read
+into, so once warmed up a frame costs no new image memory.
+"""
+
+import collections
+import math
+import threading
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    Named scratch buffers reused across frames. get(name, shape) returns a
+    contiguous array of that shape in memory kept from earlier calls, and
+    only allocates when the buffer has to grow, with some headroom since eye
+    crops change size by a few pixels from frame to frame.
+
+    A pool belongs to one thread, and what get returns is only valid until
+    the next get with the same name.
+    """
+
+    def __init__(self, headroom=1.25):
+        self.headroom = headroom
+        self.buffers = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        dtype = np.dtype(dtype)
+        size = math.prod(shape) * dtype.itemsize
+        backing = self.buffers.get(name)
+        if backing is None or backing.size < size:
+            backing = np.empty(int(size * self.headroom), np.uint8)
+            self.buffers[name] = backing
+            self.allocations += 1
+        return backing[:size].view(dtype).reshape(shape)
+
+
+def scratch(pool, name, shape, dtype=np.uint8):
+    """
+    A buffer from pool, or None (let OpenCV allocate) without one.
+    """
+    if pool is None:
+        return None
+    return pool.get(name, shape, dtype)
+
+
+class FrameRing:
+    """
+    Up to slots frame buffers the camera reads into in turn.
+
+    read(webcam) fills a free buffer through read(image=...), and the frame
+    belongs to the caller until it is handed back with release(frame), so a
+    buffer is never overwritten while a later stage still uses it. When none
+    is free (at startup, or when every frame is still held) the camera
+    allocates one as usual, and release keeps at most slots of them.
+    """
+
+    def __init__(self, slots=3):
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.free = collections.deque()
+        self.misses = 0
+
+    def read(self, webcam):
+        with self.lock:
+            buffer = self.free.popleft() if self.free else None
+        if buffer is None:
+            self.misses += 1
+            return webcam.read()
+        # a capture that changed size allocates a new frame, the old buffer
+        # is simply dropped
+        return webcam.read(image=buffer)
+
+    def release(self, frame):
+        if frame is None:
+            return
+        with self.lock:
+            if len(self.free) < self.slots:
+                self.free.append(frame)
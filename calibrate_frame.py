@@ -4,17 +4,35 @@ Check the README.md for complete documentation.
 """
 
 import cv2
-from GazeTracking.gaze_tracking import GazeTracking
 import tkinter as tk
 import ttkbootstrap as ttk
 import threading
+import time
 import pyautogui
 import numpy as np
-import time
+from buffers import FrameRing
+from capture import frame_time
+from collector import CONVERGED, FAILED, CalibrationCollector, DotDwell
+from mapping import MappingEngine, SeparableQuadratic, make_model
+from profiles import CALIBRATION_DOTS, profile_mapper
 
 
 class CalibrateScreen(tk.Frame):
-    def __init__(self, window, gazeObject, camObject, cellWidth, cellHeight, app):
+    def __init__(
+        self,
+        window,
+        gazeObject,
+        camObject,
+        cellWidth,
+        cellHeight,
+        app,
+        mappingModel="quadratic",
+        dotPositions=None,
+        validateProfile=None,
+        validationTolerance=3,
+        dwellParams=None,
+        maxAttempts=3,
+    ):
         self.window = window
         self.window.attributes("-fullscreen", True)
         self.app = app
@@ -37,6 +55,12 @@ class CalibrateScreen(tk.Frame):
         self.screenHeight = pyautogui.size()[1]
         self.xcoeffs = 0
         self.ycoeffs = 0
+        self.mappingModel = mappingModel
+
+        # When checking a saved profile only a few dots are shown and the
+        # profile is accepted if its mean error is within the tolerance (cells)
+        self.validateProfile = validateProfile
+        self.validationTolerance = validationTolerance
 
         # Instructions message
         self.display_instructions()
@@ -44,37 +68,39 @@ class CalibrateScreen(tk.Frame):
         # Corner dots information
         self.dotSize = 20
         self.currentPosition = 0
-        self.dotPositions = [
-            (0.5, 0.05),  # Top-left corner
-            (0.5, 0.25),
-            (0.5, 0.5),  # Center
-            (0.5, 0.75),
-            (0.5, 0.95),  # Top-right corner
-            (0.05, 0.5),  # Bottom-left corner
-            (0.25, 0.5),
-            (0.5, 0.5),
-            (0.75, 0.5),
-            (0.95, 0.5),  # Bottom-right corner
-        ]
-        self.eyeData = [[] for _ in range(len(self.dotPositions))]
+        self.dotPositions = list(dotPositions or CALIBRATION_DOTS)
+        self.gridWidth = self.screenWidth // self.cellWidth
+        self.gridHeight = self.screenHeight // self.cellHeight
+        self.collector = CalibrationCollector(
+            self.dotPositions, self.gridWidth, self.gridHeight
+        )
         self.dotShowing = False
         self.initialize_dots_as_circles()
 
+        # Each dot is collected until the mean pupil position has settled
+        # (see collector.DotDwell); an unsteady dot is shown again up to
+        # maxAttempts times
+        self.dwell = DotDwell(**(dwellParams or {}))
+        self.maxAttempts = maxAttempts
+        self.dwellTimes = []
+        self.bestEffortDots = 0
+
         # Initialize gaze tracking
         self.gaze = gazeObject
         self.webcam = camObject
+        # every frame is read into the same buffer
+        self.frames = FrameRing(1)
 
-        # Create a thread to track the gaze
-        self.collectData = False
+        # Create a thread to track the gaze, it sleeps until collecting is set
+        self.collecting = threading.Event()
         self.calibrate = True
         self.gazeThread = threading.Thread(target=self.track_gaze, daemon=False)
         self.gazeThread.start()
-        self.lock = threading.Lock()
         self.failCollection = 0
 
-        # Timing variables
+        # Timing variables (ms): pause between dots, dwell polling
         self.timeDelay = 500
-        self.timeCollection = 3000
+        self.pollInterval = 50
 
     def display_instructions(self):
         """
@@ -89,7 +115,7 @@ class CalibrateScreen(tk.Frame):
         labelTop.place(x=100, y=50)
         labelBottom = ttk.Label(
             self.app.root,
-            text="Press space to continue.                           ",
+            text="Press space to start.                              ",
             style="ItalicInfo.TLabel",
         )
         labelBottom.place(x=100, y=100)
@@ -127,133 +153,214 @@ class CalibrateScreen(tk.Frame):
     def dot_on(self, event=None):
         """
         Starts measuring at current dot and signals for gaze tracking.
+        Space starts the first dot, the others come on by themselves.
         """
+        if self.dotShowing:
+            return
         if self.currentPosition == len(self.dotPositions):
             self.window.unbind("<space>")
             return
-        # current position on the screen
-        x = self.width * self.dotPositions[self.currentPosition][0]
-        y = self.height * self.dotPositions[self.currentPosition][1]
 
         # Make dot yellow and start gaze tracking collection
         self.create_dot(self.currentPosition, fill="yellow")
-        self.collectData = True
-
+        self.label_frames(self.currentPosition)
+        self.dwell.start()
         self.dotShowing = True  # turns on gaze tracking
-        self.window.after(2000, self.dot_off)
+        self.collecting.set()
+        self.window.after(self.pollInterval, self.dot_check)
+
+    def dot_check(self):
+        """
+        Waits for the current dot to converge or fail.
+        """
+        state = self.dwell.poll(self.collector.dot_samples(self.currentPosition))
+        if state == CONVERGED:
+            self.dot_off()
+        elif state == FAILED:
+            self.dot_failed()
+        else:
+            self.window.after(self.pollInterval, self.dot_check)
 
     def dot_off(self, event=None):
         """
-        After 2 seconds, turns off measuring at dot and stops gaze tracking.
-        Changes dot to green color and next dot to red color.
+        Once the dot converged, turns off measuring at dot and stops gaze
+        tracking. Changes dot to green color and shows the next dot.
         """
-        with self.lock:
-            if len(self.eyeData[self.currentPosition]) > 5:
-                self.collectData = False
-                self.failCollection = 0
-
-                self.currentPosition += 1
-                self.dotShowing = False  # turns off gaze tracking
-                self.create_dot(self.currentPosition - 1, fill="green")
-
-                # make next one red
-                if self.currentPosition != len(self.dotPositions):
-                    self.create_dot(self.currentPosition, fill="red")
-                else:
-                    self.calibrate = False
-                    self.window.attributes("-fullscreen", False)
-                    self.window.destroy()
-                    self.exit_fullscreen()
-            elif self.failCollection < 10:
-                print("not enough data collected, waiting...")
-                self.failCollection += 1
-                self.window.after(500, self.dot_off)
-            else:
-                print("Failed calibration. Please try again with different lighting.")
-                self.calibrate = False
-                self.window.attributes("-fullscreen", False)
-                self.window.destroy()
-                self.webcam.release()
-                cv2.destroyAllWindows()
-                self.exit_fullscreen()
+        self.collecting.clear()
+        self.label_frames(None)
+        self.failCollection = 0
+        self.dwellTimes.append(self.dwell.elapsed())
+        self.bestEffortDots += self.dwell.bestEffort
+
+        self.currentPosition += 1
+        self.dotShowing = False  # turns off gaze tracking
+        self.create_dot(self.currentPosition - 1, fill="green")
+
+        # make next one red and start it after a short pause
+        if self.currentPosition != len(self.dotPositions):
+            self.create_dot(self.currentPosition, fill="red")
+            self.window.after(self.timeDelay, self.dot_on)
+            return
+        print(
+            f"calibrated in {sum(self.dwellTimes):.1f} s, per dot: "
+            + ", ".join(f"{t:.1f}" for t in self.dwellTimes)
+            + (
+                f" ({self.bestEffortDots} did not fully settle)"
+                if self.bestEffortDots
+                else ""
+            )
+        )
+        if self.validateProfile is not None and not self.check_profile():
+            # saved profile is off, fall back to the full calibration
+            self.stop_tracking()
+            self.app.calibration_screen()
+        else:
+            self.stop_tracking()
+            self.window.attributes("-fullscreen", False)
+            self.window.destroy()
+            self.exit_fullscreen()
+
+    def dot_failed(self):
+        """
+        The gaze didn't settle on the dot in time: drops its samples and
+        shows it again, up to maxAttempts times.
+        """
+        self.collecting.clear()
+        self.label_frames(None)
+        self.dotShowing = False
+        self.collector.discard(self.currentPosition)
+        self.failCollection += 1
+        if self.failCollection < self.maxAttempts:
+            print("gaze not steady on the dot, trying it again...")
+            self.create_dot(self.currentPosition, fill="red")
+            self.window.after(self.timeDelay, self.dot_on)
+        else:
+            print("Failed calibration. Please try again with different lighting.")
+            self.abort()
+
+    def stop_tracking(self):
+        """
+        Ends the gaze thread, waking it if it is waiting for a dot.
+        """
+        self.calibrate = False
+        self.collecting.set()
+
+    def abort(self):
+        self.stop_tracking()
+        self.window.attributes("-fullscreen", False)
+        self.window.destroy()
+        self.webcam.release()
+        cv2.destroyAllWindows()
+        self.exit_fullscreen()
+
+    def label_frames(self, label):
+        """
+        Tags recorded frames with the current dot when the camera is a
+        replay.RecordingCapture.
+        """
+        if hasattr(self.webcam, "set_label"):
+            self.webcam.set_label(label)
 
     def track_gaze(self):
         """
         Tracks the gaze of the user and records the pupil position data.
+        Blocks on the collecting event between dots instead of polling.
         """
 
-        while self.calibrate:
-            if self.collectData:
-                ret, frame = self.webcam.read()
-                if not ret or frame is None:
-                    print("Error getting frames.")
-                    self.calibrate = False
-                    self.window.attributes("-fullscreen", False)
-                    self.window.destroy()
-                    self.webcam.release()
-                    cv2.destroyAllWindows()
-                    self.exit_fullscreen()
-                    break
-                self.gaze.refresh(frame)
-
-                left_pupil = self.gaze.pupil_left_coords()
-                right_pupil = self.gaze.pupil_right_coords()
-
-                if (
-                    left_pupil
-                    and right_pupil
-                    and self.currentPosition < len(self.dotPositions)
-                ):
-                    # Record the average gaze position
-                    avgGaze = [
-                        (left_pupil[0] + right_pupil[0]) / 2,
-                        (left_pupil[1] + right_pupil[1]) / 2,
-                    ]
-                    with self.lock:
-                        self.eyeData[self.currentPosition].append(avgGaze)
-                        print(self.eyeData)
-            else:
-                time.sleep(0.1)
+        while True:
+            self.collecting.wait()
+            if not self.calibrate:
+                break
+            # the dot the frame belongs to, dot_off may move on meanwhile,
+            # and the attempt at it, which dot_failed ends by discarding it
+            dot = self.currentPosition
+            attempt = (
+                self.collector.attempt(dot) if dot < len(self.dotPositions) else None
+            )
+            ret, frame = self.frames.read(self.webcam)
+            if not ret or frame is None:
+                print("Error getting frames.")
+                self.calibrate = False
+                # tkinter calls have to happen on the GUI thread
+                self.window.after(0, self.abort)
+                break
+            stamp = frame_time(self.webcam, time.perf_counter())
+            self.gaze.refresh(frame)
+            self.frames.release(frame)
+
+            left_pupil = self.gaze.pupil_left_coords()
+            right_pupil = self.gaze.pupil_right_coords()
+
+            if (
+                left_pupil
+                and right_pupil
+                and self.dotShowing
+                and dot == self.currentPosition
+                and dot < len(self.dotPositions)
+            ):
+                # Record the average gaze position once the eyes settled on
+                # the dot, the samples before are the eyes moving to it
+                x = (left_pupil[0] + right_pupil[0]) / 2
+                y = (left_pupil[1] + right_pupil[1]) / 2
+                if self.dwell.fixating(x, y, stamp):
+                    self.collector.add(dot, x, y, attempt)
         print("done")
 
     def exit_fullscreen(self, event=None):
         # mappingfunction
-        if self.failCollection == 0:
+        if self.failCollection == 0 and self.validateProfile is None:
             # code for calculating coefficients....
 
             self.calculateFunctionGrid()
 
         # stop thread
-        self.calibrate = False
+        self.stop_tracking()
         # if self.gazeThread.is_alive():
         #     self.gazeThread.join()
 
     def calculateFunctionGrid(self):
-        # setup grid
-        gridWidth = self.screenWidth // self.cellWidth
-        gridHeight = self.screenHeight // self.cellHeight
-
-        # stack the eye data for each dot
-        data = np.vstack(self.eyeData)
-        x_eye = data[:, 0]
-        y_eye = x_eye = data[:, 1]
-
-        # stack the targets data
-        targets = []
-        for i in range(len(self.dotPositions)):
-            xPix = int(self.dotPositions[i][0] * gridWidth)  # x
-            yPix = int(self.dotPositions[i][1] * gridHeight)  # y
-            for j in range(len(self.eyeData[i])):
-                targets.append([xPix, yPix])
-        targets = np.array(targets)
-        x_pixel = np.array(targets[:, 0])
-        y_pixel = np.array(targets[:, 1])
-
-        # calculate polyfit
-        self.app.xcoeff = np.polyfit(x_eye, x_pixel, 2)
-        self.app.ycoeff = np.polyfit(y_eye, y_pixel, 2)
-        print(x_eye)
-        print(y_eye)
-        print(x_pixel)
-        print(y_pixel)
+        # the collector has kept the quadratic fit up to date while collecting
+        self.app.xcoeff, self.app.ycoeff = self.collector.coefficients()
         print(f"{self.app.xcoeff}, {self.app.ycoeff}")
+        print(f"rejected outliers per dot: {self.collector.rejected.tolist()}")
+
+        data, targets = self.collector.data()
+        if self.mappingModel == "quadratic":
+            # only the lookup table is left to build
+            self.app.mapper = MappingEngine(
+                SeparableQuadratic.from_coeffs(self.app.xcoeff, self.app.ycoeff),
+                self.gridWidth,
+                self.gridHeight,
+            ).compile(data.min(axis=0), data.max(axis=0))
+        else:
+            # fit the selected model and compile it into a lookup table
+            self.app.mapper = MappingEngine(
+                make_model(self.mappingModel), self.gridWidth, self.gridHeight
+            ).fit(data, targets)
+
+        # keep the accepted samples so the calibration can be saved as a profile
+        self.app.eyeData = self.collector.eye_data()
+        self.app.dotPositions = self.dotPositions
+
+    def check_profile(self):
+        """
+        Checks the saved profile against the validation dots. If the mean
+        error is within validationTolerance cells the profile's mapping is
+        handed to the app and True is returned.
+        """
+        profile = self.validateProfile
+        mapper = profile_mapper(profile)
+        errors = []
+        for dot, (dotX, dotY) in enumerate(self.dotPositions):
+            x, y = np.median(self.collector.dot_samples(dot), axis=0)
+            column, row = mapper.cell(x, y)
+            target = (int(dotX * mapper.gridWidth), int(dotY * mapper.gridHeight))
+            errors.append(np.hypot(column - target[0], row - target[1]))
+        error = float(np.mean(errors))
+        print(f"Saved calibration error: {error:.1f} cells")
+        if error > self.validationTolerance:
+            return False
+        self.app.xcoeff = np.array(profile["xcoeff"])
+        self.app.ycoeff = np.array(profile["ycoeff"])
+        self.app.mapper = mapper
+        return True
@@ -0,0 +1,235 @@
+"""
+Camera capture with negotiated settings.
+
+cv2.VideoCapture(0) opens with whatever the driver picks: often a YUYV
+format that limits the frame rate at higher resolutions, and a queue of
+several frames, so read() hands out images that are already a few frames
+old. open_camera asks for the resolution, frame rate, pixel format and
+queue depth in a config, reads back what the driver granted and warns about
+what it didn't.
+
+The config is a JSON object (python app.py --camera-config camera.json),
+any key left out keeps the driver's default:
+
+    {"width": 640, "height": 480, "fps": 30, "format": "MJPG",
+     "bufferSize": 1, "drain": true}
+
+With drain the capture skips frames that were already waiting in the
+driver's queue, so every read returns the newest frame. It is meant for the
+serial loop; the threaded pipeline reads continuously and keeps the queue
+empty anyway.
+"""
+
+import json
+import time
+
+import cv2
+
+DEFAULT_CONFIG = {
+    "backend": "any",
+    "width": None,
+    "height": None,
+    "fps": None,
+    "format": None,
+    # one queued frame, where the backend supports it (V4L2, GStreamer)
+    "bufferSize": 1,
+    "drain": False,
+    "maxDrain": 8,
+}
+
+BACKENDS = {
+    "any": cv2.CAP_ANY,
+    "v4l2": cv2.CAP_V4L2,
+    "dshow": cv2.CAP_DSHOW,
+    "msmf": cv2.CAP_MSMF,
+    "avfoundation": cv2.CAP_AVFOUNDATION,
+    "gstreamer": cv2.CAP_GSTREAMER,
+}
+
+# YUYV is also known as YUY2
+FORMATS = {"MJPG": "MJPG", "YUYV": "YUYV", "YUY2": "YUYV"}
+
+
+def load_config(path=None, **overrides):
+    """
+    DEFAULT_CONFIG updated from the JSON file at path and then from the
+    overrides that are not None.
+    """
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path) as f:
+            loaded = json.load(f)
+        unknown = set(loaded) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown camera settings {sorted(unknown)}")
+        config.update(loaded)
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    if config["format"] is not None:
+        name = str(config["format"]).upper()
+        if name not in FORMATS:
+            raise ValueError(
+                f"Unknown pixel format {config['format']!r}, use MJPG or YUYV"
+            )
+        config["format"] = FORMATS[name]
+    if config["backend"] not in BACKENDS:
+        raise ValueError(
+            f"Unknown capture backend {config['backend']!r}, "
+            f"choose from {list(BACKENDS)}"
+        )
+    return config
+
+
+def fourcc_name(code):
+    """
+    The four characters of a CAP_PROP_FOURCC value, "" if there are none.
+    """
+    code = int(code)
+    name = "".join(chr((code >> 8 * i) & 0xFF) for i in range(4))
+    return FORMATS.get(name, name) if name.strip("\0") else ""
+
+
+def frame_time(webcam, fallback):
+    """
+    The perf_counter time the last frame read from webcam was captured, if
+    the capture knows it (Camera does), otherwise fallback.
+    """
+    stamp = getattr(webcam, "frameTime", None)
+    return fallback if stamp is None else stamp
+
+
+class Camera:
+    """
+    A cv2.VideoCapture opened with a config from load_config. Behaves like
+    the VideoCapture (read, grab, retrieve, get, set, release) and adds:
+
+        granted     what the driver reports it actually uses
+        mismatches  the requested settings it didn't grant
+        frameTime   perf_counter time the last frame left the driver
+        drained     how many stale frames drain mode has skipped
+    """
+
+    def __init__(self, index=0, config=None):
+        self.index = index
+        self.config = dict(DEFAULT_CONFIG) if config is None else config
+        self.capture = cv2.VideoCapture(index, BACKENDS[self.config["backend"]])
+        self.frameTime = None
+        self.frames = 0
+        self.drained = 0
+        self.granted = {}
+        self.mismatches = {}
+        if self.capture.isOpened():
+            self.negotiate()
+
+    def negotiate(self):
+        config = self.config
+        # V4L2 only accepts a size the current format supports, so the
+        # format goes first
+        if config["format"] is not None:
+            self.capture.set(
+                cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*config["format"])
+            )
+        if config["width"] is not None:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, config["width"])
+        if config["height"] is not None:
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, config["height"])
+        if config["fps"] is not None:
+            self.capture.set(cv2.CAP_PROP_FPS, config["fps"])
+        if config["bufferSize"] is not None:
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, config["bufferSize"])
+        self.verify()
+
+    def verify(self):
+        """
+        Reads back the settings and, since some backends report what was
+        asked rather than what they deliver, the size of a real frame.
+        """
+        get = self.capture.get
+        self.granted = {
+            "width": int(get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": get(cv2.CAP_PROP_FPS),
+            "format": fourcc_name(get(cv2.CAP_PROP_FOURCC)),
+            # 0 when the backend has no such setting
+            "bufferSize": int(get(cv2.CAP_PROP_BUFFERSIZE)),
+            "backend": self.capture.getBackendName(),
+        }
+        ret, frame = self.capture.read()
+        if ret and frame is not None:
+            self.granted["height"], self.granted["width"] = frame.shape[:2]
+
+        self.mismatches = {}
+        for key in ("width", "height", "format", "bufferSize"):
+            wanted = self.config[key]
+            if wanted is not None and self.granted[key] != wanted:
+                self.mismatches[key] = (wanted, self.granted[key])
+        wanted = self.config["fps"]
+        if wanted is not None and abs(self.granted["fps"] - wanted) > 0.5:
+            self.mismatches["fps"] = (wanted, self.granted["fps"])
+
+    def describe(self):
+        granted = self.granted
+        text = (
+            f"camera {self.index}: {granted['width']}x{granted['height']} "
+            f"{granted['format'] or '?'} at {granted['fps']:g} fps, "
+            f"buffer {granted['bufferSize'] or 'default'} ({granted['backend']})"
+        )
+        if self.mismatches:
+            text += "; not granted: " + ", ".join(
+                f"{key} {wanted} (got {got})"
+                for key, (wanted, got) in self.mismatches.items()
+            )
+        return text
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def grab(self):
+        if not self.config["drain"]:
+            ok = self.capture.grab()
+            self.frameTime = time.perf_counter()
+            self.frames += ok
+            return ok
+        # a grab that returns well within a frame interval took a frame that
+        # was already queued; keep going until one has to wait for the camera
+        fps = self.granted.get("fps") or 30.0
+        waited = 0.25 / fps
+        for attempt in range(1, self.config["maxDrain"] + 1):
+            start = time.perf_counter()
+            if not self.capture.grab():
+                return False
+            self.frameTime = time.perf_counter()
+            if self.frameTime - start > waited:
+                break
+            if attempt < self.config["maxDrain"]:
+                # replaced by the next grab
+                self.drained += 1
+        self.frames += 1
+        return True
+
+    def retrieve(self, image=None, flag=0):
+        return self.capture.retrieve(image, flag)
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    def release(self):
+        self.capture.release()
+
+
+def open_camera(index=0, config=None, verbose=True):
+    """
+    Opens camera index with config (see load_config) and prints what was
+    granted.
+    """
+    camera = Camera(index, load_config() if config is None else config)
+    if verbose and camera.isOpened():
+        print(camera.describe())
+    return camera
@@ -0,0 +1,364 @@
+"""
+Streaming calibration collector.
+
+Pupil samples are written into preallocated arrays as they arrive. Each dot
+rejects outliers against the median/MAD of its own samples, and the inliers
+update the quadratic fit with recursive least squares, so the coefficients
+are ready as soon as the last dot is done instead of being fitted at the end.
+DotDwell decides how long each dot is collected for.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from fixation import FIXATION, FixationClassifier
+
+
+class RecursiveLeastSquares:
+    """
+    Recursive least squares for y = phi . w. A forgetting factor below 1
+    weights older samples down exponentially; delta is the initial
+    covariance, large meaning a weak prior.
+    """
+
+    def __init__(self, nFeatures, nOutputs=1, forgetting=1.0, delta=1e4):
+        self.forgetting = forgetting
+        self.weights = np.zeros((nFeatures, nOutputs))
+        self.P = np.eye(nFeatures) * delta
+        self.count = 0
+
+    def update(self, phi, y):
+        """
+        Adds one sample and returns its error before the update.
+        """
+        phi = np.asarray(phi, dtype=float)
+        Pphi = self.P @ phi
+        gain = Pphi / (self.forgetting + phi @ Pphi)
+        error = np.atleast_1d(y) - phi @ self.weights
+        self.weights += np.outer(gain, error)
+        self.P = (self.P - np.outer(gain, Pphi)) / self.forgetting
+        self.count += 1
+        return error
+
+    def predict(self, phi):
+        return np.asarray(phi, dtype=float) @ self.weights
+
+
+class QuadraticRLS:
+    """
+    Incremental version of np.polyfit(x, y, 2). Inputs are centred and
+    scaled so the powers stay well conditioned; coeffs() converts back to
+    polyfit's highest-power-first order.
+    """
+
+    def __init__(self, center, scale=10.0, forgetting=1.0):
+        self.center = center
+        self.scale = scale
+        self.rls = RecursiveLeastSquares(3, forgetting=forgetting)
+
+    def features(self, x):
+        u = (x - self.center) / self.scale
+        return np.array([u * u, u, 1.0])
+
+    def update(self, x, y):
+        return self.rls.update(self.features(x), y)[0]
+
+    def predict(self, x):
+        return self.rls.predict(self.features(x))[0]
+
+    def coeffs(self):
+        a, b, c = self.rls.weights[:, 0]
+        m, s = self.center, self.scale
+        return np.array(
+            [a / s**2, b / s - 2 * a * m / s**2, a * m**2 / s**2 - b * m / s + c]
+        )
+
+
+class CalibrationCollector:
+    """
+    Collects pupil samples per calibration dot.
+
+    The first `warmup` samples of a dot are held back until there are enough
+    to estimate its median; after that each sample is rejected if it lies
+    more than madThreshold robust deviations from the dot's median, on
+    either axis. Accepted samples feed one QuadraticRLS per axis. At most
+    `capacity` samples are kept per dot.
+
+    discard starts a new attempt at a dot. A sample tagged with the attempt
+    it was taken in (see attempt) is refused once that attempt is over, so
+    a tracking thread can't add to a dot the GUI has just reset.
+    """
+
+    def __init__(
+        self,
+        dotPositions,
+        gridWidth,
+        gridHeight,
+        capacity=256,
+        warmup=5,
+        madThreshold=3.5,
+        minMad=0.5,
+        scale=10.0,
+    ):
+        n = len(dotPositions)
+        self.targets = np.array(
+            [[int(x * gridWidth), int(y * gridHeight)] for x, y in dotPositions],
+            dtype=float,
+        )
+        self.capacity = capacity
+        self.warmup = warmup
+        self.madThreshold = madThreshold
+        self.minMad = minMad
+        self.scale = scale
+
+        self.lock = threading.Lock()
+        self.samples = np.zeros((n, capacity, 2))
+        self.accepted = np.zeros((n, capacity), dtype=bool)
+        self.counts = np.zeros(n, dtype=int)
+        self.rejected = np.zeros(n, dtype=int)
+        self.attempts = np.zeros(n, dtype=int)
+        self.dropped = 0
+
+        # created once the first dot gives a centre for the inputs
+        self.xfit = None
+        self.yfit = None
+
+    def attempt(self, dot):
+        with self.lock:
+            return int(self.attempts[dot])
+
+    def add(self, dot, x, y, attempt=None):
+        """
+        Adds a pupil sample for a dot. Returns True if it was accepted.
+        """
+        with self.lock:
+            if attempt is not None and attempt != self.attempts[dot]:
+                return False
+            i = self.counts[dot]
+            if i == self.capacity:
+                self.dropped += 1
+                return False
+            self.samples[dot, i] = (x, y)
+            self.counts[dot] = i + 1
+            if i + 1 < self.warmup:
+                return False
+            if i + 1 == self.warmup:
+                # enough for a median, judge the held back samples too
+                for j in np.flatnonzero(self.inliers(dot, slice(0, i + 1))):
+                    self.accept(dot, j)
+                return bool(self.accepted[dot, i])
+            if not self.inliers(dot, slice(i, i + 1))[0]:
+                self.rejected[dot] += 1
+                return False
+            self.accept(dot, i)
+            return True
+
+    def inliers(self, dot, index):
+        samples = self.samples[dot, : self.counts[dot]]
+        median = np.median(samples, axis=0)
+        mad = np.maximum(np.median(np.abs(samples - median), axis=0), self.minMad)
+        # 0.6745 makes the MAD comparable to a standard deviation
+        z = 0.6745 * np.abs(self.samples[dot, index] - median) / mad
+        return np.all(z <= self.madThreshold, axis=1)
+
+    def accept(self, dot, i):
+        x, y = self.samples[dot, i]
+        if self.xfit is None:
+            cx, cy = np.median(self.samples[dot, : self.counts[dot]], axis=0)
+            self.xfit = QuadraticRLS(cx, self.scale)
+            self.yfit = QuadraticRLS(cy, self.scale)
+        self.accepted[dot, i] = True
+        self.xfit.update(x, self.targets[dot, 0])
+        self.yfit.update(y, self.targets[dot, 1])
+
+    def discard(self, dot):
+        """
+        Drops every sample of a dot, e.g. one the user didn't hold still on,
+        and refits the accepted samples of the other dots.
+        """
+        with self.lock:
+            self.attempts[dot] += 1
+            self.counts[dot] = 0
+            self.accepted[dot] = False
+            self.rejected[dot] = 0
+            self.xfit = self.yfit = None
+            for other in range(len(self.targets)):
+                for i in np.flatnonzero(self.accepted[other]):
+                    self.accept(other, i)
+
+    def accepted_count(self, dot):
+        with self.lock:
+            return int(np.count_nonzero(self.accepted[dot]))
+
+    def dot_samples(self, dot):
+        """
+        Accepted samples of a dot as an (n, 2) array.
+        """
+        with self.lock:
+            return self.samples[dot][self.accepted[dot]].copy()
+
+    def eye_data(self):
+        """
+        Accepted samples as nested lists, one list per dot.
+        """
+        return [self.dot_samples(dot).tolist() for dot in range(len(self.targets))]
+
+    def data(self):
+        """
+        Returns (eye, targets) arrays of all accepted samples.
+        """
+        with self.lock:
+            mask = self.accepted
+            eye = self.samples[mask]
+            targets = np.repeat(self.targets, mask.sum(axis=1), axis=0)
+        return eye, targets
+
+    def coefficients(self):
+        """
+        Returns the current (xcoeff, ycoeff), highest power first like
+        np.polyfit, or None before any sample was accepted.
+        """
+        with self.lock:
+            if self.xfit is None:
+                return None
+            return self.xfit.coeffs(), self.yfit.coeffs()
+
+
+def std_error(samples):
+    """
+    The standard error of the mean of (n, 2) samples, per axis.
+    """
+    return np.std(samples, axis=0, ddof=1) / np.sqrt(len(samples))
+
+
+WAITING = "waiting"
+COLLECTING = "collecting"
+CONVERGED = "converged"
+FAILED = "failed"
+
+
+class DotDwell:
+    """
+    Decides when a calibration dot has been looked at long enough.
+
+    Samples before fixation onset, while the eyes are still travelling to
+    the dot, are not collected. After onset the dot has converged once it
+    has minSamples accepted samples, minDwell seconds have passed and the
+    standard error of their mean is below maxStdError (pupil pixels) on
+    both axes. A dot that hasn't converged after maxDwell seconds is taken
+    as it is if it has minSamples accepted samples (bestEffort is set), and
+    failed otherwise: the user wasn't steady enough for a reliable sample.
+
+    The fixation thresholds are for a steady pupil. The pupil noise is
+    measured from the first noiseSamples samples, and the velocity and
+    dispersion thresholds are raised to noiseScale times it, so that a
+    noisy camera still finds the fixation onset.
+
+    fixating is called from the tracking thread, poll from the GUI thread.
+    """
+
+    def __init__(
+        self,
+        maxStdError=0.25,
+        minDwell=0.5,
+        maxDwell=4.0,
+        minSamples=10,
+        fixationParams=None,
+        noiseSamples=15,
+        noiseScale=4.0,
+    ):
+        self.maxStdError = maxStdError
+        self.minDwell = minDwell
+        self.maxDwell = maxDwell
+        self.minSamples = minSamples
+        self.fixation = FixationClassifier(**(fixationParams or {}))
+        self.noiseSamples = noiseSamples
+        self.noiseScale = noiseScale
+        # per axis pupil noise in pixels, once measured
+        self.noise = None
+        self.first = []
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self, now=None):
+        """
+        Starts timing a newly shown dot.
+        """
+        with self.lock:
+            self.started = time.perf_counter() if now is None else now
+            self.onset = None
+            self.state = WAITING
+            self.bestEffort = False
+            self.fixation.reset()
+
+    def fixating(self, x, y, t):
+        """
+        Feeds a pupil sample to the fixation classifier and returns True
+        once the fixation on the dot has started, i.e. the sample should be
+        collected.
+        """
+        with self.lock:
+            if self.noise is None:
+                self.first.append((x, y, t))
+                if len(self.first) == self.noiseSamples:
+                    self.measure_noise()
+            if self.onset is None:
+                if self.fixation.update(x, y, t) != FIXATION:
+                    return False
+                self.onset = t
+                self.state = COLLECTING
+            return self.state == COLLECTING
+
+    def measure_noise(self):
+        """
+        Estimates the noise from the steps between the first samples and
+        scales the fixation thresholds to it.
+        """
+        steps = np.diff(np.array(self.first), axis=0)
+        # the median is robust to the few steps of the saccade onto the dot;
+        # a step between two samples with noise sigma has sigma * sqrt(2)
+        self.noise = np.median(np.abs(steps[:, :2]), axis=0) / 0.6745 / np.sqrt(2)
+        interval = np.median(steps[:, 2])
+        fixation = self.fixation
+        # a sample's total noise against the spread of a few samples, and a
+        # step's noise over the sample interval
+        fixation.dispersionThreshold = max(
+            fixation.dispersionThreshold, self.noiseScale * float(self.noise.sum())
+        )
+        if interval > 0:
+            fixation.velocityThreshold = max(
+                fixation.velocityThreshold,
+                self.noiseScale * float(np.hypot(*self.noise)) / interval,
+            )
+        self.first = []
+
+    def poll(self, samples, now=None):
+        """
+        Returns the dot's state, WAITING, COLLECTING, CONVERGED or FAILED,
+        given its accepted samples so far as an (n, 2) array.
+        """
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            if self.state in (WAITING, COLLECTING):
+                if (
+                    self.onset is not None
+                    and len(samples) >= max(self.minSamples, 2)
+                    and now - self.onset >= self.minDwell
+                    and np.all(std_error(samples) <= self.maxStdError)
+                ):
+                    self.state = CONVERGED
+                elif now - self.started >= self.maxDwell:
+                    # a noisy but complete dot is better than a repeat
+                    if self.onset is not None and len(samples) >= max(
+                        self.minSamples, 2
+                    ):
+                        self.state = CONVERGED
+                        self.bestEffort = True
+                    else:
+                        self.state = FAILED
+            return self.state
+
+    def elapsed(self, now=None):
+        return (time.perf_counter() if now is None else now) - self.started
@@ -0,0 +1,163 @@
+"""
+Accuracy and speed comparison of the pupil detector backends on a recording.
+
+Every detector runs over the same replayed frames. Speed is the time per
+frame and whether that keeps up with the recorded camera rate. On frames
+recorded during calibration (`python app.py --record session/`), accuracy is
+measured per dot: the spread of the pupil position while the user looked at
+the dot, and the error in grid cells of a quadratic fitted on even frames and
+tested on odd ones.
+
+Usage:
+    python compare_detectors.py session/
+    python compare_detectors.py session/ --detectors haar --json out.json
+"""
+
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from collector import CalibrationCollector
+from detectors import make_detector
+from profiles import CALIBRATION_DOTS
+from replay import ReplayCapture
+
+# name -> detector and its options
+VARIANTS = {
+    "dlib": ("dlib", {}),
+    "haar": ("haar", {"method": "blob"}),
+    "haar-centroid": ("haar", {"method": "centroid"}),
+}
+
+
+def run_detector(name, session, faceTracking):
+    """
+    Returns the per-frame times (s), labels and averaged pupil positions.
+    """
+    webcam = ReplayCapture(session, preload=True)
+    detector, options = VARIANTS[name]
+    gaze = make_detector(detector, faceTracking=faceTracking, **options)
+    times, labels, pupils = [], [], []
+    while True:
+        ret, frame = webcam.read()
+        if not ret:
+            break
+        start = time.perf_counter()
+        gaze.refresh(frame)
+        left = gaze.pupil_left_coords()
+        right = gaze.pupil_right_coords()
+        times.append(time.perf_counter() - start)
+        labels.append(webcam.label)
+        if left and right:
+            pupils.append(((left[0] + right[0]) / 2, (left[1] + right[1]) / 2))
+        else:
+            pupils.append(None)
+    fps = webcam.get(cv2.CAP_PROP_FPS)
+    webcam.release()
+    return np.array(times), labels, pupils, fps
+
+
+def calibration_error(labels, pupils, dots, gridWidth, gridHeight):
+    """
+    Per dot spread (median absolute deviation in frame pixels) and the mean
+    held out error in cells, or None without labelled frames.
+    """
+    perDot = {}
+    for label, pupil in zip(labels, pupils):
+        if label is not None and pupil is not None and label < len(dots):
+            perDot.setdefault(label, []).append(pupil)
+    if len(perDot) < 3:
+        return None, None
+
+    spread = []
+    train = CalibrationCollector(dots, gridWidth, gridHeight)
+    test = {}
+    for dot, samples in perDot.items():
+        samples = np.array(samples)
+        spread.append(np.median(np.abs(samples - np.median(samples, axis=0))))
+        for x, y in samples[0::2]:
+            train.add(dot, x, y)
+        test[dot] = samples[1::2]
+    coefficients = train.coefficients()
+    if coefficients is None:
+        return float(np.mean(spread)), None
+
+    xcoeff, ycoeff = coefficients
+    errors = []
+    for dot, samples in test.items():
+        if not len(samples):
+            continue
+        column = np.polyval(xcoeff, samples[:, 0])
+        row = np.polyval(ycoeff, samples[:, 1])
+        target = train.targets[dot]
+        errors.append(np.median(np.hypot(column - target[0], row - target[1])))
+    return float(np.mean(spread)), float(np.mean(errors)) if errors else None
+
+
+def compare(name, args):
+    times, labels, pupils, fps = run_detector(name, args.session, not args.no_roi)
+    found = sum(pupil is not None for pupil in pupils)
+    spread, error = calibration_error(
+        labels,
+        pupils,
+        CALIBRATION_DOTS,
+        args.screen[0] // args.cell,
+        args.screen[1] // args.cell,
+    )
+    ms = times * 1000
+    return {
+        "detector": name,
+        "frames": len(times),
+        "detected": found / len(times) if len(times) else 0.0,
+        "mean_ms": float(ms.mean()) if len(ms) else 0.0,
+        "p50_ms": float(np.percentile(ms, 50)) if len(ms) else 0.0,
+        "p99_ms": float(np.percentile(ms, 99)) if len(ms) else 0.0,
+        "camera_fps": fps,
+        "keeps_up": bool(len(ms) and fps and ms.mean() < 1000 / fps),
+        "spread_px": spread,
+        "error_cells": error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("session", help="recorded session directory")
+    parser.add_argument(
+        "--detectors", nargs="+", default=list(VARIANTS), choices=list(VARIANTS)
+    )
+    parser.add_argument("--no-roi", action="store_true", help="no face tracking")
+    parser.add_argument("--screen", type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument("--cell", type=int, default=20, help="grid cell size")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'detector':13s} {'frames':>7s} {'found':>6s} {'mean ms':>8s} "
+        f"{'p99 ms':>7s} {'keeps up':>9s} {'spread px':>10s} {'error cells':>12s}"
+    )
+    for name in args.detectors:
+        try:
+            r = compare(name, args)
+        except ImportError as e:
+            print(f"{name:13s} unavailable: {e}")
+            continue
+        results.append(r)
+        spread = "-" if r["spread_px"] is None else f"{r['spread_px']:.2f}"
+        error = "-" if r["error_cells"] is None else f"{r['error_cells']:.2f}"
+        print(
+            f"{r['detector']:13s} {r['frames']:7d} {r['detected']:6.0%} "
+            f"{r['mean_ms']:8.2f} {r['p99_ms']:7.2f} "
+            f"{'yes' if r['keeps_up'] else 'no':>9s} {spread:>10s} {error:>12s}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
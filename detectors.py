@@ -0,0 +1,252 @@
+"""
+Pupil detector backends.
+
+MouseController and CalibrateScreen only use three calls of the GazeTracking
+API, which every backend provides:
+
+    refresh(frame)          analyse a BGR webcam frame
+    pupil_left_coords()     (x, y) in frame pixels, or None
+    pupil_right_coords()    (x, y) in frame pixels, or None
+
+Backends:
+    dlib  GazeTracking (dlib face landmarks), the accurate default
+    haar  haarscascade/track.py finished into a tracker: Haar face and eye
+          cascades plus blob detection on the thresholded eye, much cheaper
+          per frame on slow machines
+"""
+
+import collections
+
+import cv2
+import numpy as np
+
+from buffers import BufferPool
+from haarscascade.track import (
+    FrameContext,
+    blob_process,
+    crop,
+    detect_eye_boxes,
+    detector as blob_detector,
+    eye_cascade,
+    face_cascade,
+    histogram_threshold,
+    locate_face,
+    make_face_tracker,
+    pupil_centroid,
+    search_threshold,
+    to_gray,
+)
+
+
+def make_dlib_detector(faceTracking=True):
+    from GazeTracking.gaze_tracking import GazeTracking
+    from face_tracking import enable_face_tracking
+
+    gaze = GazeTracking()
+    if faceTracking:
+        enable_face_tracking(gaze)
+    return gaze
+
+
+class HaarDetector:
+    """
+    Haar cascade pupil detector with the GazeTracking interface.
+
+    The face is found on a downscaled pyramid level and tracked between
+    keyframes, eyes in the bottom half of the face are ignored, and the eye
+    is thresholded at threshold (0-255) after cutting off the eyebrow. The
+    pupil is then the largest blob after morphology (method "blob", as in
+    track.py) or the moments centroid of the largest dark region (method
+    "centroid", cheaper).
+
+    With threshold None it is searched on the first tuneFrames frames with
+    eyes. When fewer than minConfidence of the last window frames find both
+    pupils, it is re-tuned from the eye histograms.
+
+    The gray frame, pyramid and eye masks are written into buffers kept
+    between frames (reuseBuffers), so the detector allocates no image memory
+    once warmed up.
+    """
+
+    def __init__(
+        self,
+        threshold=None,
+        levels=1,
+        faceTracking=True,
+        method="blob",
+        tuneFrames=10,
+        window=30,
+        minConfidence=0.6,
+        lightingTolerance=25,
+        reuseBuffers=True,
+    ):
+        if method not in ("blob", "centroid"):
+            raise ValueError(f"Unknown pupil method {method!r}, use blob or centroid")
+        self.threshold = threshold
+        self.levels = levels
+        self.tracker = make_face_tracker(face_cascade) if faceTracking else None
+        self.method = method
+        self.tuneFrames = tuneFrames
+        self.minConfidence = minConfidence
+        self.lightingTolerance = lightingTolerance
+        self.buffers = BufferPool() if reuseBuffers else None
+
+        self.tuning = []
+        self.hits = collections.deque(maxlen=window)
+        self.brightness = None
+        self.tunedBrightness = None
+        self.retunes = 0
+        self.eyeBoxes = (None, None)
+        self.left = None
+        self.right = None
+
+    def settings(self):
+        """
+        What is worth caching in a calibration profile.
+        """
+        return {
+            "threshold": self.threshold,
+            "brightness": self.tunedBrightness,
+            "method": self.method,
+        }
+
+    def load_settings(self, settings):
+        """
+        Reuses a cached threshold. It is dropped on the first frame if the
+        face brightness is more than lightingTolerance off the cached one.
+        """
+        if settings and settings.get("threshold") is not None:
+            self.threshold = settings["threshold"]
+            self.tunedBrightness = settings.get("brightness")
+
+    def refresh(self, frame):
+        self.left = self.right = None
+        self.eyeBoxes = (None, None)
+        ctx = FrameContext(frame, self.levels, self.buffers)
+        face = locate_face(ctx, face_cascade, self.tracker)
+        if face is None:
+            return
+        fx, fy = face[:2]
+        face_gray = crop(ctx.gray, face)
+        self.update_brightness(face_gray)
+
+        eyes = []
+        for box in detect_eye_boxes(face_gray, eye_cascade):
+            if box is None:
+                eyes.append(None)
+                continue
+            x, y, w, h = box
+            # same cut as cut_eyebrows, kept here to map back to the frame
+            eyebrow = h // 4
+            eye = crop(face_gray, (x, y + eyebrow, w, h - eyebrow))
+            eyes.append((eye, fx + x, fy + y + eyebrow))
+        self.eyeBoxes = tuple(
+            None if eye is None else (eye[1], eye[2]) + eye[0].shape[::-1]
+            for eye in eyes
+        )
+
+        if self.threshold is None:
+            self.tune([eye[0] for eye in eyes if eye is not None])
+            return
+        self.left, self.right = (
+            None if eye is None else self.locate_pupil(*eye) for eye in eyes
+        )
+        self.hits.append(self.left is not None and self.right is not None)
+        if (
+            len(self.hits) == self.hits.maxlen
+            and np.mean(self.hits) < self.minConfidence
+        ):
+            self.retune([eye[0] for eye in eyes if eye is not None])
+
+    def refine(self, frame):
+        """
+        Cheap update for when the eyes are known not to have moved much:
+        finds the pupils again inside the last eye boxes only, skipping the
+        face and eye cascades. Returns False, leaving the pupils unchanged,
+        if that isn't possible and refresh is needed.
+        """
+        if self.threshold is None or None in self.eyeBoxes:
+            return False
+        pupils = []
+        for box in self.eyeBoxes:
+            eye = to_gray(crop(frame, box), self.buffers)
+            pupil = self.locate_pupil(eye, box[0], box[1])
+            if pupil is None:
+                return False
+            pupils.append(pupil)
+        self.left, self.right = pupils
+        return True
+
+    def update_brightness(self, face_gray):
+        # cv2.mean reads the view in place, np.mean would copy it
+        brightness = cv2.mean(face_gray)[0]
+        if self.brightness is None:
+            self.brightness = brightness
+            # a cached threshold from different lighting is no use
+            if (
+                self.tunedBrightness is not None
+                and abs(brightness - self.tunedBrightness) > self.lightingTolerance
+            ):
+                self.threshold = None
+        else:
+            self.brightness += 0.05 * (brightness - self.brightness)
+
+    def tune(self, eyes):
+        """
+        Collects eye crops and runs the threshold search once there are
+        enough.
+        """
+        self.tuning.extend(eye.copy() for eye in eyes)
+        if len(self.tuning) >= self.tuneFrames:
+            self.threshold = search_threshold(self.tuning)
+            self.tunedBrightness = self.brightness
+            self.tuning = []
+            self.hits.clear()
+
+    def retune(self, eyes):
+        if eyes:
+            self.threshold = int(np.median([histogram_threshold(e) for e in eyes]))
+            self.tunedBrightness = self.brightness
+            self.retunes += 1
+        self.hits.clear()
+
+    def locate_pupil(self, eye, ox, oy):
+        """
+        Returns the pupil centre in frame pixels for an eye crop whose top
+        left corner is at (ox, oy) in the frame, or None.
+        """
+        if self.method == "centroid":
+            found = pupil_centroid(eye, self.threshold, self.buffers)
+            if found is None:
+                return None
+            px, py = found[0]
+        else:
+            keypoints = blob_process(eye, self.threshold, blob_detector, self.buffers)
+            if not keypoints:
+                return None
+            px, py = max(keypoints, key=lambda k: k.size).pt
+        return int(ox + px), int(oy + py)
+
+    def pupil_left_coords(self):
+        return self.left
+
+    def pupil_right_coords(self):
+        return self.right
+
+    @property
+    def pupils_located(self):
+        return self.left is not None and self.right is not None
+
+
+DETECTORS = {
+    "dlib": make_dlib_detector,
+    "haar": HaarDetector,
+}
+
+
+def make_detector(name, **kwargs):
+    if name not in DETECTORS:
+        raise ValueError(
+            f"Unknown pupil detector {name!r}, choose from {list(DETECTORS)}"
+        )
+    return DETECTORS[name](**kwargs)
@@ -0,0 +1,226 @@
+"""
+Online drift correction for the running controller.
+
+Head movement slowly shifts the pupil positions the calibration was fitted
+on. DriftCorrector keeps a short history of the smoothed pupil position and
+turns implicit ground truth (the cursor position at a confirmed click or
+dwell, or a single dot the user is asked to look at) into (pupil, cell)
+pairs. Each pair updates the quadratic coefficients by recursive least
+squares with a forgetting factor, on a background thread; the recompiled
+mapper is then handed over in one assignment so the control loop never
+waits on it.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+from collector import QuadraticRLS
+from mapping import MappingEngine, SeparableQuadratic
+
+
+def rls_from_coeffs(coeffs, center, scale, forgetting, delta):
+    """
+    Builds a QuadraticRLS whose current fit is the polyfit coeffs.
+    """
+    A, B, C = coeffs
+    fit = QuadraticRLS(center, scale, forgetting)
+    fit.rls.weights[:, 0] = [
+        A * scale**2,
+        (B + 2 * A * center) * scale,
+        A * center**2 + B * center + C,
+    ]
+    fit.rls.P *= delta / fit.rls.P[0, 0]
+    return fit
+
+
+class DriftCorrector:
+    """
+    Refines the calibration while the controller runs.
+
+    forgetting close to 1 adapts slowly, lower values follow drift faster
+    but are noisier. delta is how much the calibrated coefficients are
+    trusted to begin with (smaller is stiffer). Samples whose error under
+    the current mapping is above maxError cells are ignored as the user
+    probably wasn't looking at the target.
+    """
+
+    def __init__(
+        self,
+        xcoeffs,
+        ycoeffs,
+        mapper,
+        cellWidth,
+        cellHeight,
+        onUpdate,
+        forgetting=0.98,
+        delta=1.0,
+        scale=10.0,
+        maxError=8,
+        lookback=0.3,
+        settle=0.4,
+        history=64,
+    ):
+        self.mapper = mapper
+        self.cellWidth = cellWidth
+        self.cellHeight = cellHeight
+        self.onUpdate = onUpdate
+        self.maxError = maxError
+        self.lookback = lookback
+        self.settle = settle
+        self.forgetting = forgetting
+        self.delta = delta
+        self.scale = scale
+
+        self.xcoeffs = np.asarray(xcoeffs, dtype=float)
+        self.ycoeffs = np.asarray(ycoeffs, dtype=float)
+        self.xfit = None
+        self.yfit = None
+
+        # (time, x, y) of recent smoothed pupil positions
+        self.history = collections.deque(maxlen=history)
+        self.prompt = None
+        self.promptSamples = []
+
+        self.samples = queue.Queue()
+        self.thread = None
+        self.updates = 0
+        self.rejected = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.samples.put(None)
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def observe(self, eye, now=None):
+        """
+        Called by the control loop with every smoothed pupil position.
+        """
+        if now is None:
+            now = time.perf_counter()
+        self.history.append((now, eye[0], eye[1]))
+        prompt = self.prompt
+        if prompt is not None:
+            point, shown, duration = prompt
+            if now - shown >= self.settle:
+                self.promptSamples.append(eye)
+            if now - shown >= duration:
+                self.prompt = None
+                if self.promptSamples:
+                    self.submit(np.median(self.promptSamples, axis=0), point)
+
+    def confirm(self, x, y, now=None):
+        """
+        The user confirmed screen point (x, y) with a click or dwell, so they
+        were looking at it just before. Returns False if there was no recent
+        pupil position.
+        """
+        if now is None:
+            now = time.perf_counter()
+        recent = [
+            (px, py) for t, px, py in list(self.history) if now - t <= self.lookback
+        ]
+        if not recent:
+            return False
+        self.submit(np.median(recent, axis=0), (x, y))
+        return True
+
+    def begin_prompt(self, x, y, duration=1.5):
+        """
+        Starts a single dot prompt at screen point (x, y). Pupil positions
+        from settle seconds after the start until duration are used.
+        """
+        self.promptSamples = []
+        self.prompt = ((x, y), time.perf_counter(), duration)
+
+    def submit(self, eye, point):
+        self.start()
+        cell = (point[0] / self.cellWidth, point[1] / self.cellHeight)
+        self.samples.put((eye, cell))
+
+    def run(self):
+        while True:
+            sample = self.samples.get()
+            if sample is None:
+                return
+            eye, cell = sample
+            if self.update(eye, cell):
+                self.onUpdate(self.mapper, self.xcoeffs, self.ycoeffs)
+
+    def update(self, eye, cell):
+        """
+        Adds one ground truth pair and rebuilds the mapper. Returns False if
+        the pair was rejected.
+        """
+        x, y = eye
+        column = np.polyval(self.xcoeffs, x)
+        row = np.polyval(self.ycoeffs, y)
+        if np.hypot(column - cell[0], row - cell[1]) > self.maxError:
+            self.rejected += 1
+            return False
+        if self.xfit is None:
+            # centre the inputs on the first sample
+            self.xfit = rls_from_coeffs(
+                self.xcoeffs, x, self.scale, self.forgetting, self.delta
+            )
+            self.yfit = rls_from_coeffs(
+                self.ycoeffs, y, self.scale, self.forgetting, self.delta
+            )
+        self.xfit.update(x, cell[0])
+        self.yfit.update(y, cell[1])
+        self.xcoeffs = self.xfit.coeffs()
+        self.ycoeffs = self.yfit.coeffs()
+        self.mapper = self.compile(self.mapper)
+        self.updates += 1
+        return True
+
+    def compile(self, previous):
+        """
+        Builds a mapper for the new coefficients with the same lookup table
+        range as the previous one.
+        """
+        mapper = MappingEngine(
+            SeparableQuadratic.from_coeffs(self.xcoeffs, self.ycoeffs),
+            previous.gridWidth,
+            previous.gridHeight,
+            step=previous.step,
+            margin=0,
+            maxSize=previous.maxSize,
+        )
+        if previous.lut is not None:
+            low = previous.origin
+            high = low + np.array(previous.maxIndex) * previous.step
+            mapper.compile(low, high)
+        return mapper
+
+
+class ClickListener:
+    """
+    Calls onClick(x, y) for every left click, from pynput's listener thread.
+    """
+
+    def __init__(self, onClick):
+        from pynput import mouse
+
+        self.onClick = onClick
+        self.button = mouse.Button.left
+        self.listener = mouse.Listener(on_click=self.clicked)
+
+    def clicked(self, x, y, button, pressed):
+        if pressed and button == self.button:
+            self.onClick(x, y)
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
@@ -0,0 +1,116 @@
+"""
+Face ROI tracking so face detection does not scan the whole frame every time.
+
+The head barely moves between frames, so after a face is found we only search
+an expanded box around it. A full-frame detection runs on tracking loss and
+every keyframeInterval frames to pick up large moves.
+"""
+
+import numpy as np
+
+
+class FaceRoiTracker:
+    """
+    Wraps a face detector, detect(gray) -> list of (x, y, w, h), and reuses
+    the last face box to restrict later searches.
+    """
+
+    def __init__(self, detect, margin=0.5, keyframeInterval=15):
+        self.detect = detect
+        self.margin = margin  # fraction of the face size added on each side
+        self.keyframeInterval = keyframeInterval
+
+        self.box = None
+        self.sinceKeyframe = 0
+
+        # counters for checking how often the fast path is taken
+        self.fullDetections = 0
+        self.roiDetections = 0
+
+    def reset(self):
+        """
+        Forgets the last face so the next update does a full-frame search.
+        """
+        self.box = None
+
+    def search_region(self, width, height):
+        x, y, w, h = self.box
+        padX = int(w * self.margin)
+        padY = int(h * self.margin)
+        x0 = max(x - padX, 0)
+        y0 = max(y - padY, 0)
+        x1 = min(x + w + padX, width)
+        y1 = min(y + h + padY, height)
+        return x0, y0, x1, y1
+
+    def update(self, gray):
+        """
+        Returns the (x, y, w, h) face box in full-frame coordinates, or None.
+        """
+        height, width = gray.shape[:2]
+        faces = None
+
+        if self.box is not None and self.sinceKeyframe < self.keyframeInterval:
+            x0, y0, x1, y1 = self.search_region(width, height)
+            found = self.detect(gray[y0:y1, x0:x1])
+            self.roiDetections += 1
+            if len(found):
+                faces = [(x + x0, y + y0, w, h) for x, y, w, h in found]
+                self.sinceKeyframe += 1
+
+        if faces is None:
+            # keyframe or tracking loss
+            faces = self.detect(gray)
+            self.fullDetections += 1
+            self.sinceKeyframe = 0
+
+        if not len(faces):
+            self.box = None
+            return None
+
+        # if multiple faces detected, choose largest one as face
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(x + w), width), min(int(y + h), height)
+        self.box = (x0, y0, x1 - x0, y1 - y0)
+        return self.box
+
+
+class DlibFaceTracker:
+    """
+    Drop-in replacement for GazeTracking's dlib face detector that runs
+    through a FaceRoiTracker.
+    """
+
+    def __init__(self, detector, margin=0.5, keyframeInterval=15):
+        import dlib
+
+        self.dlib = dlib
+        self.detector = detector
+        self.tracker = FaceRoiTracker(self.detect, margin, keyframeInterval)
+
+    def detect(self, gray):
+        return [
+            (rect.left(), rect.top(), rect.width(), rect.height())
+            for rect in self.detector(np.ascontiguousarray(gray))
+        ]
+
+    def __call__(self, gray, *args):
+        rects = self.dlib.rectangles()
+        box = self.tracker.update(gray)
+        if box is not None:
+            x, y, w, h = box
+            rects.append(self.dlib.rectangle(x, y, x + w, y + h))
+        return rects
+
+
+def enable_face_tracking(gaze, margin=0.5, keyframeInterval=15):
+    """
+    Swaps the face detector of a GazeTracking object for a tracking one.
+    Returns the FaceRoiTracker so callers can reset it or read its counters.
+    """
+    detector = gaze._face_detector
+    if isinstance(detector, DlibFaceTracker):
+        detector = detector.detector
+    gaze._face_detector = DlibFaceTracker(detector, margin, keyframeInterval)
+    return gaze._face_detector.tracker
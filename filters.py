@@ -0,0 +1,162 @@
+"""
+Streaming filters for smoothing the pupil position.
+
+All filters share update(x, y, t=None) -> (x, y) and reset(), where t is
+the sample's capture time (perf_counter, now if None); the One Euro and
+Kalman filters take their dt from it. They keep their state in plain floats
+and fixed buffers, so each update is constant time and does no array
+allocation in the tracking loop.
+"""
+
+import math
+import time
+
+
+class MovingAverageFilter:
+    """
+    Boxcar average over the last size samples, kept as a running sum over a
+    fixed ring buffer.
+    """
+
+    def __init__(self, size=3):
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self.xs = [0.0] * self.size
+        self.ys = [0.0] * self.size
+        self.index = 0
+        self.count = 0
+        self.xsum = 0.0
+        self.ysum = 0.0
+
+    def update(self, x, y, t=None):
+        if self.count == self.size:
+            self.xsum -= self.xs[self.index]
+            self.ysum -= self.ys[self.index]
+        else:
+            self.count += 1
+        self.xs[self.index] = x
+        self.ys[self.index] = y
+        self.xsum += x
+        self.ysum += y
+
+        self.index += 1
+        if self.index == self.size:
+            self.index = 0
+            # resum once per lap so rounding errors don't build up
+            self.xsum = math.fsum(self.xs[: self.count])
+            self.ysum = math.fsum(self.ys[: self.count])
+        return self.xsum / self.count, self.ysum / self.count
+
+
+class OneEuroFilter:
+    """
+    One Euro filter (Casiez et al., CHI 2012): a low-pass filter whose cutoff
+    rises with speed, so slow fixations are smoothed hard while fast saccades
+    pass through with little lag.
+
+    minCutoff (Hz) sets the jitter at rest, beta how quickly the cutoff opens
+    up with speed.
+    """
+
+    def __init__(self, minCutoff=1.0, beta=0.01, dCutoff=1.0):
+        self.minCutoff = minCutoff
+        self.beta = beta
+        self.dCutoff = dCutoff
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.lastTime = None
+        self.dx = 0.0
+        self.dy = 0.0
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def update(self, x, y, t=None):
+        t = time.perf_counter() if t is None else t
+        if self.last is None:
+            self.last = (x, y)
+            self.lastTime = t
+            return x, y
+        dt = max(t - self.lastTime, 1e-6)
+        self.lastTime = t
+        lastX, lastY = self.last
+
+        # smoothed speed
+        a = self.alpha(self.dCutoff, dt)
+        self.dx += a * ((x - lastX) / dt - self.dx)
+        self.dy += a * ((y - lastY) / dt - self.dy)
+
+        # speed dependent cutoff
+        ax = self.alpha(self.minCutoff + self.beta * abs(self.dx), dt)
+        ay = self.alpha(self.minCutoff + self.beta * abs(self.dy), dt)
+        self.last = (lastX + ax * (x - lastX), lastY + ay * (y - lastY))
+        return self.last
+
+
+class KalmanFilter:
+    """
+    Constant-velocity Kalman filter, run independently on x and y.
+
+    processNoise is the acceleration variance, measurementNoise the variance
+    of the pupil measurement (webcam pixels squared).
+    """
+
+    def __init__(self, processNoise=5000.0, measurementNoise=4.0):
+        self.q = processNoise
+        self.r = measurementNoise
+        self.reset()
+
+    def reset(self):
+        self.axes = None
+        self.lastTime = None
+
+    def step(self, axis, z, dt):
+        p, v, p00, p01, p11 = axis
+        # predict
+        p += v * dt
+        dt2 = dt * dt
+        p00 += dt * (2 * p01 + dt * p11) + self.q * dt2 * dt2 / 4
+        p01 += dt * p11 + self.q * dt2 * dt / 2
+        p11 += self.q * dt2
+        # update
+        s = p00 + self.r
+        k0 = p00 / s
+        k1 = p01 / s
+        residual = z - p
+        p += k0 * residual
+        v += k1 * residual
+        p11 -= k1 * p01
+        p01 -= k0 * p01
+        p00 -= k0 * p00
+        return [p, v, p00, p01, p11]
+
+    def update(self, x, y, t=None):
+        t = time.perf_counter() if t is None else t
+        if self.axes is None:
+            self.axes = [[x, 0.0, self.r, 0.0, 1e4], [y, 0.0, self.r, 0.0, 1e4]]
+            self.lastTime = t
+            return x, y
+        dt = max(t - self.lastTime, 1e-6)
+        self.lastTime = t
+        self.axes[0] = self.step(self.axes[0], x, dt)
+        self.axes[1] = self.step(self.axes[1], y, dt)
+        return self.axes[0][0], self.axes[1][0]
+
+
+FILTERS = {
+    "average": MovingAverageFilter,
+    "one_euro": OneEuroFilter,
+    "kalman": KalmanFilter,
+}
+
+
+def make_filter(name, **kwargs):
+    if name not in FILTERS:
+        raise ValueError(f"Unknown filter {name!r}, choose from {list(FILTERS)}")
+    return FILTERS[name](**kwargs)
@@ -0,0 +1,104 @@
+"""
+Fixation and saccade classification of the pupil position.
+
+FixationClassifier combines the two classic eye movement rules: a sample
+moving faster than velocityThreshold is a saccade (I-VT), and samples that
+stay within dispersionThreshold for at least minDuration are a fixation
+(I-DT). Anything in between (slow drift, smooth pursuit, too few samples) is
+"moving". The controller uses the state to decide how much work a frame
+gets. Thresholds are in webcam pixels of pupil movement.
+"""
+
+import math
+import time
+
+FIXATION = "fixation"
+SACCADE = "saccade"
+MOVING = "moving"
+
+
+class FixationClassifier:
+    def __init__(
+        self,
+        velocityThreshold=60.0,
+        dispersionThreshold=2.5,
+        minDuration=0.1,
+        size=32,
+    ):
+        self.velocityThreshold = velocityThreshold
+        self.dispersionThreshold = dispersionThreshold
+        self.minDuration = minDuration
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        # ring buffer of recent samples, like the streaming filters
+        self.ts = [0.0] * self.size
+        self.xs = [0.0] * self.size
+        self.ys = [0.0] * self.size
+        self.index = 0
+        self.count = 0
+        self.state = MOVING
+        self.since = None
+        self.velocity = 0.0
+
+    def update(self, x, y, t=None):
+        """
+        Adds a sample and returns the new state.
+        """
+        if t is None:
+            t = time.perf_counter()
+        if self.count:
+            last = (self.index - 1) % self.size
+            dt = t - self.ts[last]
+            if dt > 0:
+                self.velocity = math.hypot(x - self.xs[last], y - self.ys[last]) / dt
+        self.ts[self.index] = t
+        self.xs[self.index] = x
+        self.ys[self.index] = y
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+        if self.count > 1 and self.velocity > self.velocityThreshold:
+            state = SACCADE
+        elif self.dispersion(t) <= self.dispersionThreshold:
+            state = FIXATION
+        else:
+            state = MOVING
+        if state != self.state:
+            self.state = state
+            self.since = t
+        return state
+
+    def last(self):
+        """
+        The most recent (x, y), or None before the first sample.
+        """
+        if not self.count:
+            return None
+        j = (self.index - 1) % self.size
+        return self.xs[j], self.ys[j]
+
+    def dispersion(self, now):
+        """
+        (max x - min x) + (max y - min y) over the last minDuration seconds,
+        or infinity if the buffer doesn't span that long yet.
+        """
+        xmin = ymin = math.inf
+        xmax = ymax = -math.inf
+        for i in range(1, self.count + 1):
+            j = (self.index - i) % self.size
+            x, y = self.xs[j], self.ys[j]
+            xmin, xmax = min(xmin, x), max(xmax, x)
+            ymin, ymax = min(ymin, y), max(ymax, y)
+            if now - self.ts[j] >= self.minDuration:
+                return (xmax - xmin) + (ymax - ymin)
+        return math.inf
+
+    def duration(self, now=None):
+        """
+        Seconds spent in the current state.
+        """
+        if self.since is None:
+            return 0.0
+        return (time.perf_counter() if now is None else now) - self.since
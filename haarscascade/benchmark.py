@@ -0,0 +1,157 @@
+"""
+Before/after benchmark of the Haar tracker on recorded frames.
+
+Compares the original path (BGR frame converted to gray separately by each
+stage, full-resolution face cascade) with the shared FrameContext path
+(one gray conversion, face cascade on a downscaled pyramid level). track.py
+only has the new path, so the original functions are copied below (minus
+dead code) and share only the cascades and blob detector with it.
+
+Usage:
+    python benchmark.py recording.avi
+    python benchmark.py frames_dir/ --frames 300 --threshold 40
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+import track
+
+
+def load_frames(path, limit):
+    """
+    Loads up to limit frames from a video file or a directory of images.
+    """
+    frames = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            frame = cv2.imread(os.path.join(path, name))
+            if frame is not None:
+                frames.append(frame)
+            if len(frames) >= limit:
+                break
+    else:
+        cap = cv2.VideoCapture(path)
+        while len(frames) < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    return frames
+
+
+# the original track.py functions, one gray conversion per stage
+
+
+def legacy_detect_eyes(img, classifier):
+    gray_frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    eyes = classifier.detectMultiScale(gray_frame, 1.3, 5)
+    width = np.size(img, 1)
+    left_eye, right_eye = None, None
+    for x, y, w, h in eyes:
+        eyecenter = x + w / 2
+        if eyecenter < width * 0.5:
+            left_eye = img[y : y + h, x : x + w]
+        else:
+            right_eye = img[y : y + h, x : x + w]
+    return left_eye, right_eye
+
+
+def legacy_detect_faces(img, classifier):
+    gray_frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    coords = classifier.detectMultiScale(gray_frame, 1.3, 5)
+    if len(coords) == 0:
+        return None
+    x, y, w, h = max(coords, key=lambda c: c[3])
+    return img[y : y + h, x : x + w]
+
+
+def legacy_blob_process(img, threshold, detector):
+    gray_frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, img = cv2.threshold(gray_frame, threshold, 255, cv2.THRESH_BINARY)
+    img = cv2.erode(img, None, iterations=2)
+    img = cv2.dilate(img, None, iterations=4)
+    img = cv2.medianBlur(img, 5)
+    return detector.detect(img)
+
+
+def legacy_frame(frame, threshold):
+    face_frame = legacy_detect_faces(frame, track.face_cascade)
+    if face_frame is None:
+        return 0
+    pupils = 0
+    for eye in legacy_detect_eyes(face_frame, track.eye_cascade):
+        if eye is not None:
+            eye = track.cut_eyebrows(eye)
+            pupils += len(legacy_blob_process(eye, threshold, track.detector))
+    return pupils
+
+
+def context_frame(frame, threshold, levels, tracker=None):
+    ctx = track.FrameContext(frame, levels)
+    face = track.locate_face(ctx, track.face_cascade, tracker)
+    if face is None:
+        return 0
+    face_gray = track.crop(ctx.gray, face)
+    pupils = 0
+    for eye_box in track.detect_eye_boxes(face_gray, track.eye_cascade):
+        if eye_box is not None:
+            eye = track.cut_eyebrows(track.crop(face_gray, eye_box))
+            pupils += len(track.blob_process(eye, threshold, track.detector))
+    return pupils
+
+
+def time_frames(frames, process):
+    times = []
+    pupils = 0
+    for frame in frames:
+        start = time.perf_counter()
+        pupils += process(frame)
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000, pupils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source", help="video file or directory of frames")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--threshold", type=int, default=40)
+    parser.add_argument("--levels", type=int, default=1)
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.frames)
+    if not frames:
+        print("No frames loaded from", args.source)
+        return
+
+    configs = [
+        ("before", lambda f: legacy_frame(f, args.threshold)),
+        ("context", lambda f: context_frame(f, args.threshold, args.levels)),
+    ]
+    tracker = track.make_face_tracker(track.face_cascade)
+    configs.append(
+        (
+            "context+roi",
+            lambda f: context_frame(f, args.threshold, args.levels, tracker),
+        )
+    )
+
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    baseline = None
+    for name, process in configs:
+        times, pupils = time_frames(frames, process)
+        mean = times.mean()
+        baseline = baseline or mean
+        print(
+            f"{name:12s} mean {mean:6.2f} ms  p95 {np.percentile(times, 95):6.2f} ms"
+            f"  {1000 / mean:6.1f} fps  x{baseline / mean:4.2f}  pupils {pupils}"
+        )
+
+
+if __name__ == "__main__":
+    main()
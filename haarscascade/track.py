@@ -1,8 +1,18 @@
+import os
+import sys
 import cv2
 import numpy as np
 
-face_cascade = cv2.CascadeClassifier("haarscascade_frontalface_default.xml")
-eye_cascade = cv2.CascadeClassifier("haarscascade_eye.xml")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from buffers import BufferPool, FrameRing, scratch
+from face_tracking import FaceRoiTracker
+
+# cascades live next to this file, not in the working directory
+HERE = os.path.dirname(os.path.abspath(__file__))
+face_cascade = cv2.CascadeClassifier(
+    os.path.join(HERE, "haarscascade_frontalface_default.xml")
+)
+eye_cascade = cv2.CascadeClassifier(os.path.join(HERE, "haarscascade_eye.xml"))
 
 # blob detection algorithm
 detector_params = cv2.SimpleBlobDetector_Params()
@@ -11,28 +21,52 @@ detector_params.maxArea = 1500
 detector = cv2.SimpleBlobDetector_create(detector_params)
 
 
-def detect_eyes(img, classifier):
-    # convert image to grayscale
-    gray_frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    #
+def to_gray(img, pool=None):
+    # eye and face crops taken from a FrameContext are already gray
+    if img.ndim == 2:
+        return img
+    dst = scratch(pool, "crop_gray", img.shape[:2])
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=dst)
+
+
+def crop(img, box):
+    if box is None:
+        return None
+    x, y, w, h = box
+    return img[y : y + h, x : x + w]
+
+
+def detect_eye_boxes(gray_frame, classifier):
     eyes = classifier.detectMultiScale(gray_frame, 1.3, 5)  # detect eyes
-    width = np.size(img, 1)  # get face frame width
-    height = np.size(img, 0)  # get face frame height
+    width = np.size(gray_frame, 1)  # get face frame width
+    height = np.size(gray_frame, 0)  # get face frame height
     left_eye, right_eye = None, None  # initialize in case none detected
     for x, y, w, h in eyes:
         if y > height / 2:  # pass if the eye is detected at the bottom half of face
-            pass
+            continue
         eyecenter = x + w / 2  # get the eye center
         # determine left and right eyes
         if eyecenter < width * 0.5:
-            left_eye = img[y : y + h, x : x + w]
+            left_eye = (x, y, w, h)
         else:
-            right_eye = img[y : y + h, x : x + w]
+            right_eye = (x, y, w, h)
     return left_eye, right_eye
 
 
-def detect_faces(img, classifier):
+def detect_eyes(img, classifier):
+    left_eye, right_eye = detect_eye_boxes(to_gray(img), classifier)
+    return crop(img, left_eye), crop(img, right_eye)
+
+
+def detect_faces(img, classifier, tracker=None):
     gray_frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if tracker is not None:
+        # only search around the last face, see FaceRoiTracker
+        face = tracker.update(gray_frame)
+        if face is None:
+            return None
+        x, y, w, h = face
+        return img[y : y + h, x : x + w]
     coords = classifier.detectMultiScale(gray_frame, 1.3, 5)
     # if multiple faces detected, choose largest one as face
     if len(coords) > 1:
@@ -40,7 +74,7 @@ def detect_faces(img, classifier):
         for i in coords:
             if i[3] > biggest[3]:
                 biggest = i
-        biggest = np.array([i], np.int32)
+        biggest = np.array([biggest], np.int32)
     elif len(coords) == 1:
         biggest = coords
     else:
@@ -50,6 +84,64 @@ def detect_faces(img, classifier):
     return frame
 
 
+def make_face_tracker(classifier, margin=0.5, keyframeInterval=15):
+    """
+    Creates a FaceRoiTracker that runs the Haar face cascade.
+    """
+    return FaceRoiTracker(
+        lambda gray: classifier.detectMultiScale(gray, 1.3, 5),
+        margin,
+        keyframeInterval,
+    )
+
+
+class FrameContext:
+    """
+    Per-frame buffers shared by the tracker stages. The frame is converted to
+    gray once, and a small pyramid is built so the face cascade can run at low
+    resolution. Eyes and pupils are cropped as views of the native gray frame.
+
+    With a buffers.BufferPool the gray frame and the pyramid are written into
+    the pool's buffers, so they only stay valid until the next frame.
+    """
+
+    def __init__(self, frame, levels=1, pool=None):
+        self.frame = frame
+        height, width = frame.shape[:2]
+        dst = scratch(pool, "gray", (height, width))
+        self.gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=dst)
+        self.pyramid = [self.gray]
+        for level in range(levels):
+            # pyrDown's default size, rounded up
+            height, width = (height + 1) // 2, (width + 1) // 2
+            dst = scratch(pool, f"pyramid{level}", (height, width))
+            self.pyramid.append(cv2.pyrDown(self.pyramid[-1], dst=dst))
+        self.scale = 2**levels
+
+    @property
+    def small(self):
+        return self.pyramid[-1]
+
+
+def locate_face(ctx, classifier, tracker=None):
+    """
+    Finds the largest face on the smallest pyramid level and returns its
+    (x, y, w, h) box in native frame coordinates, or None.
+    """
+    if tracker is not None:
+        face = tracker.update(ctx.small)
+    else:
+        coords = classifier.detectMultiScale(ctx.small, 1.3, 5)
+        if len(coords) == 0:
+            return None
+        face = max(coords, key=lambda box: box[3])
+    if face is None:
+        return None
+    height, width = ctx.gray.shape[:2]
+    x, y, w, h = (int(v) * ctx.scale for v in face)
+    return x, y, min(w, width - x), min(h, height - y)
+
+
 def cut_eyebrows(img):
     height, width = img.shape[:2]
     eyebrow_h = int(height / 4)
@@ -57,56 +149,149 @@ def cut_eyebrows(img):
     return img
 
 
-def blob_process(img, threshold, detector):
-    gray_frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    _, img = cv2.threshold(gray_frame, threshold, 255, cv2.THRESH_BINARY)
-    # transformations to reduce noise:
-    img = cv2.erode(img, None, iterations=2)  # 1
-    img = cv2.dilate(img, None, iterations=4)  # 2
-    img = cv2.medianBlur(img, 5)  # 3
+def blob_process(img, threshold, detector, pool=None):
+    gray_frame = to_gray(img, pool)
+    shape = gray_frame.shape
+    mask = scratch(pool, "mask", shape)
+    _, img = cv2.threshold(gray_frame, threshold, 255, cv2.THRESH_BINARY, dst=mask)
+    # transformations to reduce noise, alternating between two buffers:
+    img = cv2.erode(img, None, dst=scratch(pool, "morph", shape), iterations=2)  # 1
+    img = cv2.dilate(img, None, dst=mask, iterations=4)  # 2
+    img = cv2.medianBlur(img, 5, dst=scratch(pool, "morph", shape))  # 3
 
     keypoints = detector.detect(img)
     return keypoints
 
 
+def pupil_centroid(img, threshold, pool=None):
+    """
+    Cheaper alternative to blob_process: thresholds the eye once and returns
+    the centroid of the largest dark region from its moments, as
+    ((x, y), area), or None.
+    """
+    gray_frame = to_gray(img, pool)
+    _, mask = cv2.threshold(
+        gray_frame,
+        threshold,
+        255,
+        cv2.THRESH_BINARY_INV,
+        dst=scratch(pool, "mask", gray_frame.shape),
+    )
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    largest = max(contours, key=cv2.contourArea)
+    moments = cv2.moments(largest)
+    if moments["m00"] == 0:
+        return None
+    centre = (moments["m10"] / moments["m00"], moments["m01"] / moments["m00"])
+    return centre, moments["m00"]
+
+
+# fraction of the (eyebrow cut) eye crop the pupil and iris cover once
+# thresholded, the same target GazeTracking calibrates its threshold to
+PUPIL_FRACTION = 0.48
+
+
+def dark_fraction(img, threshold):
+    gray_frame = to_gray(img)
+    return np.count_nonzero(gray_frame < threshold) / gray_frame.size
+
+
+def search_threshold(eyes, thresholds=range(5, 100, 5), target=PUPIL_FRACTION):
+    """
+    Picks the threshold for a set of eye crops whose dark fraction is closest
+    to target on average, preferring thresholds that find a pupil in every
+    crop and keep its position steady.
+    """
+    best, bestScore = None, None
+    for threshold in thresholds:
+        fractions = [dark_fraction(eye, threshold) for eye in eyes]
+        found = [pupil_centroid(eye, threshold) for eye in eyes]
+        centres = [
+            (x / eye.shape[1], y / eye.shape[0])
+            for eye, hit in zip(eyes, found)
+            if hit is not None
+            for x, y in [hit[0]]
+        ]
+        missed = 1 - len(centres) / len(eyes)
+        jitter = float(np.std(centres, axis=0).sum()) if len(centres) > 1 else 1.0
+        score = abs(np.mean(fractions) - target) + missed + jitter
+        if bestScore is None or score < bestScore:
+            best, bestScore = threshold, score
+    return best
+
+
+def histogram_threshold(img, target=PUPIL_FRACTION):
+    """
+    The gray level below which target of the eye's pixels lie, read off the
+    cumulative histogram. Used to re-tune without another search.
+    """
+    hist = cv2.calcHist([to_gray(img)], [0], None, [256], [0, 256]).ravel()
+    cumulative = np.cumsum(hist) / hist.sum()
+    return int(np.searchsorted(cumulative, target)) + 1
+
+
 def nothing(x):
     pass
 
 
-def main():
+def main(cap=None, levels=1):
     # camera capture
-    cap = cv2.VideoCapture(0)
+    if cap is None:
+        cap = cv2.VideoCapture(0)
     cv2.namedWindow("image")
+    # 0 means pick the threshold automatically from the eyes in view
     cv2.createTrackbar("threshold", "image", 0, 255, nothing)
+    # reuse the last face box between keyframes
+    face_tracker = make_face_tracker(face_cascade)
+    # frames and intermediate images are reused instead of reallocated
+    frames = FrameRing(1)
+    pool = BufferPool()
     while True:
         # take in frames
-        _, frame = cap.read()
-        # extract face location
-        face_frame = detect_faces(frame, face_cascade)
+        ret, frame = frames.read(cap)
+        if not ret:
+            break
+        # convert to gray once and detect the face at low resolution
+        ctx = FrameContext(frame, levels, pool)
+        face = locate_face(ctx, face_cascade, face_tracker)
         # if face extracted, find eyes
-        if face_frame is not None:
-            eyes = detect_eyes(face_frame, eye_cascade)
+        if face is not None:
+            face_gray = crop(ctx.gray, face)
+            face_frame = crop(frame, face)
+            threshold = cv2.getTrackbarPos("threshold", "image")  # moving threshold
+            eye_boxes = [box for box in detect_eye_boxes(face_gray, eye_cascade) if box]
+            if threshold == 0 and eye_boxes:
+                eyes = [cut_eyebrows(crop(face_gray, box)) for box in eye_boxes]
+                threshold = search_threshold(eyes)
+                cv2.setTrackbarPos("threshold", "image", threshold)
             # if eye(s) extracted, find pupils
-            for eye in eyes:
-                if eye is not None:
-                    threshold = cv2.getTrackbarPos(
-                        "threshold", "image"
-                    )  # moving threshold
-                    eye = cut_eyebrows(eye)
-                    keypoints = blob_process(eye, threshold, detector)
-                    eye = cv2.drawKeypoints(
+            for eye_box in eye_boxes:
+                if eye_box is not None:
+                    eye_gray = cut_eyebrows(crop(face_gray, eye_box))
+                    eye = cut_eyebrows(crop(face_frame, eye_box))
+                    keypoints = blob_process(eye_gray, threshold, detector, pool)
+                    cv2.drawKeypoints(
                         eye,
                         keypoints,
                         eye,
                         (0, 0, 255),
                         cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS,
                     )
-                    cv2.imshow("my image", face_frame)  # ???
-                    if cv2.waitKey(1) & 0xFF == ord("q"):
-                        break
-                    cap.release()
-                    cv2.destroyAllWindows()
+            cv2.imshow("my image", face_frame)
+        frames.release(frame)
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            break
+    cap.release()
+    cv2.destroyAllWindows()
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    from replay import ReplayCapture
+
+    parser = argparse.ArgumentParser(description="Haar cascade pupil tracker.")
+    parser.add_argument("--replay", help="play back a recorded session")
+    args = parser.parse_args()
+    main(ReplayCapture(args.replay, realtime=True) if args.replay else None)
@@ -0,0 +1,226 @@
+"""
+Per-stage timing for the tracking hot path.
+
+StageProfiler feeds rolling log-linear (HDR style) latency histograms, one per
+stage. When disabled every call returns immediately, so the hooks can stay in
+the loop. Histograms can be dumped as JSON or CSV on exit, on SIGUSR1, or
+drawn on a frame as a debug overlay.
+"""
+
+import csv
+import json
+import signal
+import threading
+import time
+
+import cv2
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of microsecond values with about 1.5% precision
+    (subBits=7), like HdrHistogram. Values above maxSeconds are clamped.
+    """
+
+    def __init__(self, subBits=7, maxSeconds=60):
+        self.subBits = subBits
+        self.subCount = 1 << subBits
+        self.half = self.subCount >> 1
+        self.size = self.index(int(maxSeconds * 1e6)) + 1
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.size
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, value):
+        if value < self.subCount:
+            return value
+        shift = value.bit_length() - self.subBits
+        return shift * self.half + (value >> shift)
+
+    def value(self, index):
+        """
+        Lower bound, in microseconds, of the values counted in a bucket.
+        """
+        if index < self.subCount:
+            return index
+        shift = index // self.half - 1
+        return (index - shift * self.half) << shift
+
+    def add(self, seconds):
+        value = int(seconds * 1e6)
+        if value < 0:
+            value = 0
+        self.counts[min(self.index(value), self.size - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """
+        Returns the p-th percentile in milliseconds.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(p / 100 * self.count)))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.value(i), self.max) / 1000
+        return self.max / 1000
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max / 1000,
+        }
+
+    def export(self):
+        """
+        The non-empty buckets and totals, e.g. to merge on another machine.
+        """
+        return {
+            "subBits": self.subBits,
+            "count": self.count,
+            "total_us": self.total,
+            "max_us": self.max,
+            "bins": [[i, n] for i, n in enumerate(self.counts) if n],
+        }
+
+
+class RollingHistogram:
+    """
+    Histogram over roughly the last window seconds, kept as two halves that
+    are rotated rather than storing every sample.
+    """
+
+    def __init__(self, window=10.0):
+        self.window = window
+        self.current = LatencyHistogram()
+        self.previous = LatencyHistogram()
+        self.rotated = time.perf_counter()
+
+    def add(self, seconds, now):
+        if now - self.rotated > self.window / 2:
+            self.previous, self.current = self.current, self.previous
+            self.current.reset()
+            self.rotated = now
+        self.current.add(seconds)
+
+    def snapshot(self):
+        merged = LatencyHistogram()
+        merged.merge(self.previous)
+        merged.merge(self.current)
+        return merged
+
+
+class StageProfiler:
+    """
+    Collects per-stage timings. Usage in a loop:
+
+        start = profiler.clock()
+        gaze.refresh(frame)
+        start = profiler.lap("refresh", start)
+
+    lap records the time since start and returns the current time so stages
+    can be chained. "latency" is recorded from the frame's capture timestamp.
+    """
+
+    def __init__(self, enabled=False, window=10.0):
+        self.enabled = enabled
+        self.window = window
+        self.lock = threading.Lock()
+        self.histograms = {}
+        # plain histograms since the last take(), once something calls it
+        self.intervals = None
+
+    def clock(self):
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    def lap(self, stage, start):
+        if not self.enabled:
+            return 0.0
+        now = time.perf_counter()
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = RollingHistogram(self.window)
+            histogram.add(now - start, now)
+            if self.intervals is not None:
+                interval = self.intervals.get(stage)
+                if interval is None:
+                    interval = self.intervals[stage] = LatencyHistogram()
+                interval.add(now - start)
+        return now
+
+    def take(self):
+        """
+        Returns the {stage: LatencyHistogram} recorded since the previous
+        call and starts a new interval. The first call starts collecting.
+        """
+        with self.lock:
+            taken, self.intervals = self.intervals or {}, {}
+        return taken
+
+    def summary(self):
+        with self.lock:
+            snapshots = {stage: h.snapshot() for stage, h in self.histograms.items()}
+        return {stage: h.summary() for stage, h in snapshots.items()}
+
+    def dump(self, path):
+        """
+        Writes the current summary as CSV if path ends in .csv, else JSON.
+        """
+        summary = self.summary()
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                fields = ["count", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+                writer.writerow(["stage"] + fields)
+                for stage, row in summary.items():
+                    writer.writerow([stage] + [row[field] for field in fields])
+        else:
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+
+    def dump_on_signal(self, path, signum=getattr(signal, "SIGUSR1", None)):
+        """
+        Dumps to path whenever the process receives signum (SIGUSR1 by
+        default, not available on Windows). Must be called from the main
+        thread.
+        """
+        if signum is None:
+            return
+        signal.signal(signum, lambda *args: self.dump(path))
+
+    def draw_overlay(self, frame):
+        """
+        Writes p50/p99 per stage onto a frame in place.
+        """
+        y = 20
+        for stage, row in self.summary().items():
+            text = f"{stage}: p50 {row['p50_ms']:.1f} ms  p99 {row['p99_ms']:.1f} ms"
+            cv2.putText(
+                frame, text, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1
+            )
+            y += 20
+        return frame
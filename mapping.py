@@ -0,0 +1,186 @@
+"""
+Gaze to screen mapping models.
+
+Every model maps an (x, y) pupil position on the webcam frame to a (column,
+row) cell on the screen grid. After calibration the MappingEngine evaluates
+the chosen model once over the whole observed pupil range and stores the
+result in a lookup table, so the per-frame cost is one array index no matter
+how expensive the model is.
+"""
+
+import numpy as np
+
+
+class SeparableQuadratic:
+    """
+    The original mapping: two independent quadratics, x eye -> column and
+    y eye -> row.
+    """
+
+    def __init__(self):
+        self.xcoeffs = None
+        self.ycoeffs = None
+
+    @classmethod
+    def from_coeffs(cls, xcoeffs, ycoeffs):
+        model = cls()
+        model.xcoeffs = np.asarray(xcoeffs, dtype=float)
+        model.ycoeffs = np.asarray(ycoeffs, dtype=float)
+        return model
+
+    def fit(self, eye, cells):
+        self.xcoeffs = np.polyfit(eye[:, 0], cells[:, 0], 2)
+        self.ycoeffs = np.polyfit(eye[:, 1], cells[:, 1], 2)
+        return self
+
+    def predict(self, eye):
+        return np.column_stack(
+            (np.polyval(self.xcoeffs, eye[:, 0]), np.polyval(self.ycoeffs, eye[:, 1]))
+        )
+
+
+class Polynomial2D:
+    """
+    Full 2-D polynomial with cross terms, fitted by ridge-regularised least
+    squares. The regulariser keeps the cross terms stable when the
+    calibration dots only cover a cross shape on the screen.
+    """
+
+    def __init__(self, degree=2, ridge=1e-6):
+        self.degree = degree
+        self.ridge = ridge
+        self.coeffs = None
+        self.center = None
+        self.scale = None
+
+    def features(self, eye):
+        # normalise so the powers stay well conditioned
+        x, y = ((eye - self.center) / self.scale).T
+        return np.column_stack(
+            [x ** (d - i) * y**i for d in range(self.degree + 1) for i in range(d + 1)]
+        )
+
+    def fit(self, eye, cells):
+        self.center = eye.mean(axis=0)
+        self.scale = np.maximum(eye.std(axis=0), 1e-6)
+        A = self.features(eye)
+        reg = self.ridge * len(A) * np.eye(A.shape[1])
+        reg[0, 0] = 0  # don't shrink the constant term
+        self.coeffs = np.linalg.solve(A.T @ A + reg, A.T @ cells)
+        return self
+
+    def predict(self, eye):
+        return self.features(eye) @ self.coeffs
+
+
+class ThinPlateSpline:
+    """
+    Thin-plate spline RBF interpolation. Smoothing > 0 turns exact
+    interpolation into a regularised fit, which is what noisy pupil samples
+    need.
+    """
+
+    def __init__(self, smoothing=1.0, neighbors=None):
+        self.smoothing = smoothing
+        self.neighbors = neighbors
+        self.rbf = None
+
+    def fit(self, eye, cells):
+        from scipy.interpolate import RBFInterpolator
+
+        self.rbf = RBFInterpolator(
+            eye,
+            cells,
+            kernel="thin_plate_spline",
+            smoothing=self.smoothing,
+            neighbors=self.neighbors,
+        )
+        return self
+
+    def predict(self, eye):
+        return self.rbf(eye)
+
+
+MODELS = {
+    "quadratic": SeparableQuadratic,
+    "poly2d": Polynomial2D,
+    "rbf": ThinPlateSpline,
+}
+
+
+def make_model(name, **kwargs):
+    if name not in MODELS:
+        raise ValueError(f"Unknown mapping model {name!r}, choose from {list(MODELS)}")
+    return MODELS[name](**kwargs)
+
+
+class MappingEngine:
+    """
+    Fits a mapping model and compiles it into a dense lookup table over the
+    observed pupil range.
+
+    step is the table resolution in webcam pixels (coarsened if the table
+    would exceed maxSize entries per axis) and margin extends the table beyond
+    the calibration range by that fraction on each side.
+    """
+
+    def __init__(
+        self, model, gridWidth, gridHeight, step=0.25, margin=0.25, maxSize=1024
+    ):
+        self.model = model
+        self.gridWidth = gridWidth
+        self.gridHeight = gridHeight
+        self.step = step
+        self.margin = margin
+        self.maxSize = maxSize
+
+        self.lut = None
+        self.origin = None
+        self.maxIndex = None
+
+    def fit(self, eye, cells):
+        eye = np.asarray(eye, dtype=float)
+        cells = np.asarray(cells, dtype=float)
+        self.model.fit(eye, cells)
+        self.compile(eye.min(axis=0), eye.max(axis=0))
+        return self
+
+    def to_cells(self, values):
+        cells = np.floor(values)
+        cells[..., 0] = np.clip(cells[..., 0], 0, self.gridWidth - 1)
+        cells[..., 1] = np.clip(cells[..., 1], 0, self.gridHeight - 1)
+        return cells.astype(np.int16)
+
+    def compile(self, low, high):
+        """
+        Evaluates the model over [low, high] (plus margin) and stores the
+        resulting cells in a (rows, cols, 2) table.
+        """
+        low = np.asarray(low, dtype=float)
+        high = np.asarray(high, dtype=float)
+        pad = (high - low) * self.margin
+        low, high = low - pad, high + pad
+        self.step = max(self.step, float(np.max(high - low)) / self.maxSize)
+
+        xs = np.arange(low[0], high[0] + self.step, self.step)
+        ys = np.arange(low[1], high[1] + self.step, self.step)
+        gx, gy = np.meshgrid(xs, ys)
+        eye = np.column_stack((gx.ravel(), gy.ravel()))
+
+        values = self.model.predict(eye).reshape(len(ys), len(xs), 2)
+        self.lut = self.to_cells(values)
+        self.origin = low
+        self.maxIndex = (len(xs) - 1, len(ys) - 1)
+        return self
+
+    def cell(self, x, y):
+        """
+        Returns the (column, row) grid cell for a pupil position.
+        """
+        if self.lut is None:
+            col, row = self.to_cells(self.model.predict(np.array([[x, y]])))[0]
+            return int(col), int(row)
+        ix = min(max(int((x - self.origin[0]) / self.step + 0.5), 0), self.maxIndex[0])
+        iy = min(max(int((y - self.origin[1]) / self.step + 0.5), 0), self.maxIndex[1])
+        col, row = self.lut[iy, ix]
+        return int(col), int(row)
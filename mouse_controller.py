@@ -1,7 +1,16 @@
+import time
 import cv2
-from GazeTracking.gaze_tracking import GazeTracking
-import pyautogui
 import numpy as np
+from buffers import FrameRing
+from capture import frame_time
+from pipeline import GazePipeline
+from procpool import ProcessPipeline
+from mapping import MappingEngine, SeparableQuadratic
+from filters import make_filter
+from instrumentation import StageProfiler
+from actuator import CursorActuator, make_backend
+from drift import ClickListener, DriftCorrector
+from fixation import FIXATION, SACCADE, FixationClassifier
 
 
 class MouseController:
@@ -15,6 +24,27 @@ class MouseController:
         cellHeight,
         screenWidth,
         screenHeight,
+        threaded=False,
+        reportInterval=None,
+        mapper=None,
+        smoothing="average",
+        smoothingParams=None,
+        cursor=None,
+        cursorBackend="pyautogui",
+        interpolate=False,
+        autostart=True,
+        profiler=None,
+        profileOutput=None,
+        debugOverlay=False,
+        driftCorrection=False,
+        driftParams=None,
+        snapper=None,
+        processes=0,
+        detector="dlib",
+        detectorParams=None,
+        adaptive=False,
+        fixationParams=None,
+        fixationStride=3,
     ):
         self.xcoeffs = xcoeffs
         self.ycoeffs = ycoeffs
@@ -29,136 +59,378 @@ class MouseController:
         self.gridWidth = screenWidth // cellWidth
         self.gridHeight = screenHeight // cellHeight
 
-        # Moving average
-        self.xDataFrame = []
-        self.yDataFrame = []
+        # Gaze to grid cell mapping, precompiled to a lookup table by calibration
+        if mapper is None:
+            mapper = MappingEngine(
+                SeparableQuadratic.from_coeffs(xcoeffs, ycoeffs),
+                self.gridWidth,
+                self.gridHeight,
+            )
+        self.mapper = mapper
+
+        # Smoothing filter: "average", "one_euro" or "kalman"
         self.avgFrames = 3
+        params = dict(smoothingParams or {})
+        if smoothing == "average":
+            params.setdefault("size", self.avgFrames)
+        self.smoother = make_filter(smoothing, **params)
+
+        # Run capture, gaze tracking and the cursor on separate threads
+        self.threaded = threaded
+        self.reportInterval = reportInterval
+        self.pipeline = None
+
+        # With processes > 0 the threaded mode runs detection in that many
+        # worker processes, each loading its own detector by name
+        self.processes = processes
+        self.detector = detector
+        self.detectorParams = detectorParams
+
+        # Cursor moves run on their own thread and are skipped when the
+        # target cell hasn't changed. Anything with a moveTo(x, y) works here.
+        if cursor is None:
+            cursor = CursorActuator(
+                make_backend(cursorBackend),
+                cellWidth,
+                cellHeight,
+                interpolate=interpolate,
+            )
+        self.cursor = cursor
+
+        # Per-stage timings, only collected when something will read them
+        if profiler is None:
+            profiler = StageProfiler(enabled=bool(profileOutput or debugOverlay))
+        self.profiler = profiler
+        self.profileOutput = profileOutput
+        self.debugOverlay = debugOverlay
+        self.lastFrame = None
+        self.windowsShown = False
+        # the serial loop reads every frame into the same buffer
+        self.frames = FrameRing(1)
+        if profileOutput:
+            self.profiler.dump_on_signal(profileOutput)
+
+        # Fixation aware processing: during a fixation only every
+        # fixationStride-th frame is processed, with a cheap pupil refinement
+        # when the detector has one. A saccade goes back to full detection.
+        self.fixation = None
+        if adaptive:
+            self.fixation = FixationClassifier(**(fixationParams or {}))
+        self.fixationStride = fixationStride
+        self.frameIndex = 0
+        self.work = {"full": 0, "refined": 0, "skipped": 0}
+
+        # Pulls the cursor toward nearby click targets, see snapping.py
+        self.snapper = snapper
+
+        # Background recalibration from clicks and single dot prompts (R key)
+        self.drift = None
+        self.clicks = None
+        self.promptImage = None
+        if driftCorrection:
+            self.drift = DriftCorrector(
+                xcoeffs,
+                ycoeffs,
+                self.mapper,
+                cellWidth,
+                cellHeight,
+                self.swapMapping,
+                **(driftParams or {}),
+            )
+            try:
+                self.clicks = ClickListener(self.drift.confirm)
+                self.clicks.start()
+            except ImportError:
+                print("pynput is not installed, drift correction uses prompts only")
 
-        self.startController()
+        if autostart:
+            self.startController()
 
     def startController(self):
-        controlMouse = True
-        while controlMouse:
-            if cv2.waitKey(1) == 27:
-                controlMouse = False
-                break
+        if self.threaded:
+            self.startPipeline()
+            return
 
-            # We get a new frame from the webcam
-            _, frame = self.webcam.read()
+        # Esc only reaches us through a HighGUI window, so without one the
+        # loop doesn't pay for waitKey and stops on Ctrl+C instead
+        windows = self.usesWindows() and self.showControls()
+        try:
+            while True:
+                if windows and not self.handleKey(cv2.waitKey(1)):
+                    break
 
-            # We send this frame to GazeTracking to analyze it
-            self.gaze.refresh(frame)
+                # We get a new frame from the webcam
+                start = self.profiler.clock()
+                ret, frame = self.frames.read(self.webcam)
+                if not ret or frame is None:
+                    break
+                self.profiler.lap("capture", start)
+                stamp = frame_time(self.webcam, time.perf_counter())
 
-            # Get pupil Data
-            left_pupil = self.gaze.pupil_left_coords()
-            right_pupil = self.gaze.pupil_right_coords()
-
-            if left_pupil and right_pupil:
-                # Process pupil data and get pixels
-                eyegaze = [
-                    (left_pupil[0] + right_pupil[0]) / 2,
-                    (left_pupil[1] + right_pupil[1]) / 2,
-                ]
-                smoothedAvg = self.movingAverage(eyegaze)
-                xPixel = (
-                    np.clip(
-                        int(
-                            self.xcoeffs[0] * smoothedAvg[0] ** 2
-                            + self.xcoeffs[1] * smoothedAvg[0]
-                            + self.xcoeffs[2]
-                        ),
-                        0,
-                        self.gridWidth - 1,
-                    )
-                    * self.cellWidth
-                    + self.cellWidth / 2
-                )
-                yPixel = (
-                    np.clip(
-                        int(
-                            self.ycoeffs[0] * smoothedAvg[1] ** 2
-                            + self.ycoeffs[1] * smoothedAvg[1]
-                            + self.ycoeffs[2]
-                        ),
-                        0,
-                        self.gridHeight - 1,
-                    )
-                    * self.cellHeight
-                    + self.cellWidth / 2
+                target = self.processFrame(frame, stamp)
+                if target is not None:
+                    self.moveCursor(target, stamp)
+                self.showOverlay()
+                self.showPrompt()
+                self.frames.release(frame)
+        except KeyboardInterrupt:
+            pass
+
+        self.stopController()
+
+    def stopController(self):
+        if hasattr(self.cursor, "stop"):
+            self.cursor.stop()
+        if self.clicks is not None:
+            self.clicks.stop()
+        if self.drift is not None:
+            self.drift.stop()
+        if self.profileOutput:
+            self.profiler.dump(self.profileOutput)
+        if self.webcam is not None:
+            self.webcam.release()
+        if self.windowsShown:
+            cv2.destroyAllWindows()
+
+    def usesWindows(self):
+        """
+        Whether the controller shows HighGUI windows: the debug overlay and
+        the drift correction prompt.
+        """
+        return self.debugOverlay or self.drift is not None
+
+    def showControls(self):
+        """
+        HighGUI only delivers keys to an open window, and without the debug
+        overlay none is open until a prompt shows, so drift correction gets
+        a small window to press R in. Returns False if HighGUI can't open
+        windows (opencv-python-headless). Main thread only.
+        """
+        if self.debugOverlay:
+            return True
+        image = np.full((60, 360, 3), 40, np.uint8)
+        cv2.putText(
+            image,
+            "R: drift prompt  Esc: stop",
+            (10, 38),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.7,
+            (255, 255, 255),
+            1,
+        )
+        try:
+            cv2.namedWindow("gaze control", cv2.WINDOW_AUTOSIZE)
+            cv2.imshow("gaze control", image)
+        except cv2.error:
+            if self.clicks is None:
+                print(
+                    "No window for the R key and pynput is not installed: "
+                    "drift correction has no input and does nothing"
                 )
-                pyautogui.moveTo(xPixel, yPixel)  # move to point on screen
-
-        self.webcam.release()
-        cv2.destroyAllWindows()
-
-    def movingAverage(self, eyeGaze):
-        self.xDataFrame.append(eyeGaze[0])
-        if len(self.xDataFrame) > self.avgFrames:
-            self.xDataFrame.pop(0)
-        self.yDataFrame.append(eyeGaze[1])
-        if len(self.yDataFrame) > self.avgFrames:
-            self.yDataFrame.pop(0)
-        return [np.mean(self.xDataFrame), np.mean(self.yDataFrame)]
-
-
-# # GRAVITATE MOUSE TOWARD CLICKABLE ITEMS (NOT INTEGRATED)
-#     # launch google
-#     mainGoogle = 'https://www.google.com/'
-#     driver = webdriver.Chrome()
-#     driver.maximize_window()
-#     driver.get(mainGoogle)
-
-#     scannedElements = getClickableElements(driver )
-#     scanFlag = False
-#     xPixel, yPixel = weight_elements(xPixel, yPixel, scannedElements)
-
-# def getClickableElements(driver):
-#     # Get all button and anchor (link) elements
-#     buttons = driver.find_elements(By.CSS_SELECTOR, 'button, a')
-#     searchbars= driver.find_elements(By.NAME, 'q')
-#     buttons.extend(searchbars)
-#     elements = []
-#     for button in buttons:
-#         if button.is_displayed():  # Only consider visible buttons
-#             location = button.location  # Get the top-left coordinates of the element
-#             size = button.size  # Get the width and height of the element
-
-#             # Calculate the center coordinates
-#             center_x = location['x'] + size['width'] / 2
-#             center_y = location['y'] + size['height'] / 2
-#             elements.append([center_x, center_y])
-
-#             print(f"Clickable element: {button.text}, Center: ({center_x}, {center_y})")
-#     return elements
-
-
-# def calculate_distance(point1, point2):
-#     return np.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
-
-# # Function to weight elements by proximity
-# def weight_elements(gaze_x, gaze_y, elements, snap_threshold=120, weight_exponent=6):
-#     gaze_point = (gaze_x, gaze_y)
-#     distances = []
-
-#     for index, element in enumerate(elements):
-#         dist = calculate_distance(gaze_point, element)
-#         distances.append((index, dist))
-
-#     # Sort clickable elements by distance from gaze point
-#     distances = sorted(distances, key=lambda tup: tup[1])
-
-#     # Apply weights based on proximity
-#     total_weight = 0
-#     weighted_position = np.array([0.0, 0.0])
-
-#     for element, distance in distances:
-#         if distance < snap_threshold:
-#             weight = (snap_threshold - distance) ** weight_exponent
-#             weighted_position += np.array(elements[element]) * weight
-#             total_weight += weight
-
-#     # Return weighted average position if within threshold
-#     if total_weight > 0:
-#         return weighted_position / total_weight
-#     else:
-#         return gaze_point  # Return original gaze point if no snapping
+            else:
+                print("No window for the R key, drift correction uses clicks only")
+            return False
+        self.windowsShown = True
+        return True
+
+    def showOverlay(self):
+        """
+        Shows the last processed frame with stage latencies drawn on it.
+        Only called from the main thread, as HighGUI requires.
+        """
+        frame = self.lastFrame
+        if self.debugOverlay and frame is not None:
+            self.windowsShown = True
+            cv2.imshow("debug", self.profiler.draw_overlay(frame.copy()))
+
+    def handleKey(self, key):
+        """
+        Handles a HighGUI key press. Returns False when the controller should
+        stop (Esc).
+        """
+        if key == 27:
+            return False
+        if key == ord("r") and self.drift is not None:
+            self.startPrompt()
+        return True
+
+    def startPrompt(self):
+        """
+        Asks the user to look at a dot at a random cell for drift correction.
+        Returns the dot's screen position.
+        """
+        column = np.random.randint(1, self.gridWidth - 1)
+        row = np.random.randint(1, self.gridHeight - 1)
+        x = column * self.cellWidth + self.cellWidth // 2
+        y = row * self.cellHeight + self.cellHeight // 2
+        image = np.full((self.screenHeight, self.screenWidth, 3), 255, np.uint8)
+        cv2.circle(image, (x, y), 10, (0, 0, 255), -1)
+        self.promptImage = image
+        self.drift.begin_prompt(x, y)
+        return x, y
+
+    def showPrompt(self):
+        """
+        Shows or hides the drift correction dot. Main thread only.
+        """
+        if self.promptImage is None:
+            return
+        if self.drift.prompt is None:
+            self.promptImage = None
+            cv2.destroyWindow("recalibrate")
+            return
+        self.windowsShown = True
+        cv2.namedWindow("recalibrate", cv2.WND_PROP_FULLSCREEN)
+        cv2.setWindowProperty(
+            "recalibrate", cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN
+        )
+        cv2.imshow("recalibrate", self.promptImage)
+
+    def swapMapping(self, mapper, xcoeffs, ycoeffs):
+        """
+        Called from the drift thread with a recompiled mapper. One attribute
+        assignment, so the control loop picks it up on its next frame.
+        """
+        self.mapper = mapper
+        self.xcoeffs = xcoeffs
+        self.ycoeffs = ycoeffs
+
+    def startPipeline(self):
+        """
+        Runs the controller as a capture -> inference -> actuator pipeline.
+        Stale frames are dropped so the cursor follows the newest frame.
+        """
+        if self.processes:
+            self.pipeline = ProcessPipeline(
+                self.webcam,
+                self.processPupils,
+                self.moveCursor,
+                workers=self.processes,
+                detector=self.detector,
+                detectorParams=self.detectorParams,
+                detectorSettings=(
+                    self.gaze.settings() if hasattr(self.gaze, "settings") else None
+                ),
+                reportInterval=self.reportInterval,
+                profiler=self.profiler,
+            )
+        else:
+            self.pipeline = GazePipeline(
+                self.webcam,
+                self.processFrame,
+                self.moveCursor,
+                reportInterval=self.reportInterval,
+                profiler=self.profiler,
+            )
+        try:
+            self.pipeline.start()
+            windows = self.usesWindows() and self.showControls()
+            while not self.pipeline.wait(0.05):
+                if not windows:
+                    continue
+                self.showOverlay()
+                self.showPrompt()
+                if not self.handleKey(cv2.waitKey(1)):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.pipeline.stop()
+            print(self.pipeline.report())
+
+        self.stopController()
+
+    def processFrame(self, frame, stamp=None):
+        """
+        Runs gaze tracking on a frame captured at stamp (perf_counter time,
+        now if None) and returns the (x, y) pixel to move the mouse to, or
+        None if both pupils were not found.
+        """
+        if self.debugOverlay:
+            # threaded, the frame's buffer is read into again while the main
+            # thread may still be drawing it
+            self.lastFrame = frame.copy() if self.threaded else frame
+
+        fixating = self.fixation is not None and self.fixation.state == FIXATION
+        if fixating:
+            self.frameIndex += 1
+            if self.frameIndex % self.fixationStride:
+                self.work["skipped"] += 1
+                return None
+
+        # We send this frame to the pupil detector to analyze it
+        start = self.profiler.clock()
+        if fixating and self.refine(frame):
+            start = self.profiler.lap("refine", start)
+        else:
+            self.gaze.refresh(frame)
+            self.work["full"] += 1
+            start = self.profiler.lap("refresh", start)
+
+        # Get pupil Data
+        left_pupil = self.gaze.pupil_left_coords()
+        right_pupil = self.gaze.pupil_right_coords()
+        self.profiler.lap("pupils", start)
+        return self.processPupils(left_pupil, right_pupil, stamp)
+
+    def refine(self, frame):
+        """
+        Tries the detector's cheap refinement. Returns False if a full
+        refresh is needed: no refinement, or the pupils moved further than a
+        fixation allows, i.e. a saccade started.
+        """
+        if not hasattr(self.gaze, "refine") or not self.gaze.refine(frame):
+            return False
+        left = self.gaze.pupil_left_coords()
+        right = self.gaze.pupil_right_coords()
+        x, y = self.fixation.last()
+        moved = abs((left[0] + right[0]) / 2 - x) + abs((left[1] + right[1]) / 2 - y)
+        if moved > self.fixation.dispersionThreshold:
+            return False
+        self.work["refined"] += 1
+        return True
+
+    def processPupils(self, left_pupil, right_pupil, stamp=None):
+        """
+        Smooths and maps one frame's pupil positions to the (x, y) pixel to
+        move the mouse to, or None if both pupils were not found. Velocities
+        are measured between capture times (stamp), not processing times,
+        which skipped frames and queueing would distort.
+        """
+        start = self.profiler.clock()
+        if left_pupil and right_pupil:
+            # Process pupil data and get pixels
+            eyegaze = [
+                (left_pupil[0] + right_pupil[0]) / 2,
+                (left_pupil[1] + right_pupil[1]) / 2,
+            ]
+            if self.fixation is not None:
+                previous = self.fixation.state
+                state = self.fixation.update(eyegaze[0], eyegaze[1], stamp)
+                if state == SACCADE and previous != SACCADE:
+                    # jump to the new target instead of averaging across it
+                    self.smoother.reset()
+            smoothedAvg = self.smoother.update(eyegaze[0], eyegaze[1], stamp)
+            if self.drift is not None:
+                self.drift.observe(smoothedAvg)
+            target = self.gazeToPixel(smoothedAvg)
+            start = self.profiler.lap("mapping", start)
+            if self.snapper is not None:
+                target = self.snapper.snap(target[0], target[1])
+                self.profiler.lap("snap", start)
+            return target
+        return None
+
+    def gazeToPixel(self, smoothedAvg):
+        column, row = self.mapper.cell(smoothedAvg[0], smoothedAvg[1])
+        xPixel = column * self.cellWidth + self.cellWidth / 2
+        yPixel = row * self.cellHeight + self.cellHeight / 2
+        return xPixel, yPixel
+
+    def moveCursor(self, target, stamp=None):
+        start = self.profiler.clock()
+        self.cursor.moveTo(target[0], target[1])  # move to point on screen
+        self.profiler.lap("move", start)
+        if stamp is not None:
+            # capture to cursor latency
+            self.profiler.lap("latency", stamp)
@@ -0,0 +1,278 @@
+"""
+Staged capture -> inference -> actuation pipeline for the mouse controller.
+
+Each stage runs on its own thread so a slow gaze refresh never holds up the
+camera or the cursor. Stale work is dropped rather than queued: the capture
+stage only keeps the newest frame and the queue between inference and the
+actuator is bounded.
+"""
+
+import asyncio
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+from buffers import FrameRing
+from capture import frame_time
+
+
+class LatestFrameSlot:
+    """
+    Single-slot mailbox holding only the most recent frame.
+    Writing a new frame before the old one was read drops the old one,
+    which put returns so its buffer can be reused.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.item = None
+        self.seq = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame, timestamp):
+        with self.cond:
+            dropped = None
+            if self.item is not None:
+                self.dropped += 1
+                dropped = self.item[2]
+            self.item = (self.seq, timestamp, frame)
+            self.seq += 1
+            self.cond.notify()
+            return dropped
+
+    def get(self, timeout=None):
+        """
+        Returns (seq, timestamp, frame), or None if the slot was closed or
+        nothing arrived within the timeout.
+        """
+        with self.cond:
+            if self.item is None and not self.closed:
+                self.cond.wait(timeout)
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+# queue.Queue and asyncio.Queue raise different exceptions
+FULL = (queue.Full, asyncio.QueueFull)
+EMPTY = (queue.Empty, asyncio.QueueEmpty)
+
+STAGES = ("capture", "inference", "actuator")
+
+
+def put_latest(q, item):
+    """
+    Puts item on a bounded queue.Queue or asyncio.Queue, discarding the
+    oldest entries when full. Returns the dropped entries, an empty list if
+    there were none.
+    """
+    dropped = []
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except FULL:
+            try:
+                dropped.append(q.get_nowait())
+            except EMPTY:
+                pass
+
+
+class StageStats:
+    """
+    Counts items handled by one stage and the time spent working on them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.count = 0
+        self.busy = 0.0
+        self.dropped = 0
+        self.started = time.perf_counter()
+
+    def tick(self, busy):
+        with self.lock:
+            self.count += 1
+            self.busy += busy
+
+    def drop(self, n=1):
+        with self.lock:
+            self.dropped += n
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            return {
+                "stage": self.name,
+                "count": self.count,
+                "dropped": self.dropped,
+                "fps": self.count / elapsed,
+                "avg_ms": 1000 * self.busy / self.count if self.count else 0.0,
+            }
+
+
+def stage_stats(stages=STAGES):
+    return {name: StageStats(name) for name in stages}
+
+
+def latency_log(size=10000):
+    """
+    Holds the capture to cursor latency of the most recent frames, in
+    seconds.
+    """
+    return collections.deque(maxlen=size)
+
+
+def latency_percentiles(latencies, percentiles=(50, 90, 99)):
+    """
+    The percentiles of latencies in milliseconds, keyed "p50" and so on.
+    """
+    latencies = np.array(latencies) * 1000
+    return {
+        f"p{p}": float(np.percentile(latencies, p)) if len(latencies) else 0.0
+        for p in percentiles
+    }
+
+
+def format_report(snapshots):
+    """
+    One line summary of StageStats snapshots.
+    """
+    return " | ".join(
+        "{stage}: {fps:.1f} fps, {avg_ms:.1f} ms, {dropped} dropped".format(**s)
+        for s in snapshots
+    )
+
+
+class GazePipeline:
+    """
+    Runs capture, inference and actuation on separate threads.
+
+    process(frame, stamp) turns a frame into a cursor target (or None) and
+    actuate(target, stamp) applies it, where stamp is the frame's capture
+    time. Both are called from worker threads.
+
+    Frames are read into a FrameRing: one being captured, one waiting in the
+    slot and one being processed. process must not keep the frame after it
+    returns, its buffer is read into again.
+    """
+
+    def __init__(
+        self,
+        webcam,
+        process,
+        actuate,
+        queueSize=1,
+        reportInterval=None,
+        profiler=None,
+    ):
+        self.webcam = webcam
+        self.process = process
+        self.actuate = actuate
+        self.reportInterval = reportInterval
+        self.profiler = profiler
+
+        self.slot = LatestFrameSlot()
+        self.frames = FrameRing(3)
+        self.targets = queue.Queue(maxsize=queueSize)
+        self.stopEvent = threading.Event()
+
+        self.stats = stage_stats()
+        self.threads = []
+        self.latencies = latency_log()
+
+    def start(self):
+        self.stopEvent.clear()
+        for target in (self.capture_loop, self.inference_loop, self.actuator_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.slot.close()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+
+    def is_running(self):
+        return not self.stopEvent.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the pipeline stops or the timeout expires.
+        Returns True if the pipeline has stopped.
+        """
+        return self.stopEvent.wait(timeout)
+
+    def run(self):
+        """
+        Starts the pipeline and blocks until it stops, printing throughput
+        every reportInterval seconds if set.
+        """
+        self.start()
+        try:
+            while not self.wait(self.reportInterval):
+                print(self.report())
+        finally:
+            self.stop()
+
+    def capture_loop(self):
+        stats = self.stats["capture"]
+        while not self.stopEvent.is_set():
+            start = time.perf_counter()
+            ret, frame = self.frames.read(self.webcam)
+            if not ret or frame is None:
+                # end of stream or camera failure
+                self.stopEvent.set()
+                self.slot.close()
+                break
+            end = time.perf_counter()
+            stamp = frame_time(self.webcam, end)
+            self.frames.release(self.slot.put(frame, stamp))
+            stats.tick(end - start)
+            if self.profiler is not None:
+                self.profiler.lap("capture", start)
+
+    def inference_loop(self):
+        stats = self.stats["inference"]
+        while not self.stopEvent.is_set():
+            item = self.slot.get(timeout=0.1)
+            if item is None:
+                continue
+            seq, stamp, frame = item
+            start = time.perf_counter()
+            target = self.process(frame, stamp)
+            self.frames.release(frame)
+            stats.tick(time.perf_counter() - start)
+            if target is not None and put_latest(self.targets, (seq, stamp, target)):
+                stats.drop()
+
+    def actuator_loop(self):
+        stats = self.stats["actuator"]
+        while not self.stopEvent.is_set():
+            try:
+                seq, stamp, target = self.targets.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            self.actuate(target, stamp)
+            end = time.perf_counter()
+            stats.tick(end - start)
+            self.latencies.append(end - stamp)
+
+    def snapshot(self):
+        self.stats["capture"].dropped = self.slot.dropped
+        return [stats.snapshot() for stats in self.stats.values()]
+
+    def report(self):
+        return format_report(self.snapshot())
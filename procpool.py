@@ -0,0 +1,327 @@
+"""
+Multi-process gaze pipeline.
+
+Pupil detection holds the GIL for its Python parts, so threads alone keep it
+on one core. ProcessPipeline has the camera read straight into a shared memory
+ring and hands slot numbers to worker processes, each with its own detector. The
+pupil coordinates come back tagged with the frame's sequence number and are
+put back in capture order before smoothing, mapping and the cursor, which
+stay in the main process.
+"""
+
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from capture import frame_time
+from pipeline import GazePipeline, put_latest
+
+
+class SharedFrameRing:
+    """
+    slots frames of one shape and dtype in a single shared memory block.
+    Create it in the parent, attach to it by name in the workers.
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = slots * int(np.prod(shape)) * self.dtype.itemsize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray(
+            (slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf
+        )
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # the array has to go before the buffer it points into
+        self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def worker_main(ring, slots, shape, detector, detectorParams, settings, tasks, results):
+    """
+    Worker process: attaches to the ring, loads its own detector and turns
+    (seq, slot) tasks into (seq, slot, left, right, busy) results. A failure
+    is reported as ("error", pid, message) before the worker exits.
+    """
+    frames = None
+    try:
+        from detectors import make_detector
+
+        frames = SharedFrameRing(slots, shape, name=ring)
+        gaze = make_detector(detector, **detectorParams)
+        if settings and hasattr(gaze, "load_settings"):
+            gaze.load_settings(settings)
+        results.put(("ready", os.getpid()))
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot = task
+            start = time.perf_counter()
+            gaze.refresh(frames.frames[slot])
+            left = gaze.pupil_left_coords()
+            right = gaze.pupil_right_coords()
+            results.put((seq, slot, left, right, time.perf_counter() - start))
+    except Exception as e:
+        results.put(("error", os.getpid(), f"{type(e).__name__}: {e}"))
+    finally:
+        if frames is not None:
+            frames.close()
+
+
+class ProcessPipeline(GazePipeline):
+    """
+    GazePipeline whose inference runs in a pool of worker processes.
+
+    processPupils(left, right, stamp) turns one frame's pupil coordinates
+    into a cursor target (or None) and is called in capture order. A frame is
+    dropped when every ring slot is still being worked on, so the pool never
+    falls behind the camera.
+
+    start raises RuntimeError if a worker can't load its detector within
+    loadTimeout seconds. A worker that dies while running stops the
+    pipeline, since the ring slot it held would never come back.
+    """
+
+    def __init__(
+        self,
+        webcam,
+        processPupils,
+        actuate,
+        workers=None,
+        detector="dlib",
+        detectorParams=None,
+        detectorSettings=None,
+        slots=None,
+        queueSize=1,
+        reportInterval=None,
+        profiler=None,
+        loadTimeout=120.0,
+    ):
+        super().__init__(
+            webcam, processPupils, actuate, queueSize, reportInterval, profiler
+        )
+        self.workers = workers or min(os.cpu_count() or 1, 4)
+        self.detector = detector
+        self.detectorParams = detectorParams or {}
+        self.detectorSettings = detectorSettings
+        # one slot per worker: when all are busy new frames are dropped
+        # instead of waiting in line, which would only add latency
+        self.slotCount = slots or self.workers
+        self.loadTimeout = loadTimeout
+        self.checkInterval = 0.5
+
+        self.context = multiprocessing.get_context("spawn")
+        self.ring = None
+        self.scratch = None
+        self.processes = []
+        self.tasks = None
+        self.results = None
+        self.free = queue.Queue()
+        self.firstFrame = None
+        # capture times by sequence number, shared by the two loops
+        self.stamps = {}
+
+    def frame_shape(self):
+        """
+        The BGR frame shape from the capture properties, or from a first
+        frame if the capture doesn't report its size.
+        """
+        width = int(self.webcam.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.webcam.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if width > 0 and height > 0:
+            return (height, width, 3)
+        ret, frame = self.webcam.read()
+        if not ret or frame is None:
+            return None
+        self.firstFrame = (frame, frame_time(self.webcam, time.perf_counter()))
+        return frame.shape
+
+    def start(self):
+        shape = self.frame_shape()
+        if shape is None:
+            self.stopEvent.set()
+            return
+        self.ring = SharedFrameRing(self.slotCount, shape)
+        try:
+            self.start_workers(shape)
+        except BaseException:
+            self.stop_workers()
+            raise
+        super().start()
+
+    def start_workers(self, shape):
+        self.scratch = np.empty(shape, np.uint8)
+        for slot in range(self.slotCount):
+            self.free.put(slot)
+
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        for _ in range(self.workers):
+            process = self.context.Process(
+                target=worker_main,
+                args=(
+                    self.ring.name,
+                    self.slotCount,
+                    shape,
+                    self.detector,
+                    self.detectorParams,
+                    self.detectorSettings,
+                    self.tasks,
+                    self.results,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        # don't count model loading as dropped frames
+        deadline = time.perf_counter() + self.loadTimeout
+        ready = 0
+        while ready < len(self.processes):
+            try:
+                message = self.results.get(timeout=self.checkInterval)
+            except queue.Empty:
+                message = None
+            if message is not None and message[0] == "error":
+                raise RuntimeError(f"pupil worker {message[1]} failed: {message[2]}")
+            if message is not None:
+                ready += 1
+                continue
+            self.check_workers()
+            if time.perf_counter() > deadline:
+                raise RuntimeError(
+                    f"pupil workers not ready after {self.loadTimeout:.0f} s"
+                )
+
+    def check_workers(self):
+        """
+        Raises RuntimeError if a worker process has exited.
+        """
+        for process in self.processes:
+            if not process.is_alive():
+                raise RuntimeError(
+                    f"pupil worker {process.pid} exited with code {process.exitcode}"
+                )
+
+    def stop(self):
+        super().stop()
+        self.stop_workers()
+
+    def stop_workers(self):
+        for process in self.processes:
+            if process.is_alive():
+                self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=2.0)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def capture_loop(self):
+        stats = self.stats["capture"]
+        seq = 0
+        first = self.firstFrame
+        while not self.stopEvent.is_set():
+            start = time.perf_counter()
+            try:
+                slot = self.free.get_nowait()
+            except queue.Empty:
+                # every slot is in use, the workers are behind: read into
+                # the scratch frame to keep the camera current
+                slot = None
+            buffer = self.scratch if slot is None else self.ring.frames[slot]
+            if first is not None:
+                (frame, stamp), first = first, None
+                buffer[...] = frame
+                frame, ret = buffer, True
+            else:
+                ret, frame = self.webcam.read(image=buffer)
+                stamp = frame_time(self.webcam, time.perf_counter())
+            if not ret or frame is None:
+                # end of stream or camera failure
+                self.stopEvent.set()
+                break
+            if frame is not buffer:
+                # the capture allocated a new frame instead of filling ours
+                if frame.shape != self.ring.shape:
+                    print(f"frame size changed to {frame.shape}, stopping")
+                    self.stopEvent.set()
+                    break
+                buffer[...] = frame
+            if slot is None:
+                stats.drop()
+                continue
+            self.stamps[seq] = stamp
+            self.tasks.put((seq, slot))
+            seq += 1
+            stats.tick(stamp - start)
+            if self.profiler is not None:
+                self.profiler.lap("capture", start)
+
+    def inference_loop(self):
+        """
+        Collects worker results and processes them in sequence order.
+        """
+        stats = self.stats["inference"]
+        pending = {}
+        nextSeq = 0
+        checked = time.perf_counter()
+        while not self.stopEvent.is_set():
+            try:
+                result = self.results.get(timeout=0.1)
+            except queue.Empty:
+                result = None
+            try:
+                if result is not None and result[0] == "error":
+                    raise RuntimeError(f"pupil worker {result[1]} failed: {result[2]}")
+                if time.perf_counter() - checked > self.checkInterval:
+                    self.check_workers()
+                    checked = time.perf_counter()
+            except RuntimeError as e:
+                # its ring slot is lost, and with it the frames it would carry
+                print(f"{e}, stopping")
+                self.stopEvent.set()
+                break
+            if result is None:
+                continue
+            seq, slot, left, right, busy = result
+            self.free.put(slot)
+            stats.tick(busy)
+            pending[seq] = (left, right)
+            if len(pending) > self.slotCount:
+                # a result went missing, don't wait for it forever
+                for missing in range(nextSeq, min(pending)):
+                    self.stamps.pop(missing, None)
+                nextSeq = min(pending)
+            while nextSeq in pending:
+                left, right = pending.pop(nextSeq)
+                stamp = self.stamps.pop(nextSeq, None)
+                nextSeq += 1
+                target = self.process(left, right, stamp)
+                if target is not None and put_latest(
+                    self.targets, (nextSeq - 1, stamp, target)
+                ):
+                    stats.drop()
+
+    def snapshot(self):
+        return [stats.snapshot() for stats in self.stats.values()]
@@ -0,0 +1,182 @@
+"""
+Persistent calibration profiles.
+
+A profile keeps everything needed to skip the full calibration on the next
+launch: the fitted coefficients, the raw pupil samples per dot (so any mapping
+model can be refitted), the screen geometry and the camera settings. Profiles
+are stored as JSON, one file per user and camera.
+"""
+
+import getpass
+import json
+import os
+import re
+import time
+
+import cv2
+import numpy as np
+
+from capture import fourcc_name
+from mapping import MappingEngine, make_model
+
+PROFILE_VERSION = 1
+DEFAULT_ROOT = os.path.join(os.path.expanduser("~"), ".eyetrackpad", "profiles")
+
+# the full calibration run: a vertical then a horizontal line of dots
+CALIBRATION_DOTS = [
+    (0.5, 0.05),
+    (0.5, 0.25),
+    (0.5, 0.5),
+    (0.5, 0.75),
+    (0.5, 0.95),
+    (0.05, 0.5),
+    (0.25, 0.5),
+    (0.5, 0.5),
+    (0.75, 0.5),
+    (0.95, 0.5),
+]
+
+# dots used to check a loaded profile instead of the full 10 dot run
+VALIDATION_DOTS = [(0.5, 0.5), (0.15, 0.5), (0.85, 0.5)]
+
+
+def current_user():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "default"
+
+
+def camera_key(webcam, index=0):
+    """
+    Identifies a camera by its index and resolution.
+    """
+    width = int(webcam.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(webcam.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    return f"cam{index}-{width}x{height}"
+
+
+def camera_settings(webcam):
+    return {
+        "width": webcam.get(cv2.CAP_PROP_FRAME_WIDTH),
+        "height": webcam.get(cv2.CAP_PROP_FRAME_HEIGHT),
+        "fps": webcam.get(cv2.CAP_PROP_FPS),
+        "format": fourcc_name(webcam.get(cv2.CAP_PROP_FOURCC)),
+        "bufferSize": int(webcam.get(cv2.CAP_PROP_BUFFERSIZE)),
+    }
+
+
+def calibration_targets(dotPositions, eyeData, gridWidth, gridHeight):
+    """
+    Stacks the samples of every dot with the grid cell of that dot.
+    Returns (eye, targets) arrays of shape (n, 2).
+    """
+    eye = []
+    targets = []
+    for (dotX, dotY), samples in zip(dotPositions, eyeData):
+        cell = [int(dotX * gridWidth), int(dotY * gridHeight)]
+        for sample in samples:
+            eye.append(sample)
+            targets.append(cell)
+    return np.array(eye, dtype=float).reshape(-1, 2), np.array(targets).reshape(-1, 2)
+
+
+def build_profile(
+    user,
+    camera,
+    xcoeff,
+    ycoeff,
+    eyeData,
+    dotPositions,
+    screenWidth,
+    screenHeight,
+    cellWidth,
+    cellHeight,
+    mappingModel="quadratic",
+    cameraSettings=None,
+    detectorSettings=None,
+):
+    return {
+        "version": PROFILE_VERSION,
+        "user": user,
+        "camera": camera,
+        "created": time.time(),
+        "mappingModel": mappingModel,
+        "xcoeff": [float(c) for c in xcoeff],
+        "ycoeff": [float(c) for c in ycoeff],
+        "samples": [[list(map(float, s)) for s in dot] for dot in eyeData],
+        "dotPositions": [list(dot) for dot in dotPositions],
+        "screen": {
+            "width": screenWidth,
+            "height": screenHeight,
+            "cellWidth": cellWidth,
+            "cellHeight": cellHeight,
+        },
+        "cameraSettings": cameraSettings or {},
+        "detector": detectorSettings or {},
+    }
+
+
+def profile_mapper(profile):
+    """
+    Refits the profile's mapping model from its raw samples.
+    """
+    screen = profile["screen"]
+    gridWidth = screen["width"] // screen["cellWidth"]
+    gridHeight = screen["height"] // screen["cellHeight"]
+    eye, targets = calibration_targets(
+        profile["dotPositions"], profile["samples"], gridWidth, gridHeight
+    )
+    return MappingEngine(
+        make_model(profile.get("mappingModel", "quadratic")), gridWidth, gridHeight
+    ).fit(eye, targets)
+
+
+class ProfileStore:
+    """
+    Reads and writes profiles under root, one JSON file per user and camera.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    def path(self, user, camera):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{user}@{camera}")
+        return os.path.join(self.root, name + ".json")
+
+    def save(self, profile):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(profile["user"], profile["camera"])
+        # write then rename so a crash never leaves half a profile behind
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(profile, f)
+        os.replace(tmp, path)
+        return path
+
+    def load(self, user, camera, screenWidth=None, screenHeight=None):
+        """
+        Returns the stored profile, or None if there is none or it doesn't
+        match this version or screen.
+        """
+        try:
+            with open(self.path(user, camera)) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if profile.get("version") != PROFILE_VERSION:
+            return None
+        screen = profile.get("screen", {})
+        if screenWidth is not None and screen.get("width") != screenWidth:
+            return None
+        if screenHeight is not None and screen.get("height") != screenHeight:
+            return None
+        if not any(profile.get("samples", [])):
+            return None
+        return profile
+
+    def delete(self, user, camera):
+        try:
+            os.remove(self.path(user, camera))
+        except OSError:
+            pass
@@ -0,0 +1,241 @@
+"""
+Record webcam sessions to disk and play them back in place of the camera.
+
+A session is a directory of lossless PNG frames plus a session.json holding
+each frame's timestamp and optional calibration dot label. ReplayCapture
+implements the parts of cv2.VideoCapture the trackers use, so MouseController,
+CalibrateScreen and the Haar tracker can run on a recording. NullCursor stands
+in for pyautogui so nothing moves on headless machines.
+"""
+
+import json
+import os
+import time
+
+import cv2
+
+SESSION_FILE = "session.json"
+
+
+class SessionRecorder:
+    """
+    Writes frames, timestamps and labels to a session directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.entries = []
+        self.start = None
+        self.shape = None
+
+    def add(self, frame, timestamp=None, label=None):
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+        if self.start is None:
+            self.start = timestamp
+            self.shape = frame.shape
+        name = f"{len(self.entries):06d}.png"
+        cv2.imwrite(os.path.join(self.path, name), frame)
+        self.entries.append(
+            {"file": name, "time": timestamp - self.start, "label": label}
+        )
+
+    def close(self):
+        duration = self.entries[-1]["time"] if self.entries else 0.0
+        session = {
+            "version": 1,
+            "width": self.shape[1] if self.shape else 0,
+            "height": self.shape[0] if self.shape else 0,
+            "fps": (len(self.entries) - 1) / duration if duration > 0 else 0.0,
+            "frames": self.entries,
+        }
+        with open(os.path.join(self.path, SESSION_FILE), "w") as f:
+            json.dump(session, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordingCapture:
+    """
+    Wraps a capture and records every frame read from it. Set label (e.g.
+    the calibration dot index) to tag the frames that follow.
+    """
+
+    def __init__(self, cap, path):
+        self.cap = cap
+        self.recorder = SessionRecorder(path)
+        self.label = None
+
+    def set_label(self, label):
+        self.label = label
+
+    def read(self, image=None):
+        ret, frame = self.cap.read(image)
+        if ret and frame is not None:
+            # the capture's own frame time when it has one, see capture.py
+            stamp = getattr(self.cap, "frameTime", None)
+            self.recorder.add(frame, timestamp=stamp, label=self.label)
+        return ret, frame
+
+    def release(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        self.cap.release()
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+class ReplayCapture:
+    """
+    cv2.VideoCapture stand-in that plays back a recorded session.
+
+    realtime paces reads at the recorded timestamps, otherwise frames are
+    returned as fast as they are asked for. preload decodes every frame up
+    front so benchmarks measure tracking rather than PNG decoding.
+    """
+
+    def __init__(self, path, realtime=False, loop=False, preload=False):
+        self.path = path
+        with open(os.path.join(path, SESSION_FILE)) as f:
+            self.session = json.load(f)
+        self.entries = self.session["frames"]
+        self.realtime = realtime
+        self.loop = loop
+
+        self.cache = (
+            [self.load(i) for i in range(len(self.entries))] if preload else None
+        )
+        self.position = 0
+        self.opened = True
+        self.started = None
+        self.timestamp = None
+        self.label = None
+        self.grabbed = None
+
+    def load(self, index):
+        return cv2.imread(os.path.join(self.path, self.entries[index]["file"]))
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if not self.opened:
+            return False
+        if self.position >= len(self.entries):
+            if not self.loop or not self.entries:
+                return False
+            self.position = 0
+            self.started = None
+        entry = self.entries[self.position]
+
+        if self.realtime:
+            now = time.perf_counter()
+            if self.started is None:
+                self.started = now - entry["time"]
+            delay = self.started + entry["time"] - now
+            if delay > 0:
+                time.sleep(delay)
+
+        self.grabbed = self.position
+        self.timestamp = entry["time"]
+        self.label = entry.get("label")
+        self.position += 1
+        return True
+
+    def retrieve(self, image=None, flag=0):
+        if self.grabbed is None:
+            return False, None
+        if self.cache is not None:
+            frame = self.cache[self.grabbed]
+        else:
+            frame = self.load(self.grabbed)
+        if image is not None and image.shape == frame.shape:
+            image[...] = frame
+            return True, image
+        return True, frame.copy() if self.cache is not None else frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.session.get("fps", 0.0))
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.session.get("width", 0))
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.session.get("height", 0))
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.entries))
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return 0.0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = min(max(int(value), 0), len(self.entries))
+            self.started = None
+            return True
+        return False
+
+    def release(self):
+        self.opened = False
+        self.cache = None
+
+
+class NullCursor:
+    """
+    No-op replacement for pyautogui's cursor functions. Keeps the last
+    target and a move count so benchmarks can check the cursor was driven.
+    """
+
+    def __init__(self, width=1920, height=1080):
+        self.width = width
+        self.height = height
+        self.moves = 0
+        self.position = (0, 0)
+
+    def size(self):
+        return self.width, self.height
+
+    def moveTo(self, x, y, *args, **kwargs):
+        self.moves += 1
+        self.position = (x, y)
+
+
+def record(path, camera=0, seconds=10, config=None):
+    """
+    Records a session from a camera for the given number of seconds, with
+    the camera settings in config (see capture.load_config).
+    """
+    from capture import open_camera
+
+    cap = RecordingCapture(open_camera(camera, config), path)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        ret, _ = cap.read()
+        if not ret:
+            break
+    cap.release()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record a webcam session.")
+    parser.add_argument("path", help="directory to write the session to")
+    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--camera-config", help="camera settings JSON, see capture.py")
+    args = parser.parse_args()
+
+    from capture import load_config
+
+    record(args.path, args.camera, args.seconds, load_config(args.camera_config))
@@ -0,0 +1,246 @@
+"""
+Snap targets from the screen itself.
+
+ScreenTargetProvider grabs the screen on a background thread, finds the
+tiles that changed since the last grab and re-runs target detection on those
+regions only. Candidates are boxed controls (edges closed into contours) and
+lines of text (morphological gradient closed horizontally). Every change
+publishes a new versioned target set, e.g. to TargetSnapper.set_targets.
+
+Works on saved screenshots without a display:
+    python screen_targets.py before.png after.png --out targets.png
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def find_boxes(gray, minSize=8, maxSize=None):
+    """
+    Bounding boxes (x, y, w, h) of closed edge contours, i.e. buttons, input
+    fields, icons. Boxes larger than the (width, height) maxSize are ignored
+    as panels and backgrounds.
+    """
+    edges = cv2.Canny(gray, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    return filter_boxes(contours, minSize, maxSize)
+
+
+def find_text(gray, minSize=8, maxSize=None):
+    """
+    Bounding boxes of text lines, found by closing the morphological gradient
+    with a wide kernel so the letters of a word merge into one blob.
+    """
+    gradient = cv2.morphologyEx(
+        gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    )
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    closed = cv2.morphologyEx(
+        binary, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1))
+    )
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return filter_boxes(contours, minSize, maxSize)
+
+
+def filter_boxes(contours, minSize, maxSize):
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if max(w, h) < minSize or min(w, h) < 4:
+            continue
+        if maxSize is not None and (w > maxSize[0] or h > maxSize[1]):
+            continue
+        boxes.append((x, y, w, h))
+    return boxes
+
+
+def extract_targets(gray, region=None, maxFraction=0.25):
+    """
+    Returns an (n, 4) array of target boxes in gray, or in the (x, y, w, h)
+    region of it, in full image coordinates. Boxes over maxFraction of the
+    whole image in either direction are skipped, and nested duplicates from
+    the box and text passes are merged.
+    """
+    maxSize = (gray.shape[1] * maxFraction, gray.shape[0] * maxFraction)
+    ox, oy = 0, 0
+    if region is not None:
+        ox, oy, w, h = region
+        gray = gray[oy : oy + h, ox : ox + w]
+    boxes = find_boxes(gray, maxSize=maxSize) + find_text(gray, maxSize=maxSize)
+    if not boxes:
+        return np.empty((0, 4), dtype=np.int32)
+    # groupRectangles drops boxes that appear only once, so list each twice
+    merged, _ = cv2.groupRectangles(boxes + boxes, 1, 0.2)
+    merged = np.asarray(merged, dtype=np.int32).reshape(-1, 4)
+    merged[:, 0] += ox
+    merged[:, 1] += oy
+    return merged
+
+
+def dirty_regions(previous, current, tileSize=64, threshold=8):
+    """
+    Compares two gray images tile by tile and returns the (x, y, w, h)
+    regions covering the changed tiles, one per group of touching tiles.
+    """
+    height, width = current.shape
+    rows = -(-height // tileSize)
+    columns = -(-width // tileSize)
+    diff = cv2.absdiff(previous, current)
+    # pad to whole tiles, then take the max of each tile in one reshape
+    padded = np.zeros((rows * tileSize, columns * tileSize), np.uint8)
+    padded[:height, :width] = diff
+    tiles = padded.reshape(rows, tileSize, columns, tileSize).max(axis=(1, 3))
+    mask = (tiles > threshold).astype(np.uint8)
+    if not mask.any():
+        return []
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    regions = []
+    for x, y, w, h, _ in stats[1:count]:
+        # one tile of margin so targets crossing the edge are seen whole
+        x0 = max(x - 1, 0) * tileSize
+        y0 = max(y - 1, 0) * tileSize
+        x1 = min((x + w + 1) * tileSize, width)
+        y1 = min((y + h + 1) * tileSize, height)
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+    return regions
+
+
+def grab_screen():
+    """
+    Grabs the screen as a BGR image with Pillow.
+    """
+    from PIL import ImageGrab
+
+    return cv2.cvtColor(np.asarray(ImageGrab.grab()), cv2.COLOR_RGB2BGR)
+
+
+class ScreenTargetProvider:
+    """
+    Keeps the target set of the screen up to date.
+
+    process(image) analyses one capture: the first one fully, later ones only
+    in the regions that changed. Targets whose centre falls in a changed
+    region are replaced by the ones found there. Each change bumps version
+    and calls onTargets(centres, version).
+
+    start() does the same on a background thread, grabbing every interval
+    seconds with grab (grab_screen by default).
+    """
+
+    def __init__(
+        self, onTargets=None, grab=None, interval=0.5, tileSize=64, threshold=8
+    ):
+        self.onTargets = onTargets
+        self.grab = grab or grab_screen
+        self.interval = interval
+        self.tileSize = tileSize
+        self.threshold = threshold
+
+        self.previous = None
+        self.boxes = np.empty((0, 4), dtype=np.int32)
+        self.version = 0
+        self.lastRegions = []
+
+        self.running = False
+        self.thread = None
+
+    def centres(self):
+        boxes = self.boxes
+        return np.column_stack(
+            (boxes[:, 0] + boxes[:, 2] / 2, boxes[:, 1] + boxes[:, 3] / 2)
+        )
+
+    def process(self, image):
+        """
+        Analyses one capture. Returns True if the target set changed.
+        """
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.previous is None or self.previous.shape != gray.shape:
+            regions = [(0, 0, gray.shape[1], gray.shape[0])]
+        else:
+            regions = dirty_regions(self.previous, gray, self.tileSize, self.threshold)
+        self.previous = gray
+        self.lastRegions = regions
+        if not regions:
+            return False
+
+        boxes = self.boxes
+        centres = self.centres()
+        keep = np.ones(len(boxes), dtype=bool)
+        found = [boxes]
+        for x, y, w, h in regions:
+            keep &= ~(
+                (centres[:, 0] >= x)
+                & (centres[:, 0] < x + w)
+                & (centres[:, 1] >= y)
+                & (centres[:, 1] < y + h)
+            )
+            found.append(extract_targets(gray, (x, y, w, h)))
+        found[0] = boxes[keep]
+        self.boxes = np.concatenate(found)
+        self.version += 1
+        if self.onTargets is not None:
+            self.onTargets(self.centres(), self.version)
+        return True
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            try:
+                self.process(self.grab())
+            except Exception as e:
+                print(f"screen targets: {e}")
+            time.sleep(max(0.0, self.interval - (time.perf_counter() - start)))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Find snap targets in screenshots, incrementally after the first."
+    )
+    parser.add_argument("images", nargs="+", help="screenshots in capture order")
+    parser.add_argument("--tile", type=int, default=64, help="dirty tile size")
+    parser.add_argument("--out", help="draw the last image's targets to this file")
+    args = parser.parse_args()
+
+    provider = ScreenTargetProvider(tileSize=args.tile)
+    image = None
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is None:
+            parser.error(f"could not read {path}")
+        start = time.perf_counter()
+        changed = provider.process(image)
+        elapsed = (time.perf_counter() - start) * 1000
+        area = sum(w * h for _, _, w, h in provider.lastRegions)
+        print(
+            f"{path}: {len(provider.boxes)} targets, version {provider.version}, "
+            f"{len(provider.lastRegions)} dirty regions "
+            f"({area / (image.shape[0] * image.shape[1]):.0%} of the screen), "
+            f"{elapsed:.1f} ms{'' if changed else ', unchanged'}"
+        )
+
+    if args.out:
+        for x, y, w, h in provider.boxes:
+            cv2.rectangle(
+                image, (int(x), int(y)), (int(x + w), int(y + h)), (0, 0, 255), 1
+            )
+        cv2.imwrite(args.out, image)
@@ -0,0 +1,463 @@
+"""
+Headless asyncio runtime for the mouse controller.
+
+GazeService runs MouseController without any window: camera reads and pupil
+detection run in single-thread executors, the cursor is moved by a coroutine,
+and newer frames and targets replace older ones that weren't picked up yet,
+as in pipeline.py. A local TCP control socket takes one command per line,
+either a JSON object like {"command": "recalibrate", "x": 960, "y": 540} or
+just the command name:
+
+    start        resume tracking (reopens the camera after stop)
+    pause        stop reading frames, the camera stays open
+    stop         stop tracking and release the camera
+    recalibrate  start a drift correction dot prompt, see drift.py
+    metrics      stage rates, latency percentiles and controller counters
+    shutdown     stop the service
+
+and answers with one JSON line with "ok" true or false.
+
+Usage:
+    python service.py serve --detector haar           # uses the saved profile
+    python service.py serve --replay session/ --uncalibrated --cursor null
+    python service.py metrics
+    python service.py recalibrate --x 960 --y 540
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import signal
+import socket
+import time
+
+import numpy as np
+
+from buffers import FrameRing
+from capture import frame_time
+from pipeline import (
+    format_report,
+    latency_log,
+    latency_percentiles,
+    put_latest,
+    stage_stats,
+)
+
+DEFAULT_PORT = 8765
+
+
+class GazeService:
+    """
+    Runs a MouseController (created with autostart=False) on an asyncio loop
+    and serves the control socket on host:port.
+
+    openWebcam() returns a new capture and is needed to start again after a
+    stop. The service ends when the capture runs out of frames, on shutdown
+    or on SIGINT/SIGTERM.
+    """
+
+    def __init__(
+        self,
+        controller,
+        host="127.0.0.1",
+        port=DEFAULT_PORT,
+        openWebcam=None,
+        reportInterval=None,
+        paused=False,
+    ):
+        self.controller = controller
+        self.host = host
+        self.port = port
+        self.openWebcam = openWebcam
+        self.reportInterval = reportInterval
+        self.state = "paused" if paused else "running"
+
+        # one thread each: captures and detectors aren't thread safe, and
+        # a slow detection mustn't hold up the next camera read
+        self.cameraThread = concurrent.futures.ThreadPoolExecutor(1, "camera")
+        self.inferenceThread = concurrent.futures.ThreadPoolExecutor(1, "inference")
+        # frame buffers: one being read, one queued, one being processed
+        self.frameRing = FrameRing(3)
+
+        self.stats = stage_stats()
+        self.latencies = latency_log()
+        self.started = None
+
+        self.commands = {
+            "start": self.start,
+            "pause": self.pause,
+            "stop": self.stop,
+            "recalibrate": self.recalibrate,
+            "metrics": self.metrics,
+            "shutdown": self.shutdown,
+        }
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.active = asyncio.Event()
+        if self.state == "running":
+            self.active.set()
+        self.done = asyncio.Event()
+        self.frames = asyncio.Queue(maxsize=1)
+        self.targets = asyncio.Queue(maxsize=1)
+        self.started = time.perf_counter()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.done.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows, or not on the main thread
+                pass
+
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        print(f"control socket on {self.host}:{self.port}")
+        tasks = [
+            asyncio.create_task(loopFunction())
+            for loopFunction in (
+                self.capture_loop,
+                self.inference_loop,
+                self.actuator_loop,
+                self.report_loop,
+            )
+        ]
+        try:
+            await self.done.wait()
+        finally:
+            server.close()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await server.wait_closed()
+            # let a read or detection in progress finish before releasing
+            self.cameraThread.shutdown(wait=True)
+            self.inferenceThread.shutdown(wait=True)
+            print(self.report())
+            self.controller.stopController()
+
+    async def capture_loop(self):
+        loop = asyncio.get_running_loop()
+        stats = self.stats["capture"]
+        while True:
+            await self.active.wait()
+            if self.controller.webcam is None:
+                self.controller.webcam = await loop.run_in_executor(
+                    self.cameraThread, self.openWebcam
+                )
+            start = time.perf_counter()
+            ret, frame = await loop.run_in_executor(
+                self.cameraThread, self.frameRing.read, self.controller.webcam
+            )
+            if not ret or frame is None:
+                # end of a replay or camera failure
+                print("camera stream ended")
+                self.done.set()
+                return
+            end = time.perf_counter()
+            stamp = frame_time(self.controller.webcam, end)
+            if not self.active.is_set():
+                # paused while the frame was being read
+                self.frameRing.release(frame)
+                continue
+            stats.tick(end - start)
+            self.controller.profiler.lap("capture", start)
+            for _, old in put_latest(self.frames, (stamp, frame)):
+                self.frameRing.release(old)
+                stats.drop()
+
+    async def inference_loop(self):
+        loop = asyncio.get_running_loop()
+        stats = self.stats["inference"]
+        while True:
+            stamp, frame = await self.frames.get()
+            start = time.perf_counter()
+            target = await loop.run_in_executor(
+                self.inferenceThread, self.controller.processFrame, frame, stamp
+            )
+            self.frameRing.release(frame)
+            stats.tick(time.perf_counter() - start)
+            if target is not None and self.active.is_set():
+                if put_latest(self.targets, (stamp, target)):
+                    stats.drop()
+
+    async def actuator_loop(self):
+        stats = self.stats["actuator"]
+        while True:
+            stamp, target = await self.targets.get()
+            start = time.perf_counter()
+            # CursorActuator.moveTo only hands the target to its own thread
+            self.controller.moveCursor(target, stamp)
+            end = time.perf_counter()
+            stats.tick(end - start)
+            self.latencies.append(end - stamp)
+
+    async def report_loop(self):
+        if not self.reportInterval:
+            return
+        while True:
+            await asyncio.sleep(self.reportInterval)
+            print(self.report())
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.handle_line(line.decode("utf-8", "replace"))
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # client gone, or the service is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def handle_line(self, line):
+        line = line.strip()
+        try:
+            request = json.loads(line) if line.startswith("{") else {"command": line}
+        except ValueError as e:
+            return {"ok": False, "error": f"bad request: {e}"}
+        name = request.pop("command", None)
+        if name not in self.commands:
+            return {
+                "ok": False,
+                "error": f"unknown command {name!r}, use one of {list(self.commands)}",
+            }
+        try:
+            result = await self.commands[name](**request)
+        except (TypeError, ValueError, RuntimeError) as e:
+            return {"ok": False, "error": str(e)}
+        return dict({"ok": True, "state": self.state}, **(result or {}))
+
+    async def start(self):
+        if self.controller.webcam is None and self.openWebcam is None:
+            raise RuntimeError("the camera was released and can't be reopened")
+        self.state = "running"
+        self.active.set()
+
+    async def pause(self):
+        if self.state == "running":
+            self.state = "paused"
+            self.active.clear()
+
+    async def stop(self):
+        self.state = "stopped"
+        self.active.clear()
+        webcam = self.controller.webcam
+        if webcam is not None and self.openWebcam is not None:
+            # runs after any read in progress on the same thread
+            self.controller.webcam = None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.cameraThread, webcam.release)
+
+    async def recalibrate(self, x=None, y=None):
+        """
+        Starts a drift correction prompt at screen point (x, y), or at a
+        random cell. The caller shows the dot; the reply says where it is.
+        """
+        if self.controller.drift is None:
+            raise RuntimeError("drift correction is off")
+        if x is None or y is None:
+            x, y = self.controller.startPrompt()
+        else:
+            self.controller.drift.begin_prompt(float(x), float(y))
+        return {"x": x, "y": y}
+
+    async def metrics(self):
+        result = {
+            "uptime": time.perf_counter() - self.started,
+            "stages": [stats.snapshot() for stats in self.stats.values()],
+            "latency_ms": latency_percentiles(self.latencies),
+            "work": dict(self.controller.work),
+        }
+        if self.controller.fixation is not None:
+            result["fixation"] = self.controller.fixation.state
+        if hasattr(self.controller.cursor, "moves"):
+            result["moves"] = self.controller.cursor.moves
+        if self.controller.profiler.enabled:
+            result["profile"] = self.controller.profiler.summary()
+        return result
+
+    async def shutdown(self):
+        self.state = "shutdown"
+        self.active.clear()
+        self.done.set()
+
+    def report(self):
+        return format_report(stats.snapshot() for stats in self.stats.values())
+
+
+def send_command(command, host="127.0.0.1", port=DEFAULT_PORT, timeout=5.0, **args):
+    """
+    Sends one command to a running service and returns its JSON reply.
+    """
+    request = dict(args, command=command)
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall((json.dumps(request) + "\n").encode())
+        with sock.makefile("r", encoding="utf-8") as reply:
+            return json.loads(reply.readline())
+
+
+def build_controller(args):
+    """
+    Opens the capture and detector and loads the saved profile for the
+    serve command. Returns (controller, openWebcam).
+    """
+    import cv2
+
+    from detectors import make_detector
+    from mouse_controller import MouseController
+    from profiles import ProfileStore, camera_key, current_user, profile_mapper
+
+    if args.replay:
+        from replay import ReplayCapture
+
+        def openWebcam():
+            return ReplayCapture(args.replay, realtime=True, preload=True)
+
+    else:
+        from capture import load_config, open_camera
+
+        try:
+            config = load_config(args.camera_config)
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"--camera-config: {e}")
+
+        def openWebcam():
+            return open_camera(args.camera, config)
+
+    webcam = openWebcam()
+    if not webcam.isOpened():
+        raise SystemExit("could not open the webcam")
+    detectorParams = {"method": args.pupil} if args.detector == "haar" else {}
+    gaze = make_detector(args.detector, **detectorParams)
+    screenWidth, screenHeight = args.screen
+    cellWidth = cellHeight = args.cell
+
+    mapper = None
+    xcoeff = ycoeff = [0, 1, 0]
+    if not args.uncalibrated:
+        profile = ProfileStore().load(
+            current_user(), camera_key(webcam, args.camera), screenWidth, screenHeight
+        )
+        if profile is None:
+            raise SystemExit(
+                "no calibration profile for this user and camera, "
+                "calibrate with app.py first or pass --uncalibrated"
+            )
+        if hasattr(gaze, "load_settings"):
+            gaze.load_settings(profile.get("detector"))
+        mapper = profile_mapper(profile)
+        xcoeff, ycoeff = profile["xcoeff"], profile["ycoeff"]
+
+    controller = MouseController(
+        np.array(xcoeff),
+        np.array(ycoeff),
+        gaze,
+        webcam,
+        cellWidth,
+        cellHeight,
+        screenWidth,
+        screenHeight,
+        mapper=mapper,
+        cursorBackend=args.cursor,
+        autostart=False,
+        profileOutput=args.profile,
+        driftCorrection=args.drift,
+        adaptive=args.adaptive,
+        detector=args.detector,
+        detectorParams=detectorParams,
+    )
+    if mapper is None:
+        # the frame mapped linearly onto the screen, for replays
+        controller.mapper.compile(
+            (0, 0),
+            (
+                webcam.get(cv2.CAP_PROP_FRAME_WIDTH),
+                webcam.get(cv2.CAP_PROP_FRAME_HEIGHT),
+            ),
+        )
+    return controller, openWebcam
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "command",
+        choices=[
+            "serve",
+            "start",
+            "pause",
+            "stop",
+            "recalibrate",
+            "metrics",
+            "shutdown",
+        ],
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--x", type=float, help="recalibrate: dot position")
+    parser.add_argument("--y", type=float, help="recalibrate: dot position")
+    serve = parser.add_argument_group("serve")
+    serve.add_argument("--camera", type=int, default=0)
+    serve.add_argument("--replay", help="use a recorded session instead of a camera")
+    serve.add_argument(
+        "--camera-config", metavar="JSON", help="camera settings, see capture.py"
+    )
+    serve.add_argument("--detector", default="dlib", choices=["dlib", "haar"])
+    serve.add_argument("--pupil", default="blob", choices=["blob", "centroid"])
+    serve.add_argument(
+        "--cursor", default="pyautogui", choices=["pyautogui", "xlib", "uinput", "null"]
+    )
+    serve.add_argument("--screen", type=int, nargs=2, default=[1920, 1080])
+    serve.add_argument("--cell", type=int, default=20, help="grid cell size")
+    serve.add_argument(
+        "--uncalibrated",
+        action="store_true",
+        help="map the frame linearly onto the screen instead of loading a profile",
+    )
+    serve.add_argument("--drift", action="store_true")
+    serve.add_argument("--adaptive", action="store_true")
+    serve.add_argument("--paused", action="store_true", help="wait for start")
+    serve.add_argument("--report", type=float, help="print rates every N seconds")
+    serve.add_argument("--profile", help="write stage latencies here on exit")
+    serve.add_argument("--telemetry", help="send stage latencies to this URL")
+    args = parser.parse_args()
+
+    if args.command != "serve":
+        options = {}
+        if args.command == "recalibrate" and args.x is not None:
+            options = {"x": args.x, "y": args.y}
+        try:
+            reply = send_command(args.command, args.host, args.port, **options)
+        except OSError as e:
+            raise SystemExit(f"no service on {args.host}:{args.port}: {e}")
+        print(json.dumps(reply, indent=2))
+        return
+
+    controller, openWebcam = build_controller(args)
+    reporter = None
+    if args.telemetry:
+        from telemetry_reporter import TelemetryReporter
+
+        reporter = TelemetryReporter(controller.profiler, args.telemetry)
+        reporter.start()
+    GazeService(
+        controller,
+        args.host,
+        args.port,
+        openWebcam=openWebcam,
+        reportInterval=args.report,
+        paused=args.paused,
+    ).run()
+    if reporter is not None:
+        reporter.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Snap the cursor toward nearby click targets.
+
+Targets are indexed in a uniform grid hash that is rebuilt only when the
+target set changes. Each frame looks up the grid cells within the snap
+radius and weights the targets found there in one vectorised pass, instead
+of measuring and sorting every target on the screen.
+"""
+
+import threading
+
+import numpy as np
+
+
+class GridIndex:
+    """
+    Uniform grid hash over 2-D points. Points are sorted by bucket so each
+    bucket is a contiguous slice of the sorted array.
+    """
+
+    def __init__(self, points, cellSize):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.cellSize = float(cellSize)
+        self.size = len(points)
+        if not self.size:
+            self.points = points
+            return
+
+        self.low = points.min(axis=0)
+        cells = ((points - self.low) // self.cellSize).astype(np.int64)
+        self.columns = int(cells[:, 0].max()) + 1
+        self.rows = int(cells[:, 1].max()) + 1
+
+        keys = cells[:, 1] * self.columns + cells[:, 0]
+        order = np.argsort(keys, kind="stable")
+        self.points = points[order]
+        # starts[k]:starts[k + 1] is the slice of bucket k
+        self.starts = np.searchsorted(
+            keys[order], np.arange(self.columns * self.rows + 1)
+        )
+
+    def query(self, x, y, radius):
+        """
+        Returns the indices (into the sorted points) of every point in the
+        buckets overlapping the square around (x, y), a superset of the
+        points within radius.
+        """
+        if not self.size:
+            return np.empty(0, dtype=np.int64)
+        c0 = max(int((x - radius - self.low[0]) // self.cellSize), 0)
+        c1 = min(int((x + radius - self.low[0]) // self.cellSize), self.columns - 1)
+        r0 = max(int((y - radius - self.low[1]) // self.cellSize), 0)
+        r1 = min(int((y + radius - self.low[1]) // self.cellSize), self.rows - 1)
+        if c0 > c1 or r0 > r1:
+            return np.empty(0, dtype=np.int64)
+        # the buckets of one row are contiguous, so each row is one slice
+        slices = [
+            np.arange(
+                self.starts[row * self.columns + c0],
+                self.starts[row * self.columns + c1 + 1],
+            )
+            for row in range(r0, r1 + 1)
+        ]
+        return np.concatenate(slices)
+
+
+class TargetSnapper:
+    """
+    Pulls a gaze point toward the targets within radius pixels, each weighted
+    by (radius - distance) ** exponent like the original weight_elements.
+    Points with no target in range are returned unchanged.
+
+    set_targets can be called from another thread; the index is swapped in
+    with one assignment.
+    """
+
+    def __init__(self, radius=120, exponent=6, cellSize=None):
+        self.radius = radius
+        self.exponent = exponent
+        self.cellSize = cellSize or radius
+        self.lock = threading.Lock()
+        self.index = GridIndex(np.empty((0, 2)), self.cellSize)
+        self.version = None
+
+    def set_targets(self, points, version=None):
+        """
+        Replaces the targets. With a version, the index is only rebuilt when
+        the version differs from the current one. Returns True if rebuilt.
+        """
+        with self.lock:
+            if version is not None and version == self.version:
+                return False
+            self.index = GridIndex(points, self.cellSize)
+            self.version = version
+        return True
+
+    def snap(self, x, y):
+        index = self.index
+        candidates = index.points[index.query(x, y, self.radius)]
+        if not len(candidates):
+            return x, y
+        distances = np.hypot(candidates[:, 0] - x, candidates[:, 1] - y)
+        near = distances < self.radius
+        if not near.any():
+            return x, y
+        weights = (self.radius - distances[near]) ** self.exponent
+        sx, sy = weights @ candidates[near] / weights.sum()
+        return float(sx), float(sy)
+
+
+def selenium_targets(driver):
+    """
+    Centres of the visible buttons, links and search boxes on the page
+    driven by a Selenium webdriver.
+    """
+    from selenium.webdriver.common.by import By
+
+    elements = driver.find_elements(By.CSS_SELECTOR, "button, a")
+    elements.extend(driver.find_elements(By.NAME, "q"))
+    points = []
+    for element in elements:
+        if element.is_displayed():
+            location = element.location
+            size = element.size
+            points.append(
+                [
+                    location["x"] + size["width"] / 2,
+                    location["y"] + size["height"] / 2,
+                ]
+            )
+    return points
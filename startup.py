@@ -0,0 +1,133 @@
+"""
+Background startup for app.py.
+
+Loading the dlib models, opening and warming up the camera and importing the
+heavy modules all take a while, so StartupLoader does them on background
+threads while the home screen is already showing. ready is set once
+everything has finished, successfully or not.
+
+The screen size is pyautogui's, the one the calibration screen uses, so a
+profile's grid matches the controller's on scaled displays too.
+"""
+
+import threading
+import time
+
+
+class StartupLoader:
+    def __init__(
+        self,
+        screenWidth=None,
+        screenHeight=None,
+        cameraIndex=0,
+        warmupFrames=5,
+        faceTracking=True,
+        record=None,
+        detector="dlib",
+        detectorParams=None,
+        cameraConfig=None,
+    ):
+        self.screenWidth = screenWidth
+        self.screenHeight = screenHeight
+        self.cameraIndex = cameraIndex
+        self.warmupFrames = warmupFrames
+        self.faceTracking = faceTracking
+        self.record = record
+        self.detector = detector
+        self.detectorParams = detectorParams or {}
+        self.cameraConfig = cameraConfig
+
+        self.ready = threading.Event()
+        self.started = None
+        self.timings = {}
+        self.errors = []
+
+        # filled in by the loader threads
+        self.gaze = None
+        self.webcam = None
+        self.profile = None
+        self.profileStore = None
+        self.user = None
+        self.camera = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        threads = [
+            threading.Thread(target=self.timed, args=(name, target), daemon=True)
+            for name, target in (
+                ("camera", self.load_camera),
+                ("model", self.load_model),
+                ("modules", self.import_modules),
+            )
+        ]
+        for thread in threads:
+            thread.start()
+        threading.Thread(target=self.finish, args=(threads,), daemon=True).start()
+
+    def timed(self, name, target):
+        start = time.perf_counter()
+        try:
+            target()
+        except Exception as e:
+            self.errors.append(f"{name}: {e}")
+        self.timings[name] = time.perf_counter() - start
+
+    def finish(self, threads):
+        for thread in threads:
+            thread.join()
+        # the profile is keyed by camera, so it has to wait for the camera
+        if self.webcam is not None:
+            self.timed("profile", self.load_profile)
+        self.timings["ready"] = time.perf_counter() - self.started
+        self.ready.set()
+
+    def load_camera(self):
+        from capture import open_camera
+
+        # resolution, format and queue depth from the config, see capture.py
+        webcam = open_camera(self.cameraIndex, self.cameraConfig)
+        if not webcam.isOpened():
+            raise RuntimeError("could not open the webcam")
+        # the first frames are often dark while auto exposure settles
+        for _ in range(self.warmupFrames):
+            webcam.read()
+        if self.record:
+            from replay import RecordingCapture
+
+            webcam = RecordingCapture(webcam, self.record)
+        self.webcam = webcam
+
+    def load_model(self):
+        from detectors import make_detector
+
+        self.gaze = make_detector(
+            self.detector, faceTracking=self.faceTracking, **self.detectorParams
+        )
+
+    def import_modules(self):
+        # imported here so pressing space doesn't wait on them
+        import calibrate_frame  # noqa: F401
+        import mouse_controller  # noqa: F401
+        import pyautogui
+
+        if self.screenWidth is None or self.screenHeight is None:
+            self.screenWidth, self.screenHeight = pyautogui.size()
+
+    def load_profile(self):
+        from profiles import ProfileStore, camera_key, current_user
+
+        self.profileStore = ProfileStore()
+        self.user = current_user()
+        self.camera = camera_key(self.webcam, self.cameraIndex)
+        self.profile = self.profileStore.load(
+            self.user, self.camera, self.screenWidth, self.screenHeight
+        )
+        # e.g. the Haar detector's pupil threshold for this user and lighting
+        if self.profile is not None and hasattr(self.gaze, "load_settings"):
+            self.gaze.load_settings(self.profile.get("detector"))
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def ok(self):
+        return self.ready.is_set() and not self.errors
@@ -0,0 +1,98 @@
+"""
+Sends the tracker's stage latencies to the webapp's /telemetry endpoint.
+
+Every period seconds TelemetryReporter takes the StageProfiler's histograms
+of that interval; every batchSize reports it posts them as one gzipped JSON
+batch. Batches that fail to send are kept (up to maxPending reports) and go
+out with the next one, so a server restart loses nothing.
+"""
+
+import gzip
+import json
+import socket
+import threading
+import time
+import urllib.request
+
+
+class TelemetryReporter:
+    def __init__(
+        self,
+        profiler,
+        url,
+        period=10.0,
+        batchSize=6,
+        maxPending=360,
+        host=None,
+        timeout=5.0,
+    ):
+        self.profiler = profiler
+        self.url = url
+        self.period = period
+        self.batchSize = batchSize
+        self.maxPending = maxPending
+        self.host = host or socket.gethostname()
+        self.timeout = timeout
+
+        self.pending = []
+        self.sent = 0
+        self.failures = 0
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # the profiler only keeps interval histograms once take() is called
+        self.profiler.enabled = True
+        self.profiler.take()
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the thread and sends what is left.
+        """
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.timeout + 1)
+            self.thread = None
+        self.collect()
+        self.flush()
+
+    def run(self):
+        while not self.stopEvent.wait(self.period):
+            self.collect()
+            if len(self.pending) >= self.batchSize:
+                self.flush()
+
+    def collect(self):
+        stages = {
+            stage: histogram.export()
+            for stage, histogram in self.profiler.take().items()
+            if histogram.count
+        }
+        if stages:
+            self.pending.append({"t": time.time(), "stages": stages})
+            # drop the oldest reports while the server is unreachable
+            del self.pending[: -self.maxPending]
+
+    def flush(self):
+        if not self.pending:
+            return True
+        batch = {"host": self.host, "reports": self.pending}
+        request = urllib.request.Request(
+            self.url,
+            data=gzip.compress(json.dumps(batch).encode()),
+            headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except OSError as e:
+            self.failures += 1
+            print(f"telemetry: {e}")
+            return False
+        self.sent += len(batch["reports"])
+        self.pending = []
+        return True
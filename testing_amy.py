@@ -1,6 +1,7 @@
 import cv2
 import pyautogui
 import numpy as np
+from filters import MovingAverageFilter
 
 
 class MouseController:
@@ -20,9 +21,8 @@ class MouseController:
         cellHeight = 30
         gridWidth = width // cellWidth
         gridHeight = height // cellHeight
-        xpositions = []
-        ypositions = []
         avg_frames = 5  # Number of frames to average over
+        smoother = MovingAverageFilter(avg_frames)
 
         # low pass filter
         controlMouse = True
@@ -41,9 +41,7 @@ class MouseController:
                     (left_pupil[0] + right_pupil[0]) / 2,
                     (left_pupil[1] + right_pupil[1]) / 2,
                 ]
-                smoothedavg = self.smooth_eye_position(
-                    eyegaze, xpositions, ypositions, avg_frames
-                )
+                smoothedavg = smoother.update(eyegaze[0], eyegaze[1])
                 if updateNow > 1:
 
                     xPixel = (
@@ -79,12 +77,3 @@ class MouseController:
 
         webcam.release()
         cv2.destroyAllWindows()
-
-    def smooth_eye_position(self, new_position, xlist, ylist, frameAvg):
-        xlist.append(new_position[0])
-        if len(xlist) > frameAvg:
-            xlist.pop(0)
-        ylist.append(new_position[1])
-        if len(ylist) > frameAvg:
-            ylist.pop(0)
-        return [np.mean(xlist), np.mean(ylist)]
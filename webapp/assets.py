@@ -0,0 +1,151 @@
+"""
+In-memory cache for the webapp's static pages.
+
+Each asset is read once at startup together with its gzip and (if the brotli
+package is installed) brotli encodings, so a request costs no disk read or
+compression. Files are re-read when their size or mtime changes, checked at
+most every checkInterval seconds. Responses carry an ETag per encoding and
+Last-Modified, and conditional requests get 304 Not Modified.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+
+from flask import Response
+from werkzeug.http import http_date, parse_date, quote_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Asset:
+    """
+    One file's bytes and its compressed variants, keyed by content coding.
+    """
+
+    def __init__(self, path, cacheControl="no-cache"):
+        self.path = path
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.modified = stat.st_mtime
+        with open(path, "rb") as f:
+            data = f.read()
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+
+        self.bodies = {"identity": data}
+        # mtime=0 keeps the gzip bytes, and so the ETag, stable across reloads
+        compressed = {"gzip": gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(data, quality=11)
+        for coding, body in compressed.items():
+            # tiny files can grow when compressed
+            if len(body) < len(data):
+                self.bodies[coding] = body
+
+        # the headers of every variant, built once instead of per request
+        lastModified = http_date(stat.st_mtime)
+        self.headers = {}
+        for coding in self.bodies:
+            etag = self.digest if coding == "identity" else f"{self.digest}-{coding}"
+            headers = [
+                ("ETag", quote_etag(etag)),
+                ("Last-Modified", lastModified),
+                ("Cache-Control", cacheControl),
+                ("Vary", "Accept-Encoding"),
+            ]
+            if coding != "identity":
+                headers.append(("Content-Encoding", coding))
+            self.headers[coding] = (etag, headers)
+
+    def choose(self, request):
+        """
+        The smallest encoding we have that the request accepts.
+        """
+        header = request.headers.get("Accept-Encoding", "")
+        if not header:
+            return "identity"
+        if ";" in header:
+            # q-values, let werkzeug parse them
+            accepted = request.accept_encodings
+            accepts = lambda coding: accepted.quality(coding) > 0  # noqa: E731
+        else:
+            tokens = {token.strip() for token in header.split(",")}
+            accepts = lambda coding: coding in tokens or "*" in tokens  # noqa: E731
+        for coding in sorted(self.bodies, key=lambda c: len(self.bodies[c])):
+            if coding == "identity" or accepts(coding):
+                return coding
+        return "identity"
+
+    def not_modified(self, request, etag):
+        """
+        Whether the request's validators match: If-None-Match if sent,
+        otherwise If-Modified-Since.
+        """
+        match = request.headers.get("If-None-Match")
+        if match is not None:
+            if match.strip() == "*":
+                return True
+            # weak comparison, as RFC 9110 asks for If-None-Match
+            tags = (
+                tag.strip().removeprefix("W/").strip('"') for tag in match.split(",")
+            )
+            return etag in tags
+        since = request.headers.get("If-Modified-Since")
+        if since is None:
+            return False
+        since = parse_date(since)
+        return since is not None and int(self.modified) <= since.timestamp()
+
+
+class AssetCache:
+    """
+    Serves files from root out of memory. names are loaded at startup, other
+    files the first time they are requested.
+    """
+
+    def __init__(self, root, names=(), checkInterval=1.0, cacheControl="no-cache"):
+        self.root = root
+        self.checkInterval = checkInterval
+        self.cacheControl = cacheControl
+        self.lock = threading.Lock()
+        self.assets = {}
+        self.checked = {}
+        for name in names:
+            self.get(name)
+
+    def get(self, name):
+        """
+        Returns the Asset for name, reloading it if the file changed.
+        """
+        now = time.monotonic()
+        asset = self.assets.get(name)
+        if asset is not None and now - self.checked[name] < self.checkInterval:
+            return asset
+        path = os.path.join(self.root, name)
+        with self.lock:
+            asset = self.assets.get(name)
+            stat = os.stat(path)
+            if asset is None or asset.signature != (stat.st_mtime_ns, stat.st_size):
+                asset = Asset(path, self.cacheControl)
+                self.assets[name] = asset
+            self.checked[name] = now
+        return asset
+
+    def respond(self, name, request):
+        """
+        A Response for name negotiated against request's Accept-Encoding,
+        or 304 if the client's copy is current.
+        """
+        asset = self.get(name)
+        coding = asset.choose(request)
+        etag, headers = asset.headers[coding]
+        if asset.not_modified(request, etag):
+            return Response(status=304, headers=headers)
+        return Response(asset.bodies[coding], headers=headers, mimetype=asset.mimetype)
@@ -0,0 +1,160 @@
+"""
+Local load test for the webapp's index page.
+
+Starts the old handler (open("webpage.html").read() per request) and the
+cached one from main.py on local ports, then runs the same keep-alive
+client load against each: plain requests, gzip requests, and conditional
+requests that repeat the first response's ETag.
+
+Usage:
+    python load_test.py
+    python load_test.py --requests 5000 --concurrency 8
+    python load_test.py --url http://localhost:5000/     # e.g. under uwsgi
+"""
+
+import argparse
+import http.client
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+from flask import Flask
+from werkzeug.serving import make_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name -> request headers, and whether to send the ETag back
+MODES = {
+    "plain": ({}, False),
+    "gzip": ({"Accept-Encoding": "gzip, br"}, False),
+    "conditional": ({"Accept-Encoding": "gzip, br"}, True),
+}
+
+
+def baseline_app():
+    """
+    The index handler as it was before the asset cache.
+    """
+    app = Flask("baseline")
+
+    @app.route("/")
+    def index():
+        return open(os.path.join(HERE, "webpage.html")).read()
+
+    return app
+
+
+def serve(app):
+    """
+    Serves app on a free local port from a background thread.
+    """
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+def fetch(connection, path, headers):
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    return response.status, response.getheader("ETag"), len(body)
+
+
+def run_load(url, headers, conditional, requests, concurrency):
+    """
+    Returns requests/sec, the status counts and mean body bytes.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if conditional:
+        connection = http.client.HTTPConnection(parts.netloc)
+        _, etag, _ = fetch(connection, path, headers)
+        connection.close()
+        if etag:
+            headers = dict(headers, **{"If-None-Match": etag})
+
+    statuses = {}
+    sizes = []
+    lock = threading.Lock()
+
+    def client(count):
+        connection = http.client.HTTPConnection(parts.netloc)
+        local = {}
+        total = 0
+        for _ in range(count):
+            status, _, size = fetch(connection, path, headers)
+            local[status] = local.get(status, 0) + 1
+            total += size
+        connection.close()
+        with lock:
+            for status, n in local.items():
+                statuses[status] = statuses.get(status, 0) + n
+            sizes.append(total)
+
+    share = requests // concurrency
+    threads = [
+        threading.Thread(target=client, args=(share,)) for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done = share * concurrency
+    return done / elapsed, statuses, sum(sizes) / done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--rounds", type=int, default=3, help="alternate the servers, keep the best"
+    )
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--url", help="load a running server instead")
+    args = parser.parse_args()
+
+    if args.url:
+        targets = [("server", args.url)]
+        servers = []
+    else:
+        from main import app
+
+        # one log line per request would be most of the work
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+        servers = []
+        targets = []
+        for name, target in (("before", baseline_app()), ("after", app)):
+            server, url = serve(target)
+            servers.append(server)
+            targets.append((name, url))
+
+    # client and server share the machine, so interleave the runs to spread
+    # out background noise and report each one's best round
+    best = {}
+    for _ in range(args.rounds):
+        for mode in args.modes:
+            headers, conditional = MODES[mode]
+            for name, url in targets:
+                result = run_load(
+                    url, headers, conditional, args.requests, args.concurrency
+                )
+                if (name, mode) not in best or result[0] > best[name, mode][0]:
+                    best[name, mode] = result
+
+    print(f"{'server':8s} {'mode':12s} {'req/s':>8s} {'bytes':>7s}  statuses")
+    for name, _ in targets:
+        for mode in args.modes:
+            rate, statuses, size = best[name, mode]
+            print(f"{name:8s} {mode:12s} {rate:8.0f} {size:7.0f}  {statuses}")
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,60 @@
-from flask import Flask, send_file, render_template
+import os
+
+from flask import Flask, request
+
+from assets import AssetCache
+from releases import ReleaseStore
+from telemetry import TelemetryStore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
 
 app = Flask(__name__)
 
+# loaded once per worker, revalidated by clients with ETag / Last-Modified
+pages = AssetCache(HERE, ["webpage.html"])
+
+# downloadable builds, hashed once when the app loads
+releases = ReleaseStore(HERE, ["test_file.txt"])
+
+# latency histograms posted by the trackers
+telemetry = TelemetryStore(
+    os.environ.get("TELEMETRY_DIR", os.path.join(HERE, "telemetry"))
+)
+# nothing posted is larger than a telemetry batch
+app.config["MAX_CONTENT_LENGTH"] = telemetry.maxBatchBytes
+
 
 @app.route("/")
 def index():
-    return open("webpage.html").read()
+    return pages.respond("webpage.html", request)
 
 
 @app.route("/download")
 def download_file():
-    # Replace 'yourfile.exe' with the path to your actual file
-    return send_file("test_file.txt", as_attachment=True)
+    # Replace 'yourfile.exe' with the name of your actual file in releases
+    return releases.respond("test_file.txt")
+
+
+@app.route("/releases/manifest.json")
+def release_manifest():
+    return releases.respond_manifest(request)
+
+
+@app.route("/releases/<name>")
+def release_file(name):
+    return releases.respond(name)
+
+
+@app.route("/telemetry", methods=["POST"])
+def telemetry_ingest():
+    return telemetry.respond_ingest(request)
+
+
+@app.route("/telemetry", methods=["GET"])
+def telemetry_query():
+    # ?stage=refresh&since=...&until=...&host=...&step=300&p=50,99, or
+    # without stage a per host and fleet summary
+    return telemetry.respond_query(request)
 
 
 if __name__ == "__main__":
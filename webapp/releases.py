@@ -0,0 +1,145 @@
+"""
+Release artifacts for download, with a checksum manifest.
+
+Each artifact's SHA-256 is computed once, when it is first loaded (before
+uwsgi forks its workers), and again only when the file's size or mtime
+changes. The digest is the artifact's strong ETag, so Range requests with
+If-Range resume safely across a rebuild, and it is sent as Repr-Digest for
+clients to verify the whole file against.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import Response, abort, send_file
+
+
+class Artifact:
+    def __init__(self, path, chunkSize=1 << 20):
+        self.path = path
+        self.name = os.path.basename(path)
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.size = stat.st_size
+        self.modified = stat.st_mtime
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunkSize), b""):
+                digest.update(chunk)
+        self.sha256 = digest.hexdigest()
+        # RFC 9530 structured field: the base64 digest between colons
+        self.reprDigest = f"sha-256=:{base64.b64encode(digest.digest()).decode()}:"
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "size": self.size,
+            "sha256": self.sha256,
+            "modified": int(self.modified),
+        }
+
+
+class ReleaseStore:
+    """
+    The artifacts names in root. Downloads recheck the file before serving
+    it, so the ETag always matches the bytes sent; the manifest rechecks at
+    most every checkInterval seconds. Downloads may be cached for maxAge
+    seconds.
+    """
+
+    def __init__(self, root, names, checkInterval=1.0, maxAge=300):
+        self.root = root
+        self.names = list(names)
+        self.checkInterval = checkInterval
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.artifacts = {}
+        self.checked = {}
+        self.manifestBody = None
+        self.manifestKey = None
+        for name in self.names:
+            self.get(name)
+
+    def get(self, name, recheck=False):
+        """
+        The Artifact for name, rehashed if the file changed, or None. The
+        file is only stat'ed again after checkInterval, or with recheck.
+        """
+        if name not in self.names:
+            return None
+        now = time.monotonic()
+        artifact = self.artifacts.get(name)
+        if (
+            artifact is not None
+            and not recheck
+            and now - self.checked[name] < self.checkInterval
+        ):
+            return artifact
+        path = os.path.join(self.root, name)
+        with self.lock:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.artifacts.pop(name, None)
+                return None
+            artifact = self.artifacts.get(name)
+            if artifact is None or artifact.signature != (
+                stat.st_mtime_ns,
+                stat.st_size,
+            ):
+                artifact = Artifact(path)
+                self.artifacts[name] = artifact
+            self.checked[name] = now
+        return artifact
+
+    def manifest(self):
+        """
+        The manifest JSON bytes, rebuilt only when an artifact changed.
+        """
+        artifacts = [a for a in (self.get(name) for name in self.names) if a]
+        # the size and mtime in it change without the digest changing
+        key = tuple((a.name, a.signature, a.sha256) for a in artifacts)
+        if key != self.manifestKey:
+            body = {
+                "artifacts": [
+                    dict(a.describe(), url=f"/releases/{a.name}") for a in artifacts
+                ]
+            }
+            self.manifestBody = json.dumps(body, indent=2).encode()
+            self.manifestKey = key
+        return self.manifestBody
+
+    def respond_manifest(self, request):
+        body = self.manifest()
+        response = Response(body, mimetype="application/json")
+        response.set_etag(hashlib.sha256(body).hexdigest()[:32])
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+
+    def respond(self, name, asAttachment=True):
+        """
+        Streams the artifact from disk in chunks (wsgi.file_wrapper, i.e.
+        sendfile under uwsgi), honouring Range, If-Range, If-None-Match and
+        If-Modified-Since.
+        """
+        # a rebuild within checkInterval would otherwise be sent with the
+        # old ETag, and a stale If-Range would resume across it
+        artifact = self.get(name, recheck=True)
+        if artifact is None:
+            abort(404)
+        response = send_file(
+            artifact.path,
+            as_attachment=asAttachment,
+            download_name=artifact.name,
+            conditional=True,
+            etag=artifact.sha256,
+            last_modified=artifact.modified,
+            max_age=self.maxAge,
+        )
+        # describes the whole file, so it also holds for 206 responses
+        response.headers["Repr-Digest"] = artifact.reprDigest
+        return response
@@ -0,0 +1,515 @@
+"""
+Fleet telemetry: stage latency histograms from the trackers.
+
+Trackers post gzipped JSON batches of reports (see telemetry_reporter.py in
+the tracker), each a timestamp and one sparse log-linear histogram per stage
+with the buckets of instrumentation.LatencyHistogram:
+
+    {"host": "lab-3", "reports": [{"t": 1700000000.0, "stages": {"refresh":
+        {"subBits": 7, "count": 300, "total_us": 9000000, "max_us": 61000,
+         "bins": [[1234, 12], ...]}}}]}
+
+Every batch is appended as a zlib block of packed binary records to a raw
+log (one file per UTC day) and merged into pre-aggregated buckets in sqlite:
+per five minutes (kept a week), per hour (kept a month) and per day (kept
+400 days), per host and for the whole fleet. Histograms merge exactly, so queries read a few hundred
+bucket rows at most and never rescan the raw log. The raw log is only read to
+rebuild the buckets:
+
+    python telemetry.py rebuild /data
+"""
+
+import gzip
+import io
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+from flask import abort, jsonify
+
+SUB_BITS = 7
+# bucket seconds -> how long those buckets are kept
+RESOLUTIONS = {300: 7 * 86400, 3600: 30 * 86400, 86400: 400 * 86400}
+FLEET = "*"
+
+HEADER = struct.Struct("<dQQQH")
+# 64 bit counts, fleet buckets sum the bins of every host
+BIN = struct.Struct("<HQ")
+MAX_INDEX = (1 << 16) - 1
+MAX_BIN = (1 << 32) - 1
+MAX_U64 = (1 << 64) - 1
+# query times are epoch seconds that sqlite and a float both hold exactly
+MAX_TIME = 1 << 53
+# raw log block: compressed length, then a zlib block of one batch's records
+BLOCK = struct.Struct("<I")
+
+
+def checked(value, maximum, what):
+    """
+    value as an int, ValueError unless 0 <= value <= maximum.
+    """
+    value = int(value)
+    if not 0 <= value <= maximum:
+        raise ValueError(f"{what} out of range")
+    return value
+
+
+def checked_time(value, what):
+    """
+    value as a float, ValueError unless it is a time between 0 and MAX_TIME.
+    """
+    value = float(value)
+    # also false for nan
+    if not 0 <= value < MAX_TIME:
+        raise ValueError(f"{what} out of range")
+    return value
+
+
+def bucket_value(index, subBits=SUB_BITS):
+    """
+    Lower bound in microseconds of a LatencyHistogram bucket.
+    """
+    subCount = 1 << subBits
+    if index < subCount:
+        return index
+    half = subCount >> 1
+    shift = index // half - 1
+    return (index - shift * half) << shift
+
+
+class Histogram:
+    """
+    Sparse mergeable latency histogram.
+    """
+
+    def __init__(self, bins=None, count=0, total=0, maximum=0):
+        self.bins = bins or {}
+        self.count = count
+        self.total = total
+        self.max = maximum
+
+    @classmethod
+    def from_report(cls, data):
+        if data.get("subBits", SUB_BITS) != SUB_BITS:
+            raise ValueError(f"only subBits={SUB_BITS} histograms are accepted")
+        bins = {}
+        for index, n in data["bins"]:
+            index = checked(index, MAX_INDEX, "histogram bin index")
+            bins[index] = bins.get(index, 0) + checked(n, MAX_BIN, "histogram bin")
+        return cls(
+            bins,
+            checked(data["count"], MAX_U64, "count"),
+            checked(data["total_us"], MAX_U64, "total_us"),
+            checked(data["max_us"], MAX_U64, "max_us"),
+        )
+
+    def merge(self, other):
+        if self.bins:
+            for index, n in other.bins.items():
+                self.bins[index] = self.bins.get(index, 0) + n
+        else:
+            self.bins = dict(other.bins)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def pack(self, t=0.0):
+        # merged totals saturate rather than overflow the record
+        bins = sorted(self.bins.items())
+        header = HEADER.pack(
+            t,
+            min(self.count, MAX_U64),
+            min(self.total, MAX_U64),
+            min(self.max, MAX_U64),
+            len(bins),
+        )
+        return header + b"".join(BIN.pack(index, min(n, MAX_U64)) for index, n in bins)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        """
+        Returns (t, histogram, next offset).
+        """
+        t, count, total, maximum, n = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        bins = dict(BIN.iter_unpack(data[offset : offset + n * BIN.size]))
+        return t, cls(bins, count, total, maximum), offset + n * BIN.size
+
+    def percentile(self, p):
+        """
+        The p-th percentile in milliseconds, as LatencyHistogram computes it.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(p / 100 * self.count)))
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen >= rank:
+                return min(bucket_value(index), self.max) / 1000
+        return self.max / 1000
+
+    def summary(self, percentiles=(50, 90, 99)):
+        result = {
+            "count": self.count,
+            "mean_ms": self.total / self.count / 1000 if self.count else 0.0,
+            "max_ms": self.max / 1000,
+        }
+        for p in percentiles:
+            result[f"p{p:g}_ms"] = self.percentile(p)
+        return result
+
+
+def pack_name(name):
+    data = name.encode("utf-8")[:255]
+    return bytes([len(data)]) + data
+
+
+def add_to_buckets(updates, host, stage, t, histogram):
+    """
+    Merges one report's histogram into the bucket updates of a batch.
+    """
+    for resolution in RESOLUTIONS:
+        start = int(t // resolution * resolution)
+        for who in (host, FLEET):
+            updates.setdefault((resolution, who, stage, start), Histogram()).merge(
+                histogram
+            )
+
+
+def cover(since, until, resolutions):
+    """
+    Splits [since, until) into (resolution, start, end) spans of whole
+    buckets, coarsest in the middle and finer toward the edges. The finest
+    level also takes the partial buckets at the ends.
+    """
+    resolution = resolutions[0]
+    if len(resolutions) == 1:
+        return [(resolution, since // resolution * resolution, until)]
+    first = -(-since // resolution) * resolution
+    last = until // resolution * resolution
+    if first >= last:
+        return cover(since, until, resolutions[1:])
+    spans = [(resolution, first, last)]
+    if since < first:
+        spans = cover(since, first, resolutions[1:]) + spans
+    if last < until:
+        spans += cover(last, until, resolutions[1:])
+    return spans
+
+
+def iter_raw(path):
+    """
+    Yields (host, stage, t, histogram) from a raw log file, one block in
+    memory at a time.
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(BLOCK.size)
+            if len(header) < BLOCK.size:
+                return
+            data = zlib.decompress(f.read(BLOCK.unpack(header)[0]))
+            offset = 0
+            while offset < len(data):
+                names = []
+                for _ in range(2):
+                    length = data[offset]
+                    name = data[offset + 1 : offset + 1 + length]
+                    names.append(name.decode("utf-8", "replace"))
+                    offset += 1 + length
+                t, histogram, offset = Histogram.unpack(data, offset)
+                yield names[0], names[1], t, histogram
+
+
+class TelemetryStore:
+    """
+    Raw log and bucket database in root. Safe to share between uwsgi
+    workers: raw batches are appended with one O_APPEND write and bucket
+    updates are sqlite transactions.
+    """
+
+    def __init__(
+        self, root, maxBatchBytes=4 << 20, maxReports=1000, rawDays=7, maxSkew=86400
+    ):
+        self.root = root
+        self.maxBatchBytes = maxBatchBytes
+        self.maxReports = maxReports
+        self.rawDays = rawDays
+        # how far ahead of the server clock a tracker's report may be
+        self.maxSkew = maxSkew
+        self.local = threading.local()
+        self.pruned = 0.0
+        os.makedirs(os.path.join(root, "raw"), exist_ok=True)
+        # create the schema now, the workers connect on their first request
+        self.connection().close()
+        self.local.db = None
+
+    def connection(self):
+        # sqlite connections don't survive a fork, so one per process and thread
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(os.path.join(self.root, "buckets.db"), timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "resolution INTEGER, start INTEGER, host TEXT, stage TEXT, "
+                "hist BLOB, PRIMARY KEY (resolution, host, stage, start))"
+            )
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def ingest(self, batch):
+        """
+        Stores a decoded batch. Returns the number of reports taken.
+
+        Reports older than the longest retention or more than maxSkew in the
+        future are refused: they would be pruned right away or never, and
+        out of range times can't be stored as buckets.
+        """
+        host = str(batch.get("host") or "unknown")[:255]
+        if host == FLEET:
+            raise ValueError(f"{FLEET!r} is reserved for the fleet totals")
+        reports = batch.get("reports")
+        if not isinstance(reports, list) or len(reports) > self.maxReports:
+            raise ValueError(f"reports must be a list of at most {self.maxReports}")
+
+        now = time.time()
+        oldest = now - max(RESOLUTIONS.values())
+        raw = []
+        updates = {}
+        for report in reports:
+            t = float(report["t"])
+            # also false for nan
+            if not oldest <= t <= now + self.maxSkew:
+                raise ValueError(f"t={t} is not a recent timestamp")
+            for stage, data in report["stages"].items():
+                stage = str(stage)[:255]
+                histogram = Histogram.from_report(data)
+                raw.append(pack_name(host) + pack_name(stage) + histogram.pack(t))
+                add_to_buckets(updates, host, stage, t, histogram)
+        if not raw:
+            return 0
+
+        # the raw log only gets what the buckets took, a record that failed
+        # to merge would break every rebuild
+        self.merge(updates)
+        day = time.strftime("%Y%m%d", time.gmtime(now))
+        fd = os.open(
+            os.path.join(self.root, "raw", f"{day}.bin"),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+            0o644,
+        )
+        try:
+            block = zlib.compress(b"".join(raw))
+            os.write(fd, BLOCK.pack(len(block)) + block)
+        finally:
+            os.close(fd)
+        self.prune()
+        return len(reports)
+
+    def merge(self, updates):
+        db = self.connection()
+        with db:
+            # take the write lock up front so two workers can't both read
+            # a bucket and then overwrite each other's merge
+            db.execute("BEGIN IMMEDIATE")
+            for key, histogram in updates.items():
+                row = db.execute(
+                    "SELECT hist FROM buckets "
+                    "WHERE resolution=? AND host=? AND stage=? AND start=?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    histogram.merge(Histogram.unpack(zlib.decompress(row[0]))[1])
+                db.execute(
+                    "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?, ?)",
+                    (key[0], key[3], key[1], key[2], zlib.compress(histogram.pack())),
+                )
+
+    def prune(self, now=None, force=False):
+        """
+        Drops buckets past their retention and raw logs older than rawDays,
+        at most once an hour.
+        """
+        now = time.time() if now is None else now
+        if now - self.pruned < 3600 and not force:
+            return
+        self.pruned = now
+        db = self.connection()
+        with db:
+            for resolution, keep in RESOLUTIONS.items():
+                db.execute(
+                    "DELETE FROM buckets WHERE resolution=? AND start<?",
+                    (resolution, now - keep),
+                )
+        oldest = time.strftime("%Y%m%d", time.gmtime(now - self.rawDays * 86400))
+        rawDir = os.path.join(self.root, "raw")
+        for name in os.listdir(rawDir):
+            if name < oldest:
+                os.remove(os.path.join(rawDir, name))
+
+    def buckets(self, since, until, step=None, **match):
+        """
+        Yields (host, stage, start, histogram) for the fewest buckets that
+        cover [since, until), no coarser than step if given. match filters
+        on host and stage.
+        """
+        resolutions = sorted(
+            (r for r in RESOLUTIONS if step is None or step % r == 0), reverse=True
+        )
+        if not resolutions:
+            raise ValueError(f"step must be a multiple of {min(RESOLUTIONS)}")
+        where = "".join(f" AND {column}=?" for column in match)
+        db = self.connection()
+        for resolution, start, end in cover(int(since), int(until), resolutions):
+            rows = db.execute(
+                "SELECT host, stage, start, hist FROM buckets WHERE resolution=? "
+                "AND start>=? AND start<?" + where,
+                (resolution, start, end, *match.values()),
+            )
+            for host, stage, bucketStart, blob in rows:
+                histogram = Histogram.unpack(zlib.decompress(blob))[1]
+                yield host, stage, bucketStart, histogram
+
+    def query(
+        self, stage, since, until, host=FLEET, step=None, percentiles=(50, 90, 99)
+    ):
+        """
+        Summary of stage between since and until, for one host or the
+        fleet, and a series of step second summaries if step is set.
+        """
+        total = Histogram()
+        series = {}
+        for _, _, start, histogram in self.buckets(
+            since, until, step, host=host, stage=stage
+        ):
+            total.merge(histogram)
+            if step:
+                key = start // step * step
+                series.setdefault(key, Histogram()).merge(histogram)
+        result = {
+            "stage": stage,
+            "host": host,
+            "since": since,
+            "until": until,
+            "summary": total.summary(percentiles),
+        }
+        if step:
+            result["series"] = [
+                dict(h.summary(percentiles), start=start)
+                for start, h in sorted(series.items())
+            ]
+        return result
+
+    def fleet(self, since, until):
+        """
+        Per host and per stage summaries plus the fleet total per stage.
+        """
+        merged = {}
+        lastSeen = {}
+        for host, stage, start, histogram in self.buckets(since, until):
+            merged.setdefault((host, stage), Histogram()).merge(histogram)
+            lastSeen[host] = max(lastSeen.get(host, 0), start)
+        hosts = {}
+        for (host, stage), histogram in sorted(merged.items()):
+            if host != FLEET:
+                hosts.setdefault(host, {"last_seen": lastSeen[host], "stages": {}})
+                hosts[host]["stages"][stage] = histogram.summary()
+        return {
+            "since": since,
+            "until": until,
+            "hosts": hosts,
+            "fleet": {
+                stage: histogram.summary()
+                for (host, stage), histogram in sorted(merged.items())
+                if host == FLEET
+            },
+        }
+
+    def rebuild(self):
+        """
+        Recomputes every bucket from the raw log.
+        """
+        db = self.connection()
+        with db:
+            db.execute("DELETE FROM buckets")
+        rawDir = os.path.join(self.root, "raw")
+        for name in sorted(os.listdir(rawDir)):
+            updates = {}
+            for host, stage, t, histogram in iter_raw(os.path.join(rawDir, name)):
+                add_to_buckets(updates, host, stage, t, histogram)
+                # bounded, a day of raw data doesn't fit in the container
+                if len(updates) > 2000:
+                    self.merge(updates)
+                    updates = {}
+            self.merge(updates)
+        self.prune(force=True)
+
+    def respond_ingest(self, request):
+        """
+        Handles a POSTed batch, gzip or plain JSON.
+        """
+        if request.content_length and request.content_length > self.maxBatchBytes:
+            abort(413)
+        # a chunked body has no Content-Length, so read no more than the limit
+        body = request.stream.read(self.maxBatchBytes + 1)
+        if len(body) > self.maxBatchBytes:
+            abort(413)
+        if request.headers.get("Content-Encoding", "identity") == "gzip":
+            try:
+                with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+                    # stop reading instead of inflating a gzip bomb
+                    body = f.read(self.maxBatchBytes + 1)
+            except (OSError, EOFError):
+                abort(400, "bad gzip body")
+            if len(body) > self.maxBatchBytes:
+                abort(413)
+        try:
+            accepted = self.ingest(json.loads(body))
+        except (
+            ValueError,
+            KeyError,
+            TypeError,
+            AttributeError,
+            OverflowError,
+            struct.error,
+        ) as e:
+            abort(400, f"bad telemetry batch: {e}")
+        return jsonify({"accepted": accepted}), 202
+
+    def respond_query(self, request):
+        args = request.args
+        now = time.time()
+        try:
+            until = checked_time(args.get("until", now), "until")
+            since = checked_time(args.get("since", max(until - 3600, 0)), "since")
+            step = int(args["step"]) if "step" in args else None
+            if step is not None and step <= 0:
+                raise ValueError("step must be positive")
+            percentiles = [float(p) for p in args.get("p", "50,90,99").split(",")]
+            if not all(0 <= p <= 100 for p in percentiles):
+                raise ValueError("percentiles must be between 0 and 100")
+            if "stage" not in args:
+                return jsonify(self.fleet(since, until))
+            result = self.query(
+                args["stage"], since, until, args.get("host", FLEET), step, percentiles
+            )
+        except ValueError as e:
+            abort(400, str(e))
+        return jsonify(result)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Telemetry store maintenance.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("root", help="telemetry directory")
+    args = parser.parse_args()
+    TelemetryStore(args.root).rebuild()
@@ -0,0 +1,134 @@
+"""
+Tests for the release downloads and manifest.
+
+    cd webapp && python -m pytest test_releases.py
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+
+from flask import Flask, request
+
+from releases import ReleaseStore
+
+DATA = bytes(range(256)) * 40
+
+
+class ReleaseTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+        self.write("build.bin", DATA)
+        self.releases = ReleaseStore(self.root, ["build.bin", "missing.bin"])
+
+        app = Flask(__name__)
+        releases = self.releases
+
+        @app.route("/releases/manifest.json")
+        def manifest():
+            return releases.respond_manifest(request)
+
+        @app.route("/releases/<name>")
+        def release(name):
+            return releases.respond(name)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, data, mtime=None):
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def get(self, name="build.bin", **headers):
+        return self.client.get(f"/releases/{name}", headers=headers)
+
+    def test_full_download(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, DATA)
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertIn("attachment", response.headers["Content-Disposition"])
+        self.assertEqual(response.get_etag(), (hashlib.sha256(DATA).hexdigest(), False))
+        self.assertTrue(response.headers["Repr-Digest"].startswith("sha-256=:"))
+
+    def test_range(self):
+        response = self.get(Range="bytes=100-199")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, DATA[100:200])
+        self.assertEqual(
+            response.headers["Content-Range"], f"bytes 100-199/{len(DATA)}"
+        )
+        # the digest describes the whole file, not the part sent
+        self.assertEqual(
+            response.headers["Repr-Digest"], self.get().headers["Repr-Digest"]
+        )
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range=f"bytes={len(DATA) + 10}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["Content-Range"], f"bytes */{len(DATA)}")
+
+    def test_if_range_matching_etag(self):
+        etag = self.get().headers["ETag"]
+        response = self.get(Range="bytes=10-19", **{"If-Range": etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, DATA[10:20])
+
+    def test_if_range_stale_etag(self):
+        etag = self.get().headers["ETag"]
+        rebuilt = DATA[::-1]
+        self.write("build.bin", rebuilt)
+        # within checkInterval, the download must still see the rebuild
+        response = self.get(Range="bytes=10-19", **{"If-Range": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, rebuilt)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_if_none_match(self):
+        etag = self.get().headers["ETag"]
+        response = self.get(**{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_missing_release(self):
+        self.assertEqual(self.get("missing.bin").status_code, 404)
+        self.assertEqual(self.get("unlisted.bin").status_code, 404)
+
+    def test_manifest(self):
+        response = self.client.get("/releases/manifest.json")
+        self.assertEqual(response.status_code, 200)
+        artifacts = json.loads(response.data)["artifacts"]
+        self.assertEqual(len(artifacts), 1)
+        self.assertEqual(artifacts[0]["name"], "build.bin")
+        self.assertEqual(artifacts[0]["size"], len(DATA))
+        self.assertEqual(artifacts[0]["sha256"], hashlib.sha256(DATA).hexdigest())
+        self.assertEqual(artifacts[0]["url"], "/releases/build.bin")
+
+        etag = response.headers["ETag"]
+        again = self.client.get(
+            "/releases/manifest.json", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(again.status_code, 304)
+
+    def test_manifest_follows_mtime(self):
+        etag = self.client.get("/releases/manifest.json").headers["ETag"]
+        # same bytes, so the same digest, but a new modified time
+        self.write("build.bin", DATA, mtime=1000000000)
+        self.releases.checkInterval = 0
+        response = self.client.get(
+            "/releases/manifest.json", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["artifacts"][0]["modified"], 10**9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+Tests for the telemetry ingest and queries.
+
+    cd webapp && python -m pytest test_telemetry.py
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from flask import Flask, request
+
+from telemetry import TelemetryStore
+
+
+def histogram(count=3, bins=((500, 2), (900, 1))):
+    return {
+        "subBits": 7,
+        "count": count,
+        "total_us": 2000,
+        "max_us": 950,
+        "bins": [list(b) for b in bins],
+    }
+
+
+class TelemetryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+        self.telemetry = TelemetryStore(self.root)
+
+        app = Flask(__name__)
+        telemetry = self.telemetry
+
+        @app.route("/telemetry", methods=["POST"])
+        def ingest():
+            return telemetry.respond_ingest(request)
+
+        @app.route("/telemetry", methods=["GET"])
+        def query():
+            return telemetry.respond_query(request)
+
+        self.client = app.test_client()
+        self.now = time.time()
+
+    def tearDown(self):
+        self.telemetry.connection().close()
+        self.dir.cleanup()
+
+    def post(self, t=None, stages=None, host="lab-3", gzipped=False):
+        batch = {
+            "host": host,
+            "reports": [
+                {
+                    "t": self.now if t is None else t,
+                    "stages": stages or {"refresh": histogram()},
+                }
+            ],
+        }
+        body = json.dumps(batch).encode()
+        headers = {}
+        if gzipped:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        return self.client.post("/telemetry", data=body, headers=headers)
+
+    def raw_size(self):
+        rawDir = os.path.join(self.root, "raw")
+        return sum(os.path.getsize(os.path.join(rawDir, n)) for n in os.listdir(rawDir))
+
+    def summary(self, **args):
+        args.setdefault("stage", "refresh")
+        response = self.client.get("/telemetry", query_string=args)
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_ingest_and_query(self):
+        self.assertEqual(self.post().status_code, 202)
+        self.assertEqual(self.post(gzipped=True).status_code, 202)
+        result = self.summary()
+        self.assertEqual(result["summary"]["count"], 6)
+        self.assertEqual(result["summary"]["max_ms"], 0.95)
+        self.assertEqual(self.summary(host="lab-3")["summary"]["count"], 6)
+
+        fleet = self.client.get("/telemetry").json
+        self.assertEqual(fleet["fleet"]["refresh"]["count"], 6)
+        self.assertIn("lab-3", fleet["hosts"])
+
+    def test_step_series(self):
+        self.post(t=self.now - 600)
+        self.post()
+        result = self.summary(since=self.now - 3600, until=self.now + 1, step=300)
+        self.assertEqual(sum(s["count"] for s in result["series"]), 6)
+
+    def test_rejected_records(self):
+        for t in (1e300, -1, self.now + 10 * 86400, "nan", "inf"):
+            self.assertEqual(self.post(t=t).status_code, 400, t)
+        self.assertEqual(self.post(host="*").status_code, 400)
+        for stage in (
+            histogram(bins=((500, 1 << 32),)),
+            histogram(count=-1),
+            histogram(count=1 << 64),
+            histogram(bins=((1 << 16, 1),)),
+        ):
+            self.assertEqual(self.post(stages={"refresh": stage}).status_code, 400)
+        # nothing was logged, so a rebuild still works and finds nothing
+        self.assertEqual(self.raw_size(), 0)
+        self.telemetry.rebuild()
+        self.assertEqual(self.summary()["summary"]["count"], 0)
+
+    def test_rebuild(self):
+        self.post()
+        self.post(t=self.now - 7200)
+        self.telemetry.rebuild()
+        result = self.summary(since=self.now - 3 * 3600, until=self.now + 1)
+        self.assertEqual(result["summary"]["count"], 6)
+
+    def test_bad_queries(self):
+        for args in (
+            {"since": "nan"},
+            {"until": "inf"},
+            {"since": "1e30"},
+            {"until": "-5"},
+            {"since": "abc"},
+            {"step": "0"},
+            {"step": "-300"},
+            {"p": "nan"},
+            {"p": "150"},
+        ):
+            for stage in ({}, {"stage": "refresh"}):
+                response = self.client.get("/telemetry", query_string={**args, **stage})
+                self.assertEqual(response.status_code, 400, (args, stage))
+        # only a stage query has a series to step through
+        response = self.client.get("/telemetry?stage=refresh&step=7")
+        self.assertEqual(response.status_code, 400)
+
+    def test_too_large(self):
+        self.telemetry.maxBatchBytes = 100
+        self.assertEqual(self.post().status_code, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()